@@ -4,8 +4,11 @@ import threading
 import jieba
 from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+import json_codec  # QuickForm/json_codec.py，由 main.py 加入 sys.path
+from http_client_service import PROVIDER_URLS  # QuickForm/http_client_service.py
+from ai_gateway_service import ai_gateway  # QuickForm/ai_gateway_service.py，事件循环线程中发送上游请求
+from ai_admission_service import ai_admission, AdmissionRejected, estimate_tokens, usage_tokens, retry_after_seconds  # 与QuickForm共用按密钥的准入控制
 
 chat_server_bp = Blueprint(
     'chat_server',
@@ -69,24 +72,31 @@ def api_chat():
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
         return response, 500
 
+    ip = request.headers.get('X-Forwarded-For', '').split(',')[0].strip() or request.remote_addr
     try:
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {api_token}'
         }
-        # 带重试的 Session，提高调用稳定性
-        session = requests.Session()
-        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["POST"]) 
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        # 分离连接/读取超时
-        resp = session.post(api_url, json={'messages': messages}, headers=headers, timeout=(5, 60))
-        try:
-            data = resp.json()
-        except ValueError:
-            data = {'error': '上游返回非JSON响应', 'raw': (resp.text[:500] if resp.text else '')}
-        return jsonify(data), resp.status_code
+        # 按密钥排队放行，超过上游限额时返回503和预计等待时间；
+        # 与学生提问（on_ask）和教师的分析报告共用 CHAT_SERVER_API_TOKEN，按同一个服务商名称排队，共享一份限额
+        with ai_admission.admit('siliconflow', api_token, ip, estimate_tokens({'messages': messages})) as ticket:
+            # 由AI请求网关发送（keep-alive，带重试），分离连接/读取超时；HTTP接口需要同步返回，这里等待结果
+            resp = ai_gateway.post('chat_server', api_url, data=json_codec.dumps_bytes({'messages': messages}), headers=headers, timeout=(5, 60)).result()
+            if resp.status_code == 429:
+                ticket.throttled(retry_after_seconds(resp))
+            try:
+                # 只校验上游返回的是合法JSON，响应体原样转发，不重新编码
+                result = json_codec.loads(resp.content)
+            except ValueError:
+                data = {'error': '上游返回非JSON响应', 'raw': (resp.text[:500] if resp.text else '')}
+                return jsonify(data), resp.status_code
+            ticket.settle(usage_tokens(result))
+        return json_codec.raw_json_response(resp.content, status=resp.status_code)
+    except AdmissionRejected as e:
+        response = jsonify({'error': str(e), 'eta': e.eta})
+        response.headers['Retry-After'] = str(e.eta or 30)
+        return response, 503
     except requests.Timeout as e:
         response = jsonify({'error': '上游超时', 'message': str(e)})
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
@@ -231,8 +241,7 @@ def register_socketio(socketio):
             emit('bot_stream', {'token': '[END]'})
             return
         try:
-            import requests as _requests
-            url = 'https://api.siliconflow.cn/v1/chat/completions'
+            url = PROVIDER_URLS['siliconflow']
             headers = {
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {api_key}'
@@ -241,21 +250,46 @@ def register_socketio(socketio):
                 'model': use_model,
                 'messages': messages
             }
-            resp = _requests.post(url, headers=headers, json=payload, timeout=(5, 120))
-            if resp.status_code != 200:
-                emit('bot_stream', {'token': f"[API错误 HTTP {resp.status_code}] {resp.text[:200]}"})
-                emit('bot_stream', {'token': '[END]'})
-                return
-            data = resp.json()
-            content = ''
-            if isinstance(data, dict) and data.get('choices'):
-                choice = data['choices'][0]
-                content = (choice.get('message') or {}).get('content') or choice.get('text') or ''
-            if content:
-                emit('bot_stream', {'token': content})
-            else:
-                emit('bot_stream', {'token': '[空响应]'} )
+            # 与教师的分析报告共用同一个密钥的限额：排队时把前面的请求数和预计等待时间推送给学生
+            on_wait = lambda ahead, eta: emit('bot_queue', {'ahead': ahead, 'eta': eta})
+            ticket = ai_admission.admit('siliconflow', headers['Authorization'], ip, estimate_tokens(payload), on_wait=on_wait)
+        except AdmissionRejected as e:
+            emit('bot_stream', {'token': f"[{e}]"})
             emit('bot_stream', {'token': '[END]'})
+            return
+
+        sid = request.sid
+
+        def reply(token):
+            socketio.emit('bot_stream', {'token': token}, to=sid)
+            socketio.emit('bot_stream', {'token': '[END]'}, to=sid)
+
+        def finish(future):
+            # 在AI请求网关的事件循环线程中执行：只解析响应并推送，不做阻塞操作
+            try:
+                resp = future.result()
+                if resp.status_code == 429:
+                    ticket.throttled(retry_after_seconds(resp))
+                if resp.status_code != 200:
+                    reply(f"[API错误 HTTP {resp.status_code}] {resp.text[:200]}")
+                    return
+                data = resp.json()
+                ticket.settle(usage_tokens(data))
+                content = ''
+                if isinstance(data, dict) and data.get('choices'):
+                    choice = data['choices'][0]
+                    content = (choice.get('message') or {}).get('content') or choice.get('text') or ''
+                reply(content or '[空响应]')
+            except Exception as e:
+                reply(f"\n[API错误: {e} ]")
+            finally:
+                ticket.release()
+
+        # 提交后立即返回，等待上游应答期间不占用处理事件的线程
+        try:
+            future = ai_gateway.post('siliconflow', url, headers=headers, json=payload, timeout=(5, 120))
         except Exception as e:
-            emit('bot_stream', {'token': f"\n[API错误: {e} ]"})
-            emit('bot_stream', {'token': '[END]'})
\ No newline at end of file
+            ticket.release()
+            reply(f"\n[API错误: {e} ]")
+            return
+        future.add_done_callback(finish)
@@ -0,0 +1,410 @@
+"""AI调用准入控制 - 按API密钥限制同时进行的请求数、每分钟请求数和估算的每分钟token数
+
+多个教师共用 CHAT_SERVER_API_TOKEN（硅基流动的兜底密钥），ChatServer 的学生提问也使用它；
+突发的请求超过服务商的限额后会收到429。准入控制在发出请求前排队：
+- 每个密钥一个限流器（按服务商+密钥哈希区分，不保存密钥本身；传入密钥或 "Bearer <密钥>" 都对应同一个），
+  限额可按服务商覆盖；
+- 每分钟请求数和每分钟token数用令牌桶实现，token数按提示词长度和 max_tokens 估算，
+  请求完成后按服务商返回的实际用量（没有时按输出长度估算）多退少补；
+- 排队按用户轮转：每个用户的请求先进先出，不同用户轮流放行，一个用户的大量请求不会挡住其他用户；
+- 排队数超过上限或等待超时时拒绝（AdmissionRejected，附带预计等待时间），调用方据此提示用户稍后再试；
+- 收到429时按 Retry-After 暂停该密钥的放行（HTTP层不再对429重试，避免重试放大负载）。
+"""
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+AI_ADMISSION_ENABLED = os.getenv('QUICKFORM_AI_ADMISSION', '1') != '0'
+AI_MAX_IN_FLIGHT = int(os.getenv('QUICKFORM_AI_MAX_IN_FLIGHT', '8'))  # 每个密钥同时进行的请求数
+AI_RPM = int(os.getenv('QUICKFORM_AI_RPM', '60'))  # 每个密钥每分钟请求数
+AI_TPM = int(os.getenv('QUICKFORM_AI_TPM', '100000'))  # 每个密钥每分钟token数（估算）
+AI_MAX_WAITING = int(os.getenv('QUICKFORM_AI_MAX_WAITING', '100'))  # 每个密钥排队的请求数上限
+AI_ADMISSION_TIMEOUT = float(os.getenv('QUICKFORM_AI_ADMISSION_TIMEOUT', '120'))  # 最长排队时间（秒）
+# 按服务商覆盖限额，如 {"siliconflow": {"in_flight": 20, "rpm": 1000, "tpm": 500000}}
+AI_KEY_LIMITS = json_codec.loads(os.getenv('QUICKFORM_AI_KEY_LIMITS', '{}') or '{}')
+AI_THROTTLE_RETRIES = 1  # 收到429后等待 Retry-After 再试的次数
+DEFAULT_RETRY_AFTER = 5  # 429没有 Retry-After 时暂停的秒数
+DEFAULT_COMPLETION_TOKENS = 1000  # 请求没有 max_tokens 时估算的输出token数
+TOKENS_PER_CHAR = 0.75  # 中英文混合文本的估算系数
+MAX_LIMITERS = 1000  # 保留的限流器个数，超出时删除最久未使用的空闲限流器
+WAIT_REPORT_INTERVAL = 1.0  # 排队时回调 on_wait 的间隔（秒）
+
+
+def normalize_api_key(api_key):
+    """去掉 Authorization 头的 "Bearer " 前缀和首尾空白"""
+    api_key = (api_key or '').strip()
+    if api_key[:7].lower() == 'bearer ':
+        api_key = api_key[7:].strip()
+    return api_key
+
+
+class AdmissionRejected(Exception):
+    """排队过多或等待超时；eta 为预计还需等待的秒数"""
+
+    def __init__(self, message, eta=None):
+        super().__init__(message)
+        self.eta = eta
+
+
+def _text_tokens(text):
+    return int(math.ceil(len(text or '') * TOKENS_PER_CHAR))
+
+
+def estimate_tokens(payload, completion=None):
+    """估算一次请求消耗的token数：提示词 + 输出（已知输出文本时按文本估算，否则按 max_tokens）"""
+    messages = payload.get('messages') or (payload.get('input') or {}).get('messages') or []
+    tokens = sum(_text_tokens(message.get('content')) for message in messages if isinstance(message, dict))
+    if completion is not None:
+        return tokens + _text_tokens(completion)
+    params = payload.get('parameters') or payload
+    return tokens + int(params.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+def usage_tokens(result):
+    """从响应JSON中取出实际用量（OpenAI兼容接口为 usage.total_tokens，阿里云百炼为输入+输出），没有时返回None"""
+    usage = result.get('usage') if isinstance(result, dict) else None
+    if not isinstance(usage, dict):
+        return None
+    if usage.get('total_tokens') is not None:
+        return int(usage['total_tokens'])
+    if usage.get('input_tokens') is not None or usage.get('output_tokens') is not None:
+        return int(usage.get('input_tokens') or 0) + int(usage.get('output_tokens') or 0)
+    return None
+
+
+def retry_after_seconds(response, default=DEFAULT_RETRY_AFTER):
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return default
+
+
+class _TokenBucket:
+    """令牌桶：容量为每分钟限额，按每秒 限额/60 补充；余额可以为负（实际用量超过估算时）"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount, now):
+        """余额达到 amount 还需的秒数（amount 超过容量时按容量计算）"""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate else 0.0
+
+    def take(self, amount, now):
+        self.refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def give(self, amount, now):
+        self.refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    """排队中的请求（按对象身份比较，同一用户相同token数的请求互不混淆）"""
+    __slots__ = ('user', 'tokens')
+
+    def __init__(self, user, tokens):
+        self.user = user
+        self.tokens = tokens
+
+
+class AdmissionTicket:
+    """一次已放行的请求；用作上下文管理器，退出时归还并发名额"""
+
+    def __init__(self, limiter, tokens):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.started = time.monotonic()
+        self._released = False
+
+    def settle(self, actual_tokens):
+        """按实际用量修正token桶（估算偏高时退还，偏低时补扣）"""
+        if self.limiter is not None and actual_tokens is not None:
+            self.limiter.adjust(self.tokens - int(actual_tokens))
+            self.tokens = int(actual_tokens)
+
+    def throttled(self, retry_after):
+        """服务商返回429：暂停该密钥的放行"""
+        if self.limiter is not None:
+            self.limiter.throttle(retry_after)
+
+    def release(self):
+        if not self._released and self.limiter is not None:
+            self._released = True
+            self.limiter.release(time.monotonic() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class KeyLimiter:
+    """单个API密钥的准入控制
+
+    Args:
+        name: 显示名称（服务商:密钥哈希前缀）
+        in_flight: 同时进行的请求数上限
+        rpm: 每分钟请求数
+        tpm: 每分钟token数
+        max_waiting: 排队的请求数上限
+    """
+
+    def __init__(self, name, in_flight=AI_MAX_IN_FLIGHT, rpm=AI_RPM, tpm=AI_TPM, max_waiting=AI_MAX_WAITING):
+        self.name = name
+        self.max_in_flight = max(1, int(in_flight))
+        self.max_waiting = max_waiting
+        self._requests = _TokenBucket(max(1, int(rpm)))
+        self._tokens = _TokenBucket(max(1, int(tpm)))
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # 用户 -> deque[等待者]，键的顺序即轮转顺序
+        self._waiting = 0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.avg_duration = None  # 请求耗时的指数移动平均，用于估算等待时间
+        self.last_used = time.monotonic()
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled_count = 0
+        self.total_wait = 0.0
+
+    # ---- 调度（调用方持有锁）----
+
+    def _head(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _ready_in(self, tokens, now):
+        """资源足够放行一个请求还需的秒数；并发已满时返回None（等待有请求结束）"""
+        if self.in_flight >= self.max_in_flight:
+            return None
+        return max(self.blocked_until - now, self._requests.time_until(1, now), self._tokens.time_until(tokens, now), 0.0)
+
+    def _admit(self, tokens, now):
+        self._requests.take(1, now)
+        self._tokens.take(tokens, now)
+        self.in_flight += 1
+        self.admitted += 1
+        self.last_used = now
+
+    def _dequeue(self, waiter):
+        queue = self._queues.get(waiter.user)
+        if not queue or waiter not in queue:
+            return
+        head = queue[0] is waiter
+        queue.remove(waiter)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[waiter.user]
+        elif head:
+            # 该用户的下一个请求排到轮转的末尾
+            self._queues.move_to_end(waiter.user)
+
+    def _position(self, waiter, now):
+        """(前面的请求数, 预计等待秒数)；按用户轮转的顺序计算前面的请求"""
+        users = list(self._queues.keys())
+        my_queue = self._queues[waiter.user]
+        my_index = my_queue.index(waiter)
+        my_turn = users.index(waiter.user)
+        ahead = []
+        for turn, user in enumerate(users):
+            queue = self._queues[user]
+            count = my_index if user == waiter.user else min(len(queue), my_index + (1 if turn < my_turn else 0))
+            ahead.extend(list(queue)[:count])
+        tokens_needed = sum(w.tokens for w in ahead) + waiter.tokens
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        eta = max(
+            self.blocked_until - now,
+            (len(ahead) + 1 - self._requests.tokens) / self._requests.rate,
+            (tokens_needed - self._tokens.tokens) / self._tokens.rate,
+            0.0
+        )
+        free_slots = self.max_in_flight - self.in_flight
+        if len(ahead) + 1 > free_slots and self.avg_duration:
+            rounds = math.ceil((len(ahead) + 1 - free_slots) / self.max_in_flight)
+            eta = max(eta, rounds * self.avg_duration)
+        return len(ahead), int(math.ceil(eta))
+
+    # ---- 接口 ----
+
+    def acquire(self, user, tokens, timeout=AI_ADMISSION_TIMEOUT, on_wait=None, wait=True):
+        """等待放行并返回 AdmissionTicket
+
+        Args:
+            user: 排队时轮转的单位（用户id、IP等）
+            tokens: 估算的token数
+            timeout: 最长排队时间（秒）
+            on_wait: 排队期间每秒调用一次 on_wait(前面的请求数, 预计等待秒数)
+            wait: 为False时不能立即放行就直接拒绝（用于对冲等可有可无的请求）
+
+        Raises:
+            AdmissionRejected: 排队过多或等待超时
+        """
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        waiter = _Waiter(user, tokens)
+        with self._cond:
+            if not self._queues and self._ready_in(tokens, started) == 0:
+                self._admit(tokens, started)
+                return AdmissionTicket(self, tokens)
+            if not wait or self._waiting >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionRejected('AI服务繁忙，排队的请求过多，请稍后再试')
+            self._queues.setdefault(user, deque()).append(waiter)
+            self._waiting += 1
+        last_report = None
+        try:
+            while True:
+                report = None
+                with self._cond:
+                    now = time.monotonic()
+                    if self._head() is waiter:
+                        delay = self._ready_in(tokens, now)
+                        if delay == 0:
+                            self._dequeue(waiter)
+                            self._admit(tokens, now)
+                            self.total_wait += now - started
+                            # 下一个排队的请求可能也能放行
+                            self._cond.notify_all()
+                            return AdmissionTicket(self, tokens)
+                    else:
+                        delay = None
+                    if deadline and now >= deadline:
+                        ahead, eta = self._position(waiter, now)
+                        self.rejected += 1
+                        raise AdmissionRejected(f'AI服务繁忙，排队超过 {timeout:g} 秒，请稍后再试', eta)
+                    if on_wait and (last_report is None or now - last_report >= WAIT_REPORT_INTERVAL):
+                        last_report = now
+                        report = self._position(waiter, now)
+                    else:
+                        sleep = WAIT_REPORT_INTERVAL if delay is None else min(delay, WAIT_REPORT_INTERVAL)
+                        if deadline:
+                            sleep = min(sleep, deadline - now)
+                        self._cond.wait(max(sleep, 0.001))
+                if report:
+                    on_wait(*report)
+        except BaseException:
+            with self._cond:
+                self._dequeue(waiter)
+                self._cond.notify_all()
+            raise
+
+    def release(self, duration):
+        with self._cond:
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+            self.avg_duration = duration if self.avg_duration is None else self.avg_duration * 0.8 + duration * 0.2
+            self._cond.notify_all()
+
+    def adjust(self, tokens):
+        with self._cond:
+            self._tokens.give(tokens, time.monotonic())
+            self._cond.notify_all()
+
+    def throttle(self, retry_after):
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.throttled_count += 1
+        logger.warning(f"AI服务商限流（429），{self.name} 暂停放行 {retry_after:g} 秒")
+
+    def idle(self):
+        with self._cond:
+            return not self.in_flight and not self._waiting
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'waiting': self._waiting,
+                'waiting_users': len(self._queues),
+                'rpm_available': int(self._requests.tokens),
+                'tpm_available': int(self._tokens.tokens),
+                'blocked_for': round(max(0.0, self.blocked_until - now), 1),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'throttled': self.throttled_count,
+                'avg_wait': round(self.total_wait / self.admitted, 3) if self.admitted else 0,
+                'avg_duration': round(self.avg_duration, 3) if self.avg_duration else None
+            }
+
+
+class AdmissionController:
+    """按 (服务商, 密钥) 懒创建限流器
+
+    Args:
+        enabled: 为False时 admit 直接放行（返回不受限的 ticket）
+        limits: 按服务商覆盖的限额 {服务商: {'in_flight':, 'rpm':, 'tpm':}}
+    """
+
+    def __init__(self, enabled=AI_ADMISSION_ENABLED, limits=None):
+        self.enabled = enabled
+        self.limits = limits if limits is not None else AI_KEY_LIMITS
+        self._limiters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def limiter(self, provider, api_key):
+        """api_key 可以是密钥本身或 Authorization 头（"Bearer <密钥>"），两者对应同一个限流器"""
+        api_key = normalize_api_key(api_key)
+        digest = hashlib.sha256(f'{provider}:{api_key}'.encode('utf-8')).hexdigest()[:12]
+        name = f'{provider}:{digest}'
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limits = self.limits.get(provider) or {}
+                limiter = KeyLimiter(
+                    name,
+                    in_flight=limits.get('in_flight', AI_MAX_IN_FLIGHT),
+                    rpm=limits.get('rpm', AI_RPM),
+                    tpm=limits.get('tpm', AI_TPM),
+                    max_waiting=limits.get('max_waiting', AI_MAX_WAITING)
+                )
+                self._limiters[name] = limiter
+                self._prune()
+            self._limiters.move_to_end(name)
+            return limiter
+
+    def _prune(self):
+        """调用方持有锁；限流器过多时删除最久未使用且空闲的"""
+        excess = len(self._limiters) - MAX_LIMITERS
+        if excess <= 0:
+            return
+        for name in [name for name, limiter in self._limiters.items() if limiter.idle()][:excess]:
+            del self._limiters[name]
+
+    def admit(self, provider, api_key, user, tokens, timeout=AI_ADMISSION_TIMEOUT, on_wait=None, wait=True):
+        """排队等待放行，返回 AdmissionTicket；参数见 KeyLimiter.acquire"""
+        if not self.enabled:
+            return AdmissionTicket(None, tokens)
+        return self.limiter(provider, api_key).acquire(user, tokens, timeout=timeout, on_wait=on_wait, wait=wait)
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.items())
+        return {'enabled': self.enabled, 'keys': {name: limiter.stats() for name, limiter in limiters}}
+
+
+ai_admission = AdmissionController()
@@ -0,0 +1,216 @@
+"""AI响应缓存 - 相同的请求直接返回上次的模型输出，不再等待服务商
+
+缓存键由 (服务商, 模型, 系统提示词, 提示词哈希, temperature, max_tokens, API密钥指纹) 决定：
+数据和提示词都没有变化时重新生成报告、反复测试同一个配置都会命中缓存；
+换了密钥的配置不会命中其他密钥的结果（密钥只以哈希形式参与计算，不写入磁盘）。
+
+每条缓存是磁盘上的一个JSON文件，多个worker进程共用同一个目录。
+读取时更新文件的修改时间，淘汰时先删除超过 max_age 的条目，
+再按最久未使用的顺序删除直到总大小和条数都不超过上限。只缓存成功的响应。
+"""
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_ENABLED = os.getenv('QUICKFORM_AI_CACHE', '1') != '0'
+AI_CACHE_DIR = os.getenv('QUICKFORM_AI_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai_cache'))
+AI_CACHE_MAX_MB = int(os.getenv('QUICKFORM_AI_CACHE_MAX_MB', '64'))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('QUICKFORM_AI_CACHE_MAX_ENTRIES', '5000'))
+AI_CACHE_MAX_AGE_HOURS = float(os.getenv('QUICKFORM_AI_CACHE_MAX_AGE_HOURS', '168'))
+EVICT_EVERY = 50  # 每写入多少次扫描一次目录（同步其他进程写入的条目）
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def response_cache_key(provider, model, system_prompt, prompt, temperature=None, max_tokens=None, credential=None):
+    """计算缓存键（64位十六进制字符串，同时用作文件名）"""
+    fields = {
+        'provider': provider,
+        'model': model,
+        'system': _sha256(system_prompt or ''),
+        'prompt': _sha256(prompt),
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'credential': _sha256(credential) if credential else None
+    }
+    return _sha256(json_codec.dumps(fields, sort_keys=True))
+
+
+class AIResponseCache:
+    """磁盘上的AI响应缓存
+
+    Args:
+        cache_dir: 缓存目录
+        max_bytes: 缓存总大小上限
+        max_entries: 缓存条数上限
+        max_age: 条目有效期（秒，从写入时算起）
+        enabled: 为False时 get 总是未命中、set 不写入
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, max_entries=5000, max_age=7 * 24 * 3600, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._bytes = None  # 目录总大小的估计值，None表示尚未扫描
+        self._entries = 0
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        """返回缓存的响应文本，未命中、已过期或读取失败时返回None"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json_codec.loads(f.read())
+            if time.time() - entry['created_at'] > self.max_age:
+                self._remove(path)
+                self._count('misses')
+                return None
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"读取AI响应缓存失败，按未命中处理: {str(e)}")
+            self._remove(path)
+            self._count('misses')
+            return None
+        self._count('hits')
+        return entry['response']
+
+    def set(self, key, response, provider=None, model=None):
+        """写入响应；先写临时文件再原子替换，写入失败只记录日志"""
+        if not self.enabled or not response:
+            return
+        entry = {'provider': provider, 'model': model, 'created_at': time.time(), 'response': response}
+        data = json_codec.dumps(entry).encode('utf-8')
+        path = self._path(key)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入AI响应缓存失败: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._writes += 1
+            if self._bytes is not None:
+                self._bytes += len(data)
+                self._entries += 1
+            should_evict = (
+                self._bytes is None or self._bytes > self.max_bytes or self._entries > self.max_entries
+                or self._writes % EVICT_EVERY == 0
+            )
+        if should_evict:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            with self._lock:
+                self.evicted += 1
+            return True
+        except OSError:
+            return False
+
+    def evict(self):
+        """删除过期条目和遗留的临时文件，再按最久未使用的顺序删除直到不超过上限；返回删除数"""
+        now = time.time()
+        removed = 0
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # 临时文件只在过期后清理（可能是其他进程正在写入的）
+            if now - st.st_mtime > self.max_age:
+                if self._remove(path):
+                    removed += 1
+            elif name.endswith('.json'):
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            if self._remove(path):
+                removed += 1
+                total -= size
+                count -= 1
+        with self._lock:
+            self._bytes = total
+            self._entries = count
+        if removed:
+            logger.info(f"AI响应缓存淘汰 {removed} 个条目，剩余 {count} 个，{total / 1024 / 1024:.1f}MB")
+        return removed
+
+    def clear(self):
+        """删除全部缓存条目"""
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            self._remove(os.path.join(self.cache_dir, name))
+        with self._lock:
+            self._bytes = 0
+            self._entries = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': self._entries if self._bytes is not None else None,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted': self.evicted,
+                'hit_rate': round(self.hits / total, 4) if total else 0
+            }
+
+
+ai_response_cache = AIResponseCache(
+    AI_CACHE_DIR,
+    max_bytes=AI_CACHE_MAX_MB * 1024 * 1024,
+    max_entries=AI_CACHE_MAX_ENTRIES,
+    max_age=AI_CACHE_MAX_AGE_HOURS * 3600,
+    enabled=AI_CACHE_ENABLED
+)
@@ -0,0 +1,311 @@
+"""AI请求网关 - 在专用的事件循环线程中用 httpx.AsyncClient 发送AI服务商请求
+
+同步代码通过 submit/await 接口使用：
+- post() 提交一次请求，返回 concurrent.futures.Future；调用方可以 result() 等待，
+  也可以 add_done_callback 后立即返回（回调在事件循环线程中执行，只做推送等轻量操作）。
+  同时进行的几百个长补全只是事件循环里的几百个协程，不再各占一个线程；
+- open_stream() 发起流式请求，响应头到达后返回，调用方线程用 iter_lines() 逐行读取；
+- submit(coro) 在事件循环中执行任意协程。
+每个服务商一个 AsyncClient（keep-alive连接池）。重试策略与 http_client_service 相同：
+连接失败和 RETRY_STATUS 中的状态码按指数退避重试，遵循 Retry-After；读取超时不重试。
+超时和网络错误转换为 requests 的对应异常，调用方的异常处理不变。
+httpx 为可选依赖；未安装或 QUICKFORM_AI_GATEWAY=0 时改用 http_client_service 的同步连接池，接口不变。
+"""
+import os
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+import requests
+
+import json_codec
+import http_client_service
+from http_client_service import provider_clients, HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_BACKOFF
+from ai_admission_service import retry_after_seconds
+
+try:
+    import httpx
+except ImportError:  # 可选依赖
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+AI_GATEWAY_ENABLED = os.getenv('QUICKFORM_AI_GATEWAY', '1') != '0'
+AI_GATEWAY_MAX_CONNECTIONS = int(os.getenv('QUICKFORM_AI_GATEWAY_MAX_CONNECTIONS', '256'))  # 每个服务商的连接数上限
+
+_END = object()  # 流式响应结束标记
+
+
+def _timeout(timeout):
+    """requests 风格的超时（秒数或 (连接, 读取) 元组）转换为 httpx.Timeout
+
+    等待连接池中的空闲连接不设上限：同时进行的请求数由准入控制限制。
+    """
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=None)
+
+
+def _translate(error):
+    """httpx 的超时与网络错误转换为 requests 的对应异常"""
+    message = str(error) or type(error).__name__
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.ConnectTimeout(message)
+    if isinstance(error, httpx.TimeoutException):
+        return requests.Timeout(message)
+    if isinstance(error, httpx.TransportError):
+        return requests.ConnectionError(message)
+    return error
+
+
+def _completed(func, *args, **kwargs):
+    """同步执行 func，结果包装为已完成的 Future（未启用网关时使用）"""
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class GatewayStream:
+    """网关的流式响应：事件循环读取数据放入队列，调用方线程通过 iter_lines 逐行取出
+
+    status_code、headers、text、iter_lines 以及上下文管理器的用法与 requests 的流式响应相同；
+    状态码不是200时响应体已读入 content，iter_lines 不产出数据。
+    """
+
+    def __init__(self):
+        self.status_code = None
+        self.headers = {}
+        self.content = b''
+        self._lines = queue.Queue()
+        self._future = None
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def iter_lines(self):
+        """逐行产出响应体（bytes，不含换行符）；读取失败时抛出 requests 的对应异常"""
+        while True:
+            item = self._lines.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """取消读取（关闭连接）"""
+        if self._future is not None:
+            self._future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class AIGateway:
+    """专用事件循环线程 + 每个服务商一个 httpx.AsyncClient
+
+    Args:
+        max_connections: 每个服务商的连接数上限
+        keepalive: 每个服务商保持的空闲连接数
+        retries: 最大重试次数
+        backoff: 指数退避系数（秒）
+        enabled: 为False（或未安装httpx）时所有请求改用 http_client_service 的同步连接池
+    """
+
+    def __init__(self, max_connections=AI_GATEWAY_MAX_CONNECTIONS, keepalive=HTTP_POOL_SIZE, retries=HTTP_RETRIES,
+                 backoff=HTTP_BACKOFF, enabled=AI_GATEWAY_ENABLED):
+        self.max_connections = max_connections
+        self.keepalive = keepalive
+        self.retries = retries
+        self.backoff = backoff
+        self.enabled = bool(enabled and httpx)
+        self._loop = None
+        self._thread = None
+        self._clients = {}  # 服务商 -> AsyncClient，只在事件循环线程中访问
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._counters = {}  # 服务商 -> {'requests', 'retries', 'errors'}
+
+    def start(self):
+        """启动事件循环线程（首次提交请求时自动启动）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name='quickform-ai-gateway', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+        logger.info(f"AI请求网关已启动: max_connections={self.max_connections}, retries={self.retries}")
+
+    def stop(self):
+        """关闭所有连接并停止事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_clients(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"关闭AI请求网关的连接失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+
+    async def _close_clients(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    def submit(self, coro):
+        """在事件循环中执行协程，返回 concurrent.futures.Future；cancel() 会取消该协程"""
+        if self._loop is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _client(self, provider):
+        client = self._clients.get(provider)
+        if client is None:
+            client = httpx.AsyncClient(limits=httpx.Limits(max_connections=self.max_connections,
+                                                           max_keepalive_connections=self.keepalive))
+            self._clients[provider] = client
+        return client
+
+    def _count(self, provider, key, delta=1):
+        with self._lock:
+            counters = self._counters.setdefault(provider, {'requests': 0, 'retries': 0, 'errors': 0})
+            counters[key] += delta
+            if key == 'requests':
+                self._in_flight += 1
+                self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _done(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _request_args(headers, json, data):
+        """请求体统一用 json_codec 编码（与同步连接池的 requests 输出一致：紧凑、不转义中文）"""
+        headers = dict(headers or {})
+        if json is not None:
+            data = json_codec.dumps_bytes(json)
+            headers.setdefault('Content-Type', 'application/json')
+        return headers, data
+
+    async def _send(self, provider, url, headers, content, timeout):
+        """发送请求，返回尚未读取响应体的响应；连接失败和可重试的状态码按退避重试"""
+        client = self._client(provider)
+        for attempt in range(self.retries + 1):
+            request = client.build_request('POST', url, headers=headers, content=content, timeout=_timeout(timeout))
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = await client.send(request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in http_client_service.RETRY_STATUS or attempt == self.retries:
+                    return response
+                delay = retry_after_seconds(response, default=delay)
+                await response.aclose()
+            self._count(provider, 'retries')
+            await asyncio.sleep(delay)
+
+    async def _post(self, provider, url, headers, content, timeout):
+        self._count(provider, 'requests')
+        try:
+            response = await self._send(provider, url, headers, content, timeout)
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            return response
+        except httpx.HTTPError as e:
+            self._count(provider, 'errors')
+            raise _translate(e)
+        finally:
+            self._done()
+
+    def post(self, provider, url, headers=None, json=None, data=None, timeout=None):
+        """提交一次POST，返回 Future；结果为已读完响应体的响应（status_code/headers/content/text/json() 与 requests 相同）"""
+        if not self.enabled:
+            return _completed(provider_clients.post, provider, url, headers=headers, json=json, data=data,
+                              timeout=timeout)
+        headers, content = self._request_args(headers, json, data)
+        return self.submit(self._post(provider, url, headers, content, timeout))
+
+    async def _stream(self, provider, url, headers, content, timeout, stream, ready):
+        self._count(provider, 'requests')
+        response = None
+        try:
+            response = await self._send(provider, url, headers, content, timeout)
+            stream.status_code = response.status_code
+            stream.headers = response.headers
+            if response.status_code != 200:
+                stream.content = await response.aread()
+            ready.set_result(stream)
+            if response.status_code == 200:
+                buffer = b''
+                async for chunk in response.aiter_bytes():
+                    *lines, buffer = (buffer + chunk).split(b'\n')
+                    for line in lines:
+                        stream._lines.put(line.rstrip(b'\r'))
+                if buffer:
+                    stream._lines.put(buffer.rstrip(b'\r'))
+        except httpx.HTTPError as e:
+            self._count(provider, 'errors')
+            error = _translate(e)
+            if ready.done():
+                stream._lines.put(error)
+            else:
+                ready.set_exception(error)
+        finally:
+            if not ready.done():
+                ready.set_exception(requests.ConnectionError('流式请求已取消'))
+            stream._lines.put(_END)
+            if response is not None:
+                await response.aclose()
+            self._done()
+
+    def open_stream(self, provider, url, headers=None, json=None, timeout=None):
+        """发起流式POST，响应头到达后返回 GatewayStream；未启用网关时返回 requests 的流式响应"""
+        if not self.enabled:
+            return provider_clients.post(provider, url, headers=headers, json=json, stream=True, timeout=timeout)
+        headers, content = self._request_args(headers, json, None)
+        stream, ready = GatewayStream(), Future()
+        stream._future = self.submit(self._stream(provider, url, headers, content, timeout, stream, ready))
+        return ready.result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'backend': 'httpx' if self.enabled else 'requests',
+                'running': self._thread is not None and self._thread.is_alive(),
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'max_connections': self.max_connections,
+                'providers': {provider: dict(counters) for provider, counters in self._counters.items()}
+            }
+
+
+ai_gateway = AIGateway()
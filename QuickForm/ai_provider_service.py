@@ -0,0 +1,317 @@
+"""AI服务商适配器与健康度统计
+
+每个可选模型（AIConfig.selected_model）对应一个适配器，负责构造请求、解析响应和流式数据块；
+新增服务商只需注册一个适配器。ProviderHealth 按服务商记录最近的调用结果（耗时、是否成功），
+用于故障转移时挑选备用服务商，以及按历史耗时的p95计算对冲请求的发出时机。
+"""
+import os
+import logging
+import threading
+from collections import deque
+
+from flask import current_app
+
+from http_client_service import PROVIDER_URLS
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "你面向的用户一般是教师和学生"
+
+AI_FAILOVER_ENABLED = os.getenv('QUICKFORM_AI_FAILOVER', '0') == '1'  # 主服务商失败时改用用户配置的另一个服务商（默认关闭）
+AI_HEDGE_ENABLED = os.getenv('QUICKFORM_AI_HEDGE', '0') == '1'  # 主请求超过p95耗时仍未返回时发出备用请求（会重复计费，默认关闭）
+AI_HEDGE_PERCENTILE = float(os.getenv('QUICKFORM_AI_HEDGE_PERCENTILE', '0.95'))  # 按该分位数的历史耗时发出对冲请求
+AI_HEDGE_MIN_DELAY = float(os.getenv('QUICKFORM_AI_HEDGE_MIN_DELAY', '2'))  # 对冲等待时间下限（秒）
+AI_HEDGE_MIN_SAMPLES = int(os.getenv('QUICKFORM_AI_HEDGE_MIN_SAMPLES', '20'))  # 耗时样本不足时不对冲
+HEALTH_WINDOW = int(os.getenv('QUICKFORM_AI_HEALTH_WINDOW', '100'))  # 每个服务商保留的最近调用数
+UNHEALTHY_ERROR_RATE = 0.5  # 最近错误率达到该值（且样本足够）的主服务商排到备用服务商之后
+UNHEALTHY_MIN_SAMPLES = 5
+
+
+class ProviderAdapter:
+    """服务商适配器基类
+
+    Args:
+        provider: 服务商名称（连接池、接口地址、健康度统计都按它区分）
+        label: 显示名称（用于错误信息）
+        model: 请求的模型名称
+        timeout: 非流式请求的超时（秒，或 (连接, 读取) 元组）
+        key_attr: AIConfig 中保存API密钥的字段
+    """
+
+    def __init__(self, provider, label, model, timeout, key_attr=None):
+        self.provider = provider
+        self.label = label
+        self.model = model
+        self.timeout = timeout
+        self.key_attr = key_attr
+
+    @property
+    def url(self):
+        return PROVIDER_URLS[self.provider]
+
+    def api_key(self, ai_config):
+        api_key = (getattr(ai_config, self.key_attr, None) or '').strip()
+        if not api_key:
+            raise Exception(f'{self.label}API密钥未配置')
+        return api_key
+
+    def configured(self, ai_config):
+        """该用户是否可以使用这个服务商（作为备用服务商的前提）"""
+        try:
+            return bool(self.api_key(ai_config))
+        except Exception:
+            return False
+
+    def build_request(self, prompt, ai_config, stream=False):
+        """返回 (headers, payload)"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key(ai_config)}"
+        }
+        return headers, self.build_payload(messages, headers, stream)
+
+    def build_payload(self, messages, headers, stream):
+        raise NotImplementedError
+
+    def parse_response(self, response):
+        """从非流式响应中取出文本，失败时抛出异常"""
+        raise NotImplementedError
+
+    def stream_delta(self, chunk):
+        """从一个流式数据块中取出新增的文本"""
+        raise NotImplementedError
+
+
+class OpenAICompatibleAdapter(ProviderAdapter):
+    """OpenAI兼容接口（DeepSeek、豆包、硅基流动）"""
+
+    def __init__(self, provider, label, model, timeout, key_attr=None, params=None):
+        super().__init__(provider, label, model, timeout, key_attr)
+        self.params = params or {}
+
+    def build_payload(self, messages, headers, stream):
+        payload = {"model": self.model, "messages": messages, **self.params}
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def parse_response(self, response):
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
+        result = response.json()
+        if isinstance(result, dict) and result.get('choices'):
+            choice = result['choices'][0]
+            content = (choice.get('message') or {}).get('content') or choice.get('text')
+            if content:
+                return content
+        raise Exception(f"未知响应格式: {str(result)[:200]}")
+
+    def stream_delta(self, chunk):
+        choices = chunk.get('choices') or []
+        if not choices:
+            if chunk.get('error'):
+                raise Exception(str(chunk['error'])[:200])
+            return ''
+        choice = choices[0]
+        return (choice.get('delta') or {}).get('content') or choice.get('text') or ''
+
+
+class ChatServerAdapter(OpenAICompatibleAdapter):
+    """硅基流动：Token 解析顺序为 用户配置 > 环境变量 > 应用配置"""
+
+    def api_key(self, ai_config):
+        api_key = (getattr(ai_config, 'chat_server_api_token', None) or '').strip()
+        if not api_key:
+            api_key = (os.environ.get('CHAT_SERVER_API_TOKEN', '') or '').strip()
+        if not api_key:
+            try:
+                api_key = (current_app.config.get('CHAT_SERVER_API_TOKEN', '') or '').strip()
+            except RuntimeError:
+                api_key = ''
+        if not api_key:
+            raise Exception('硅基流动未配置，请设置 CHAT_SERVER_API_TOKEN 或在配置页填写 Token')
+        return api_key
+
+    def configured(self, ai_config):
+        """只有用户在配置页填写了自己的 Token 才作为备用服务商；不借用环境变量/应用配置中的共享 Token"""
+        return bool((getattr(ai_config, 'chat_server_api_token', None) or '').strip())
+
+
+class QwenAdapter(ProviderAdapter):
+    """阿里云百炼：流式请求使用SSE + 增量输出"""
+
+    def build_payload(self, messages, headers, stream):
+        payload = {
+            "model": self.model,
+            "input": {"messages": messages},
+            "parameters": {"temperature": 0.7, "max_tokens": 4000}
+        }
+        if stream:
+            headers["X-DashScope-SSE"] = "enable"
+            payload["parameters"]["incremental_output"] = True
+        return payload
+
+    def parse_response(self, response):
+        if response.status_code != 200:
+            raise Exception(f"状态码: {response.status_code}，响应: {response.text[:200]}")
+        if not response.text:
+            raise Exception("返回空响应")
+        try:
+            result = response.json()
+        except ValueError:
+            raise Exception(f"返回非JSON响应: {response.text[:200]}")
+
+        if isinstance(result, dict) and "code" in result and result["code"] != "200":
+            raise Exception(f"{result.get('message', '未知错误')} (错误码: {result.get('code')})")
+
+        if isinstance(result, dict):
+            if "output" in result and "text" in result["output"]:
+                return result["output"]["text"]
+            elif "choices" in result and len(result["choices"]) > 0:
+                choice = result["choices"][0]
+                if "message" in choice and "content" in choice["message"]:
+                    return choice["message"]["content"]
+                elif "text" in choice:
+                    return choice["text"]
+            elif "data" in result and "choices" in result["data"] and len(result["data"]["choices"]) > 0:
+                choice = result["data"]["choices"][0]
+                if "message" in choice and "content" in choice["message"]:
+                    return choice["message"]["content"]
+
+        raise Exception(f"返回未知格式的响应: {str(result)[:200]}")
+
+    def stream_delta(self, chunk):
+        if chunk.get('code') and not chunk.get('output'):
+            raise Exception(f"{chunk.get('message', '未知错误')} (错误码: {chunk.get('code')})")
+        output = chunk.get('output') or {}
+        if output.get('text') is not None:
+            return output['text']
+        choices = output.get('choices') or []
+        return ((choices[0].get('message') or {}).get('content') or '') if choices else ''
+
+
+# AIConfig.selected_model -> 适配器；顺序即备用服务商的默认优先顺序
+PROVIDER_ADAPTERS = {
+    'deepseek': OpenAICompatibleAdapter('deepseek', 'DeepSeek', 'deepseek-chat', 60, 'deepseek_api_key',
+                                        {"temperature": 0.7, "max_tokens": 4000}),
+    'doubao': OpenAICompatibleAdapter('doubao', '豆包', 'doubao-seed-1-6-251015', 120, 'doubao_api_key',
+                                      {"temperature": 0.7, "max_tokens": 4000}),
+    'qwen': QwenAdapter('qwen', '阿里云百炼', 'qwen-plus', 120, 'qwen_api_key'),
+    'chat_server': ChatServerAdapter('siliconflow', '硅基流动', 'deepseek-ai/DeepSeek-V2.5', (5, 120)),
+}
+
+
+def get_adapter(model):
+    adapter = PROVIDER_ADAPTERS.get(model)
+    if adapter is None:
+        raise Exception(f"不支持的AI模型: {model}")
+    return adapter
+
+
+class ProviderHealth:
+    """按服务商保存最近 window 次调用的 (是否成功, 耗时)，线程安全
+
+    Args:
+        window: 每个服务商保留的调用数
+    """
+
+    def __init__(self, window=HEALTH_WINDOW):
+        self.window = window
+        self._calls = {}  # 服务商 -> deque[(是否成功, 耗时秒数或None)]
+        self._events = {'failover': 0, 'hedged': 0, 'hedge_won': 0}
+        self._lock = threading.Lock()
+
+    def record(self, provider, ok, latency=None):
+        """记录一次调用；latency 只记录完整的非流式调用耗时，流式调用传None"""
+        with self._lock:
+            calls = self._calls.get(provider)
+            if calls is None:
+                calls = self._calls[provider] = deque(maxlen=self.window)
+            calls.append((ok, latency))
+
+    def note(self, event):
+        """累计故障转移/对冲事件次数"""
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + 1
+
+    def error_rate(self, provider):
+        with self._lock:
+            calls = list(self._calls.get(provider, ()))
+        return sum(1 for ok, _ in calls if not ok) / len(calls) if calls else 0.0
+
+    def unhealthy(self, provider):
+        with self._lock:
+            calls = list(self._calls.get(provider, ()))
+        return len(calls) >= UNHEALTHY_MIN_SAMPLES and \
+            sum(1 for ok, _ in calls if not ok) / len(calls) >= UNHEALTHY_ERROR_RATE
+
+    def latency_percentile(self, provider, p, min_samples=1):
+        """成功调用耗时的分位数，样本不足时返回None"""
+        with self._lock:
+            values = sorted(latency for ok, latency in self._calls.get(provider, ()) if ok and latency is not None)
+        if len(values) < max(1, min_samples):
+            return None
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._events = {event: 0 for event in self._events}
+
+    def stats(self):
+        with self._lock:
+            providers = {provider: list(calls) for provider, calls in self._calls.items()}
+            events = dict(self._events)
+        result = {}
+        for provider, calls in providers.items():
+            latencies = sorted(latency for ok, latency in calls if ok and latency is not None)
+            pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3) if latencies else None
+            result[provider] = {
+                'calls': len(calls),
+                'errors': sum(1 for ok, _ in calls if not ok),
+                'latency_p50': pick(0.5),
+                'latency_p95': pick(0.95)
+            }
+        return {'window': self.window, 'failover': AI_FAILOVER_ENABLED, 'hedge': AI_HEDGE_ENABLED,
+                'events': events, 'providers': result}
+
+
+provider_health = ProviderHealth()
+
+
+def candidate_models(ai_config, failover=True):
+    """本次调用依次尝试的模型：所选模型，加上（启用故障转移时）一个用户自己配置了密钥的备用模型
+
+    备用模型按最近错误率从低到高选择；所选模型最近错误率过高而备用模型正常时，先尝试备用模型。
+    failover=False 时只返回所选模型（例如测试配置时）。
+    """
+    primary = ai_config.selected_model
+    get_adapter(primary)
+    if not (AI_FAILOVER_ENABLED and failover):
+        return [primary]
+    others = [model for model, adapter in PROVIDER_ADAPTERS.items()
+              if model != primary and adapter.configured(ai_config)]
+    if not others:
+        return [primary]
+    backup = min(others, key=lambda model: provider_health.error_rate(PROVIDER_ADAPTERS[model].provider))
+    if provider_health.unhealthy(get_adapter(primary).provider) and \
+            not provider_health.unhealthy(PROVIDER_ADAPTERS[backup].provider):
+        return [backup, primary]
+    return [primary, backup]
+
+
+def hedge_delay(provider):
+    """发出对冲请求前等待的秒数（该服务商成功调用耗时的p95，不低于下限）；未启用或样本不足时返回None
+
+    慢请求的比例超过 1 - AI_HEDGE_PERCENTILE 时，分位数本身落在慢请求中，对冲基本不会触发。
+    """
+    if not AI_HEDGE_ENABLED:
+        return None
+    latency = provider_health.latency_percentile(provider, AI_HEDGE_PERCENTILE, min_samples=AI_HEDGE_MIN_SAMPLES)
+    if latency is None:
+        return None
+    return max(AI_HEDGE_MIN_DELAY, latency)
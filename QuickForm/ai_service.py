@@ -1,317 +1,577 @@
 """AI服务 - 处理AI模型调用和分析相关功能"""
-import json
+import time
+import random
 import requests
-import threading
 import logging
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
 from datetime import datetime
-from collections import Counter
-from flask import current_app
+import json_codec
+from submission_service import load_submission_data, count_task_submissions, fetch_submission_ranges
+from field_stats_service import load_field_stats, FieldStatsAccumulator
+from ai_gateway_service import ai_gateway
+from ai_provider_service import SYSTEM_PROMPT, PROVIDER_ADAPTERS, get_adapter, provider_health, candidate_models, hedge_delay
+from ai_cache_service import ai_response_cache, response_cache_key
+from ai_admission_service import ai_admission, estimate_tokens, usage_tokens, retry_after_seconds, AI_THROTTLE_RETRIES
+from analysis_job_service import PRIORITY_BACKGROUND
 
 logger = logging.getLogger(__name__)
 
 
-def call_ai_model(prompt, ai_config):
-    """调用AI模型生成分析报告"""
-    if ai_config.selected_model == 'deepseek':
-        url = "https://api.deepseek.com/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {ai_config.deepseek_api_key}"
-        }
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "你面向的用户一般是教师和学生"},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 4000
-        }
-        
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=60)
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        except Exception as e:
-            logger.error(f"DeepSeek API调用失败: {str(e)}")
-            raise Exception(f"DeepSeek API调用失败: {str(e)}")
-    
-    elif ai_config.selected_model == 'doubao':
-        url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {ai_config.doubao_api_key}"
-        }
-        data = {
-            "model": "doubao-seed-1-6-251015",
-            "messages": [
-                {"role": "system", "content": "你面向的用户一般是教师和学生"},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 4000
-        }
-        
+STREAM_IDLE_TIMEOUT = 60  # 流式输出时两次数据之间的最长等待（秒）
+PROVIDER_LABELS = {adapter.provider: adapter.label for adapter in PROVIDER_ADAPTERS.values()}
+
+
+def build_chat_request(prompt, ai_config, stream=False, model=None):
+    """按模型构造请求，返回 (服务商, url, headers, payload)；model 默认为所选模型
+
+    stream=True 时请求流式输出：OpenAI兼容接口为 stream，阿里云百炼为SSE + 增量输出。
+    """
+    adapter = get_adapter(model or ai_config.selected_model)
+    headers, payload = adapter.build_request(prompt, ai_config, stream=stream)
+    return adapter.provider, adapter.url, headers, payload
+
+
+def _response_cache_key(prompt, provider, headers, payload):
+    """按请求内容计算响应缓存键；流式与非流式请求共用同一个键"""
+    params = payload.get('parameters') or payload
+    return response_cache_key(
+        provider, payload.get('model'), SYSTEM_PROMPT, prompt,
+        temperature=params.get('temperature'), max_tokens=params.get('max_tokens'),
+        credential=headers.get('Authorization')
+    )
+
+
+def _cached_response(prompt, provider, headers, payload, use_cache):
+    """返回 (缓存键, 缓存的响应)；缓存未启用时键为None，use_cache=False 时只返回键（结果仍会写入缓存）"""
+    if not ai_response_cache.enabled:
+        return None, None
+    cache_key = _response_cache_key(prompt, provider, headers, payload)
+    cached = ai_response_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        logger.info(f"{PROVIDER_LABELS[provider]}响应缓存命中，提示词长度: {len(prompt)} 字符")
+    return cache_key, cached
+
+
+def _store_response(prompt, provider, headers, payload, content):
+    """按实际应答的服务商写入响应缓存（故障转移后可能与所选模型不同）"""
+    if ai_response_cache.enabled:
+        ai_response_cache.set(_response_cache_key(prompt, provider, headers, payload), content,
+                              provider=provider, model=payload.get('model'))
+
+
+def _failed(errors):
+    """所有尝试都失败时抛出的异常：只有一次尝试时原样抛出，否则合并各服务商的错误信息"""
+    if len(errors) == 1:
+        return errors[0]
+    if all(isinstance(e, TimeoutError) for e in errors):
+        return TimeoutError('；'.join(str(e) for e in errors))
+    return Exception('；'.join(str(e) for e in errors))
+
+
+def _provider_fault(status):
+    """失败是否计入服务商的健康度：网络错误和超时（没有状态码）、429、5xx、200但响应无法解析；
+    其他4xx（密钥无效、请求有误）是单个用户的问题，计入会让所有用户都把该服务商排到后面"""
+    return status is None or status == 429 or status >= 500 or status < 400
+
+
+def _send(adapter, headers, payload, user=None, on_wait=None, wait=True):
+    """排队放行后通过 ai_gateway 提交一次非流式请求，返回 (ticket, future, 开始时间)
+
+    user 为准入控制的轮转单位，on_wait 接收排队进度，wait=False 时不排队（没有余量时抛出 AdmissionRejected）。
+    """
+    ticket = ai_admission.admit(adapter.provider, headers.get('Authorization'), user, estimate_tokens(payload),
+                                on_wait=on_wait, wait=wait)
+    started = time.monotonic()
+    try:
+        future = ai_gateway.post(adapter.provider, adapter.url, headers=headers, json=payload, timeout=adapter.timeout)
+    except Exception:
+        ticket.release()
+        raise
+    return ticket, future, started
+
+
+def _receive(adapter, ticket, future, started, retry_throttled=False):
+    """等待 _send 提交的请求完成并返回文本；记录健康度、按实际用量修正token桶并归还准入名额
+
+    收到429时按 Retry-After 暂停该密钥；retry_throttled=True 时返回None，由调用方重新排队。
+    """
+    status = None
+    try:
+        response = future.result()
+        status = response.status_code
+        if status == 429:
+            ticket.throttled(retry_after_seconds(response))
+            if retry_throttled:
+                return None
+        content = adapter.parse_response(response)
+        ticket.settle(usage_tokens(response.json()))
+    except requests.Timeout as e:
+        provider_health.record(adapter.provider, False)
+        logger.error(f"{adapter.label}超时: {e}")
+        raise Exception(f"{adapter.label}超时: {e}")
+    except Exception as e:
+        if _provider_fault(status):
+            provider_health.record(adapter.provider, False)
+        logger.error(f"{adapter.label}API调用失败: {str(e)}")
+        raise Exception(f"{adapter.label}API调用失败: {str(e)}")
+    finally:
+        ticket.release()
+    provider_health.record(adapter.provider, True, time.monotonic() - started)
+    return content
+
+
+def _request_once(model, headers, payload, user=None, on_wait=None):
+    """向一个服务商发送一次非流式请求，记录健康度并返回文本
+
+    请求先经过该密钥的准入控制排队（user 为轮转单位，on_wait 接收排队进度）；
+    收到429时按 Retry-After 暂停该密钥，重新排队后再试 AI_THROTTLE_RETRIES 次。
+    排队被拒绝（AdmissionRejected）和密钥/请求本身的错误（4xx）不计入服务商的健康度。
+    请求由 ai_gateway 的事件循环发送，本线程只等待结果。
+    """
+    adapter = get_adapter(model)
+    for attempt in range(AI_THROTTLE_RETRIES + 1):
+        ticket, future, started = _send(adapter, headers, payload, user, on_wait)
+        content = _receive(adapter, ticket, future, started,
+                           retry_throttled=attempt < AI_THROTTLE_RETRIES and ai_admission.enabled)
+        if content is not None:
+            return content
+
+
+def _call_with_failover(prompt, ai_config, models, on_wait=None, hedge=True):
+    """按 models 的顺序调用，返回 (应答的模型, headers, payload, 文本)
+
+    主服务商有足够的耗时样本时使用对冲：超过其p95耗时仍未返回，就向备用服务商（没有备用服务商时向主服务商）
+    再发一次请求，取先返回的成功结果。主请求失败时立即改用备用服务商。hedge=False 时不对冲。
+    对冲时各请求都是 ai_gateway 中的 Future，由本线程等待，不另开线程；落后的请求被取消（关闭连接）。
+    未启用网关时请求同步完成，对冲不会触发。
+    """
+    primary, backup = models[0], (models[1] if len(models) > 1 else None)
+    delay = hedge_delay(get_adapter(primary).provider) if hedge else None
+    user = getattr(ai_config, 'user_id', None)
+    errors = []
+
+    if delay is None:
+        for index, model in enumerate(models):
+            provider, url, headers, payload = build_chat_request(prompt, ai_config, model=model)
+            try:
+                return model, headers, payload, _request_once(model, headers, payload, user, on_wait)
+            except Exception as e:
+                errors.append(e)
+                if index + 1 < len(models):
+                    provider_health.note('failover')
+                    logger.warning(f"{get_adapter(model).label}调用失败，改用{get_adapter(models[index + 1]).label}")
+        raise _failed(errors)
+
+    pending = {}  # Future -> (模型, headers, payload, ticket, 开始时间, 是否为对冲请求)
+
+    def launch(model, hedge=False):
+        """提交请求，返回是否已提交；对冲请求不排队：该密钥已没有余量时放弃对冲"""
+        provider, url, headers, payload = build_chat_request(prompt, ai_config, model=model)
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=120)
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+            ticket, future, started = _send(get_adapter(model), headers, payload, user,
+                                            None if hedge else on_wait, wait=not hedge)
         except Exception as e:
-            logger.error(f"豆包API调用失败: {str(e)}")
-            raise Exception(f"豆包API调用失败: {str(e)}")
-    
-    elif ai_config.selected_model == 'qwen':
-        url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {ai_config.qwen_api_key}"
-        }
-        data = {
-            "model": "qwen-plus",
-            "input": {
-                "messages": [
-                    {"role": "system", "content": "你面向的用户一般是教师和学生"},
-                    {"role": "user", "content": prompt}
-                ]
-            },
-            "parameters": {
-                "temperature": 0.7,
-                "max_tokens": 4000
-            }
-        }
-        
+            errors.append(e)
+            return False
+        pending[future] = (model, headers, payload, ticket, started, hedge)
+        return True
+
+    def failover():
+        provider_health.note('failover')
+        logger.warning(f"{get_adapter(primary).label}调用失败，改用{get_adapter(backup).label}")
+        launch(backup)
+
+    second_launched = not launch(primary)
+    if second_launched and backup:
+        failover()
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=None if second_launched else delay, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_model = backup or primary
+                provider_health.note('hedged')
+                logger.info(f"{get_adapter(primary).label} {delay:.1f} 秒未返回，向{get_adapter(hedge_model).label}发出对冲请求")
+                launch(hedge_model, hedge=True)
+                second_launched = True
+                continue
+            for future in done:
+                model, headers, payload, ticket, started, hedged = pending.pop(future)
+                try:
+                    content = _receive(get_adapter(model), ticket, future, started)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if hedged:
+                    provider_health.note('hedge_won')
+                return model, headers, payload, content
+            if not second_launched and backup:
+                failover()
+            second_launched = True
+    finally:
+        for future, (model, headers, payload, ticket, started, hedged) in pending.items():
+            future.cancel()
+            ticket.release()
+    raise _failed(errors)
+
+
+def call_ai_model(prompt, ai_config, use_cache=True, on_wait=None, failover=True):
+    """调用AI模型生成分析报告
+
+    相同的请求（服务商、模型、提示词、参数、密钥均相同）直接返回缓存的响应；
+    use_cache=False 时跳过缓存重新调用模型，新的结果会覆盖缓存。
+    启用故障转移/对冲时，所选服务商失败或明显慢于平时会改用（或同时请求）用户配置的另一个服务商，见 _call_with_failover；
+    failover=False 时只调用所选模型，不转移也不对冲（测试配置时使用）。
+    请求经过按API密钥的准入控制，排队期间每秒调用一次 on_wait(前面的请求数, 预计等待秒数)。
+    """
+    provider, url, headers, data = build_chat_request(prompt, ai_config)
+    cache_key, cached = _cached_response(prompt, provider, headers, data, use_cache)
+    if cached is not None:
+        return cached
+    model, headers, data, content = _call_with_failover(prompt, ai_config, candidate_models(ai_config, failover),
+                                                        on_wait, hedge=failover)
+    _store_response(prompt, get_adapter(model).provider, headers, data, content)
+    return content
+
+
+def iter_sse_data(response):
+    """逐条产出SSE事件的 data 字段（已按UTF-8解码），遇到 [DONE] 结束；event:error 时抛出异常"""
+    event = None
+    for line in response.iter_lines():
+        if not line:
+            event = None
+            continue
+        line = line.decode('utf-8', errors='replace')
+        if line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data = line[5:].strip()
+            if data == '[DONE]':
+                return
+            if event == 'error':
+                raise Exception(f"流式响应返回错误: {data[:200]}")
+            yield data
+
+
+def _stream_once(model, headers, payload, on_delta, deadline, timeout, user=None, on_wait=None):
+    """向一个服务商发送一次流式请求，返回完整文本
+
+    请求先经过准入控制排队，排队的时间不计入 deadline；429 时暂停该密钥的放行并失败（由调用方故障转移）。
+    """
+    adapter = get_adapter(model)
+    label = adapter.label
+    parts = []
+    queued_at = time.monotonic()
+    status = None
+    with ai_admission.admit(adapter.provider, headers.get('Authorization'), user, estimate_tokens(payload),
+                            on_wait=on_wait) as ticket:
+        if deadline:
+            deadline += time.monotonic() - queued_at
         try:
-            logger.info(f"调用阿里云百炼API，模型: qwen-plus")
-            response = requests.post(url, headers=headers, json=data, timeout=120)
-            
-            if response.status_code != 200:
-                raise Exception(f"阿里云百炼API调用失败，状态码: {response.status_code}，响应: {response.text[:200]}")
-            
-            if not response.text:
-                raise Exception("阿里云百炼API返回空响应")
-            
-            try:
-                result = response.json()
-            except ValueError as ve:
-                raise Exception(f"阿里云百炼API返回非JSON响应: {response.text[:200]}")
-            
-            if isinstance(result, dict) and "code" in result and result["code"] != "200":
-                raise Exception(f"阿里云百炼API调用失败: {result.get('message', '未知错误')} (错误码: {result.get('code')})")
-            
-            if isinstance(result, dict):
-                if "output" in result and "text" in result["output"]:
-                    return result["output"]["text"]
-                elif "choices" in result and len(result["choices"]) > 0:
-                    choice = result["choices"][0]
-                    if "message" in choice and "content" in choice["message"]:
-                        return choice["message"]["content"]
-                    elif "text" in choice:
-                        return choice["text"]
-                elif "data" in result and "choices" in result["data"] and len(result["data"]["choices"]) > 0:
-                    choice = result["data"]["choices"][0]
-                    if "message" in choice and "content" in choice["message"]:
-                        return choice["message"]["content"]
-            
-            raise Exception(f"阿里云百炼API返回未知格式的响应: {str(result)[:200]}")
-        except requests.exceptions.RequestException as re:
-            logger.error(f"阿里云百炼API网络请求异常: {str(re)}")
-            raise Exception(f"阿里云百炼API网络请求异常: {str(re)}")
+            response = ai_gateway.open_stream(adapter.provider, adapter.url, headers=headers, json=payload,
+                                              timeout=(5, STREAM_IDLE_TIMEOUT))
+            with response:
+                status = response.status_code
+                if response.status_code == 429:
+                    ticket.throttled(retry_after_seconds(response))
+                if response.status_code != 200:
+                    raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
+                for data in iter_sse_data(response):
+                    try:
+                        chunk = json_codec.loads(data)
+                    except ValueError:
+                        continue
+                    delta = adapter.stream_delta(chunk)
+                    if delta:
+                        parts.append(delta)
+                        on_delta(delta)
+                    if deadline and time.monotonic() > deadline:
+                        raise TimeoutError(f"{label}输出超过 {timeout} 秒")
+            content = ''.join(parts)
+            if not content:
+                raise Exception("返回空响应")
+            ticket.settle(estimate_tokens(payload, completion=content))
+        except TimeoutError as e:
+            provider_health.record(adapter.provider, False)
+            logger.error(f"{label}流式输出超时: {e}")
+            raise
+        except requests.Timeout as e:
+            provider_health.record(adapter.provider, False)
+            logger.error(f"{label}流式输出超时: {e}")
+            raise TimeoutError(f"{label}流式输出超时: {e}")
         except Exception as e:
-            logger.error(f"阿里云百炼API调用失败: {str(e)}")
-            raise Exception(f"阿里云百炼API调用失败: {str(e)}")
-    
-    elif ai_config.selected_model == 'chat_server':
-        # 直接通过HTTP请求硅基流动 OpenAI 兼容接口（避免SDK依赖）
-        import os as _os
-        import requests as _requests
-        # Token 解析顺序：用户配置 > 环境变量 > 应用配置
-        api_key = (ai_config.chat_server_api_token or '').strip()
-        if not api_key:
-            api_key = (_os.environ.get('CHAT_SERVER_API_TOKEN', '') or '').strip()
-        if not api_key:
-            try:
-                api_key = (current_app.config.get('CHAT_SERVER_API_TOKEN', '') or '').strip()
-            except RuntimeError:
-                api_key = ''
-        if not api_key:
-            raise Exception('硅基流动未配置，请设置 CHAT_SERVER_API_TOKEN 或在配置页填写 Token')
-        url = 'https://api.siliconflow.cn/v1/chat/completions'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-        payload = {
-            'model': 'deepseek-ai/DeepSeek-V2.5',
-            'messages': [
-                {"role": "system", "content": "你面向的用户一般是教师和学生"},
-                {"role": "user", "content": prompt}
-            ]
-        }
+            if _provider_fault(status):
+                provider_health.record(adapter.provider, False)
+            logger.error(f"{label}API调用失败: {str(e)}")
+            raise Exception(f"{label}API调用失败: {str(e)}")
+    provider_health.record(adapter.provider, True)
+    return content
+
+
+def stream_ai_model(prompt, ai_config, on_delta, timeout=None, use_cache=True, on_wait=None):
+    """以流式方式调用AI模型，每收到一段文本调用一次 on_delta(text)，返回完整文本
+
+    OpenAI兼容接口（DeepSeek、豆包、硅基流动）解析 stream 的SSE输出，阿里云百炼使用增量输出模式。
+    读取超时按两次数据之间的间隔计算；timeout 为总耗时上限（秒），每收到一段数据检查一次，
+    超时或两次数据间隔过长时关闭连接并抛出 TimeoutError。on_delta 抛出异常时中止读取。
+    与 call_ai_model 共用响应缓存，命中时整段文本通过一次 on_delta 输出。
+    尚未输出任何文本就失败时改用备用服务商（已经推送给用户的内容无法撤回，之后的失败不再转移）；流式请求不对冲。
+    准入控制排队期间每秒调用一次 on_wait(前面的请求数, 预计等待秒数)，排队时间不计入 timeout。
+    """
+    provider, url, headers, payload = build_chat_request(prompt, ai_config, stream=True)
+    cache_key, cached = _cached_response(prompt, provider, headers, payload, use_cache)
+    if cached is not None:
+        on_delta(cached)
+        return cached
+    deadline = time.monotonic() + timeout if timeout else None
+    emitted = []
+
+    def forward(delta):
+        emitted.append(True)
+        on_delta(delta)
+
+    models = candidate_models(ai_config)
+    errors = []
+    for index, model in enumerate(models):
+        provider, url, headers, payload = build_chat_request(prompt, ai_config, stream=True, model=model)
         try:
-            resp = _requests.post(url, headers=headers, json=payload, timeout=(5, 120))
-            if resp.status_code != 200:
-                raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
-            data = resp.json()
-            # OpenAI兼容结构
-            if isinstance(data, dict) and 'choices' in data and data['choices']:
-                choice = data['choices'][0]
-                # message.content 或 text
-                msg = (choice.get('message') or {})
-                content = msg.get('content') or choice.get('text')
-                if content:
-                    return content
-            raise Exception(f"未知响应格式: {str(data)[:200]}")
-        except _requests.Timeout as e:
-            logger.error(f"硅基流动超时: {e}")
-            raise Exception(f"硅基流动超时: {e}")
+            content = _stream_once(model, headers, payload, forward, deadline, timeout,
+                                   getattr(ai_config, 'user_id', None), on_wait)
         except Exception as e:
-            logger.error(f"硅基流动调用失败: {str(e)}")
-            raise Exception(f"硅基流动调用失败: {str(e)}")
+            errors.append(e)
+            if emitted or index + 1 == len(models) or (deadline and time.monotonic() > deadline):
+                raise _failed(errors)
+            provider_health.note('failover')
+            logger.warning(f"{get_adapter(model).label}流式调用失败，改用{get_adapter(models[index + 1]).label}")
+            continue
+        _store_response(prompt, provider, headers, payload, content)
+        return content
+    raise _failed(errors)
+
+
+# 提示词中的数据样例：首、中、尾分层采样
+PROMPT_SAMPLE_SIZE = 20
+PROMPT_SAMPLE_HEAD = 5
+PROMPT_SAMPLE_MIDDLE = 6
+PROMPT_SAMPLE_TAIL = 5
+PROMPT_FULL_DATA_MAX = 3  # 提交数不超过该值时展示全部数据
+PROMPT_VALUE_MAX_LENGTH = 100  # 单个字段值在提示词中的最大长度
+
+
+def _format_number(value):
+    """整数值不显示小数部分"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def sample_positions(total_count, sample_size=PROMPT_SAMPLE_SIZE):
+    """已知总数时的分层采样位置（从0开始）：前5条、中间6条、后5条；总数不超过 sample_size 时全部选取"""
+    if total_count <= sample_size:
+        return list(range(total_count))
+    positions = set(range(min(PROMPT_SAMPLE_HEAD, total_count)))
+    if total_count > 10:
+        middle = total_count // 2 - PROMPT_SAMPLE_MIDDLE // 2
+        positions.update(range(middle, middle + PROMPT_SAMPLE_MIDDLE))
+    positions.update(range(max(0, total_count - PROMPT_SAMPLE_TAIL), total_count))
+    return sorted(positions)[:sample_size]
+
+
+class PromptSampler:
+    """单遍采样，内存中只保留样例
+
+    已知总数时按 sample_positions 的固定位置选取；总数未知时保留前 sample_size 条作为备用，
+    另外保留最后5条，离开末尾窗口的记录进入容量为6的蓄水池（中间部分的均匀随机样本）。
+    """
+
+    def __init__(self, total_count=None, sample_size=PROMPT_SAMPLE_SIZE, seed=0):
+        self.sample_size = sample_size
+        self.wanted = set(sample_positions(total_count, sample_size)) if total_count is not None else None
+        self.kept = []  # 已知总数时选中的 (位置, 记录)
+        self.first = []  # 总数未知时：前 sample_size 条
+        self.tail = deque(maxlen=PROMPT_SAMPLE_TAIL)
+        self.reservoir = []
+        self.seen_middle = 0
+        self.rng = random.Random(seed)
+        self.count = 0
+
+    def offer(self, row):
+        position = self.count
+        self.count += 1
+        if self.wanted is not None:
+            if position in self.wanted:
+                self.kept.append((position, row))
+            return
+        if len(self.first) < self.sample_size:
+            self.first.append((position, row))
+        if len(self.tail) == self.tail.maxlen:
+            leaving = self.tail[0]
+            if leaving[0] >= PROMPT_SAMPLE_HEAD:
+                self._reservoir_add(leaving)
+        self.tail.append((position, row))
+
+    def _reservoir_add(self, item):
+        self.seen_middle += 1
+        if len(self.reservoir) < PROMPT_SAMPLE_MIDDLE:
+            self.reservoir.append(item)
+        else:
+            slot = self.rng.randrange(self.seen_middle)
+            if slot < PROMPT_SAMPLE_MIDDLE:
+                self.reservoir[slot] = item
+
+    def samples(self):
+        """按位置排序的 [(位置, 记录)]"""
+        if self.wanted is not None:
+            return self.kept
+        if self.count <= self.sample_size:
+            return self.first
+        chosen = {position: row for position, row in self.first[:PROMPT_SAMPLE_HEAD]}
+        chosen.update(self.reservoir)
+        chosen.update(self.tail)
+        return sorted(chosen.items())[:self.sample_size]
+
+
+def _append_fields(parts, data):
+    for key, value in data.items():
+        # 限制单个值长度，避免过长
+        value_str = str(value)
+        if len(value_str) > PROMPT_VALUE_MAX_LENGTH:
+            value_str = value_str[:PROMPT_VALUE_MAX_LENGTH] + "...[截断]"
+        parts.append(f"  - {key}: {value_str}\n")
+
+
+def _append_field_stats(parts, field_stats):
+    if not field_stats:
+        return
+    parts.append("数据字段统计：\n")
+    for stat in field_stats:
+        if stat['type'] == 'numeric':
+            parts.append(f"  - {stat['field']}: 数值型，范围: {_format_number(stat['min'])} - {_format_number(stat['max'])}，"
+                         f"平均值: {stat['mean']:.2f}，标准差: {stat['std']:.2f}\n")
+        elif stat['type'] == 'boolean':
+            parts.append(f"  - {stat['field']}: 布尔型，是: {stat['true_count']}，否: {stat['count'] - stat['true_count']}\n")
+        elif stat['top_values']:
+            # 文本型，列出常见值
+            parts.append(f"  - {stat['field']}: 文本型，常见值: {', '.join([f'{k}({v}次)' for k, v in stat['top_values'][:3]])}\n")
+        else:
+            parts.append(f"  - {stat['field']}: 文本型\n")
+    parts.append("\n")
+
+
+def build_data_section(task, rows, total_count=None, field_stats=None, samples=None):
+    """单遍生成提示词的数据部分，各片段最后一次性拼接
+
+    Args:
+        task: 任务对象（使用 title/description）
+        rows: 可迭代的提交记录（具有 data/schema_fp 属性），可以是生成器
+        total_count: 提交总数；已知时按固定位置分层采样，否则使用蓄水池采样
+        field_stats: 预先计算的字段摘要（load_field_stats）；为None时在遍历中顺带统计
+        samples: 已在数据库中选好的样例 [(位置, 记录)]，此时不遍历 rows，总数取 total_count
+    """
+    parts = [f"""任务标题：{task.title}
+任务描述：{task.description or '无'}
+
+提交数据信息：
+"""]
+    accumulator = None
+    if samples is None:
+        accumulator = FieldStatsAccumulator(None) if field_stats is None else None
+        sampler = PromptSampler(total_count)
+        for row in rows:
+            if accumulator is not None:
+                data = load_submission_data(row.data, getattr(row, 'schema_fp', None))
+                accumulator.add(data)
+                row = (row, data)
+            sampler.offer(row)
+        count = sampler.count
+        samples = sampler.samples()
+    else:
+        count = total_count or 0
+
+    if not count:
+        parts.append("暂无提交数据\n")
+        return ''.join(parts)
+
+    parts.append(f"总提交数量：{count} 条\n\n")
+    _append_field_stats(parts, field_stats if accumulator is None else accumulator.summaries())
+
+    # 只解析被选中的样例（遍历时已解析过的直接使用）
+    parsed = []
+    for position, row in samples:
+        if accumulator is not None:
+            row, data = row
+        else:
+            data = load_submission_data(row.data, getattr(row, 'schema_fp', None))
+        parsed.append((position, row, data))
+    samples = parsed
+
+    if count > PROMPT_FULL_DATA_MAX:
+        parts.append(f"数据样例（共显示 {len(samples)} 条，占总数的 {len(samples)/count*100:.1f}%）：\n")
+        for idx, (position, row, data) in enumerate(samples, 1):
+            if data is None:
+                parts.append(f"\n样例 #{idx}: {str(row.data)[:PROMPT_VALUE_MAX_LENGTH]}...\n")
+                continue
+            parts.append(f"\n样例 #{idx} (第 {position+1} 条记录):\n")
+            _append_fields(parts, data)
     else:
-        raise Exception(f"不支持的AI模型: {ai_config.selected_model}")
+        # 数据量少，全部显示
+        parts.append("完整数据：\n")
+        for i, data in enumerate([data for _, _, data in samples if data is not None], 1):
+            parts.append(f"\n提交 #{i}:\n")
+            _append_fields(parts, data)
+    return ''.join(parts)
+
+
+def sample_ranges(positions):
+    """把有序的位置列表合并为连续区间 [(起始位置, 条数)]"""
+    ranges = []
+    for position in positions:
+        if ranges and ranges[-1][0] + ranges[-1][1] == position:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + 1)
+        else:
+            ranges.append((position, 1))
+    return ranges
+
+
+def sample_task_submissions(SessionLocal, task_pk, sample_size=PROMPT_SAMPLE_SIZE):
+    """在数据库中完成分层采样：总数取任务维护的提交数，首/中/尾区间按索引定位，只读取被选中的行
+
+    Returns:
+        (总数, [(位置, 记录)])
+    """
+    db = SessionLocal()
+    try:
+        total_count = count_task_submissions(db, task_pk)
+        ranges = sample_ranges(sample_positions(total_count, sample_size))
+        return total_count, fetch_submission_ranges(db, task_pk, ranges, total_count)
+    finally:
+        db.close()
 
 
 def generate_analysis_prompt(task, submission=None, file_content=None, SessionLocal=None, Submission=None, user_template=None):
-    """根据任务信息生成分析提示词（优化版）
+    """根据任务信息生成分析提示词（单遍遍历提交数据，只在内存中保留样例）
     
     Args:
         task: 任务对象
-        submission: 提交数据列表
+        submission: 提交数据（列表或可迭代对象）；为空时在数据库中采样
         file_content: 文件内容
         SessionLocal: 数据库会话工厂
-        Submission: 提交模型类
+        Submission: 提交模型类（兼容旧调用，已不使用）
         user_template: 用户自定义的提示词模板（可选），如果提供，将在模板中查找 {DATA_SECTION} 占位符并替换为数据部分
     """
-    if not submission and SessionLocal and Submission:
-        db = SessionLocal()
-        try:
-            submission = db.query(Submission).filter_by(task_id=task.id).all()
-        finally:
-            db.close()
-    
-    # 生成数据部分
-    data_section = f"""任务标题：{task.title}
-任务描述：{task.description or '无'}
+    total_count = len(submission) if hasattr(submission, '__len__') else None
+    rows = submission or []
+    samples = None
+    if not submission and SessionLocal:
+        # 未传入数据时在数据库中采样，不加载全部提交
+        total_count, samples = sample_task_submissions(SessionLocal, task.id)
 
-提交数据信息：
-"""
-    
-    # 生成数据详细内容
-    if submission:
-        total_count = len(submission)
-        data_section += f"总提交数量：{total_count} 条\n\n"
-        
-        # 解析所有数据
-        all_data = []
-        field_types = {}  # 字段类型统计
-        field_values = {}  # 字段值统计
-        
-        for sub in submission:
-            try:
-                data = json.loads(sub.data)
-                all_data.append(data)
-                
-                # 统计字段类型和值
-                for key, value in data.items():
-                    if key not in field_types:
-                        field_types[key] = []
-                        field_values[key] = []
-                    
-                    # 判断字段类型
-                    if isinstance(value, (int, float)):
-                        field_types[key].append('numeric')
-                        field_values[key].append(value)
-                    elif isinstance(value, bool):
-                        field_types[key].append('boolean')
-                        field_values[key].append(value)
-                    else:
-                        field_types[key].append('text')
-                        field_values[key].append(str(value))
-            except:
-                pass
-        
-        # 添加字段统计信息
-        if all_data and len(all_data) > 0:
-            # 检查第一个数据项是否为字典类型
-            first_item = all_data[0]
-            if isinstance(first_item, dict):
-                data_section += "数据字段统计：\n"
-                for field in first_item.keys():
-                    field_type_list = field_types.get(field, [])
-                    if not field_type_list:
-                        continue
-                    
-                    # 判断主要类型
-                    is_numeric = field_type_list.count('numeric') > len(field_type_list) * 0.8
-                    is_boolean = field_type_list.count('boolean') > len(field_type_list) * 0.8
-                    
-                    data_section += f"  - {field}: "
-                    if is_numeric:
-                        values = [v for v in field_values[field] if isinstance(v, (int, float))]
-                        if values:
-                            data_section += f"数值型，范围: {min(values)} - {max(values)}，平均值: {sum(values)/len(values):.2f}\n"
-                        else:
-                            data_section += "数值型\n"
-                    elif is_boolean:
-                        values = field_values[field]
-                        true_count = sum(1 for v in values if v is True or str(v).lower() in ['true', '1', 'yes', '是'])
-                        data_section += f"布尔型，是: {true_count}，否: {len(values)-true_count}\n"
-                    else:
-                        # 文本型，统计常见值
-                        values = field_values[field]
-                        value_counts = Counter(values)
-                        top_values = value_counts.most_common(5)
-                        if len(top_values) > 0:
-                            data_section += f"文本型，常见值: {', '.join([f'{k}({v}次)' for k, v in top_values[:3]])}\n"
-                        else:
-                            data_section += "文本型\n"
-                
-                data_section += "\n"
-        
-        # 智能采样：根据数据量决定显示多少条
-        sample_size = min(20, total_count)  # 最多显示20条
-        if total_count > 3:
-            # 如果有大量数据，均匀采样（首、中、尾）
-            if total_count <= sample_size:
-                sample_indices = list(range(total_count))
-            else:
-                # 均匀采样：取前几条、中间几条、后几条
-                sample_indices = list(range(0, min(5, total_count)))  # 前5条
-                if total_count > 10:
-                    mid_start = total_count // 2 - 3
-                    mid_end = total_count // 2 + 3
-                    sample_indices.extend(range(mid_start, mid_end))
-                sample_indices.extend(range(max(0, total_count - 5), total_count))  # 后5条
-                sample_indices = sorted(list(set(sample_indices)))[:sample_size]
-            
-            data_section += f"数据样例（共显示 {len(sample_indices)} 条，占总数的 {len(sample_indices)/total_count*100:.1f}%）：\n"
-            for idx, i in enumerate(sample_indices, 1):
-                try:
-                    data = all_data[i]
-                    data_section += f"\n样例 #{idx} (第 {i+1} 条记录):\n"
-                    for key, value in data.items():
-                        # 限制单个值长度，避免过长
-                        value_str = str(value)
-                        if len(value_str) > 100:
-                            value_str = value_str[:100] + "...[截断]"
-                        data_section += f"  - {key}: {value_str}\n"
-                except:
-                    if i < len(submission):
-                        data_section += f"\n样例 #{idx}: {submission[i].data[:100]}...\n"
-        else:
-            # 数据量少，全部显示
-            data_section += "完整数据：\n"
-            for i, data in enumerate(all_data, 1):
-                data_section += f"\n提交 #{i}:\n"
-                for key, value in data.items():
-                    value_str = str(value)
-                    if len(value_str) > 100:
-                        value_str = value_str[:100] + "...[截断]"
-                    data_section += f"  - {key}: {value_str}\n"
-    else:
-        data_section += "暂无提交数据\n"
+    # 字段统计优先读取增量维护的汇总（与字段数成正比），没有数据库时在遍历中顺带计算
+    field_stats = None
+    if SessionLocal and getattr(task, 'id', None):
+        field_stats = load_field_stats(SessionLocal, task.id)
+
+    data_section = build_data_section(task, rows, total_count, field_stats, samples)
     
     # 如果任务有HTML分析结果，添加到数据部分
     if hasattr(task, 'html_analysis') and task.html_analysis:
@@ -345,8 +605,12 @@ def generate_analysis_prompt(task, submission=None, file_content=None, SessionLo
     return prompt
 
 
-def analyze_html_file(task_id, user_id, file_path, SessionLocal, Task, AIConfig, read_file_content_func, call_ai_model_func):
-    """在后台分析HTML文件，将分析结果存储到数据库"""
+def analyze_html_file(task_id, user_id, file_path, SessionLocal, Task, AIConfig, read_file_content_func, call_ai_model_func,
+                      executor):
+    """在后台分析HTML文件，将分析结果存储到数据库
+
+    分析作为低优先级任务提交到 executor（AnalysisJobExecutor），同一文件排队或执行中时不重复提交。
+    """
     def analyze_in_background():
         print(f"[HTML分析] 后台分析任务开始，任务ID: {task_id}, 文件: {file_path}")
         db = SessionLocal()
@@ -405,7 +669,10 @@ HTML内容：
             db.close()
             print(f"[HTML分析] 后台分析任务结束\n")
     
-    # 在后台线程中执行分析
-    t = threading.Thread(target=analyze_in_background, daemon=True)
-    t.start()
+    # 交给分析任务执行器，优先级低于用户正在等待的分析报告
+    try:
+        executor.submit(user_id, analyze_in_background, priority=PRIORITY_BACKGROUND,
+                        key=('html_analysis', task_id, file_path), name='html_analysis')
+    except Exception as e:
+        logger.warning(f"任务 {task_id} 的HTML分析未能加入队列: {str(e)}")
 
@@ -0,0 +1,179 @@
+"""AI分析任务执行器 - 固定大小的工作线程池执行智能分析报告与HTML文件分析
+
+- 全局并发数等于工作线程数，每个用户同时执行的任务数另有上限（超过上限的任务留在队列中等待）；
+- 队列按优先级出队：交互式的分析报告优先于后台的HTML文件分析，同优先级先进先出；
+- 队列总长度和每个用户排队的任务数有上限，超出时拒绝提交；
+- 相同键的任务在排队或执行时不重复提交；
+- 任务本身负责超时（通过HTTP读取超时和截止时间协作退出），执行器不会遗留无法结束的线程。
+"""
+import time
+import logging
+import itertools
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0  # 用户正在页面上等待的分析报告
+PRIORITY_BACKGROUND = 10  # 上传HTML后的后台分析
+LATENCY_SAMPLES = 500  # 用于计算等待/执行耗时分位数的最近任务数
+
+
+class AnalysisQueueFull(Exception):
+    """分析队列已满或用户排队的任务过多"""
+
+
+class AnalysisJobExecutor:
+    """带优先级队列、全局与每用户并发上限的任务执行器
+
+    Args:
+        workers: 工作线程数（全局并发上限）
+        max_per_user: 每个用户同时执行的任务数上限
+        max_queue: 排队任务总数上限
+        max_queued_per_user: 每个用户排队的任务数上限
+    """
+
+    def __init__(self, workers=4, max_per_user=1, max_queue=100, max_queued_per_user=5):
+        self.workers = max(1, int(workers))
+        self.max_per_user = max(1, int(max_per_user))
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self._cond = threading.Condition()
+        self._queue = []  # [(优先级, 序号, 任务)]，保持有序
+        self._seq = itertools.count()
+        self._running = {}  # 用户 -> 执行中的任务数
+        self._keys = set()  # 排队或执行中的任务键
+        self._threads = []
+        self._stopped = False
+        self._waits = deque(maxlen=LATENCY_SAMPLES)
+        self._runs = deque(maxlen=LATENCY_SAMPLES)
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'deduplicated': 0}
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'quickform-analysis-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+        logger.info(f"AI分析任务执行器已启动: workers={self.workers}, max_per_user={self.max_per_user}, max_queue={self.max_queue}")
+
+    def stop(self):
+        """停止接收任务；排队中的任务被丢弃，执行中的任务在各自超时内结束"""
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            self._keys.clear()
+            self._cond.notify_all()
+            self._threads = []
+
+    def submit(self, user_id, func, *args, priority=PRIORITY_INTERACTIVE, key=None, name=None):
+        """提交任务，返回排在它前面的任务数；相同键的任务已在排队或执行时返回None
+
+        Raises:
+            AnalysisQueueFull: 队列已满或该用户排队的任务过多
+            RuntimeError: 执行器未启动
+        """
+        with self._cond:
+            if self._stopped or not self._threads:
+                raise RuntimeError('分析任务执行器未启动')
+            if key is not None and key in self._keys:
+                self._stats['deduplicated'] += 1
+                return None
+            if len(self._queue) >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise AnalysisQueueFull('分析任务排队过多，请稍后再试')
+            if sum(1 for _, _, job in self._queue if job['user_id'] == user_id) >= self.max_queued_per_user:
+                self._stats['rejected'] += 1
+                raise AnalysisQueueFull('您排队中的分析任务过多，请等待已提交的任务完成')
+            job = {
+                'user_id': user_id,
+                'func': func,
+                'args': args,
+                'key': key,
+                'name': name or getattr(func, '__name__', 'job'),
+                'priority': priority,
+                'enqueued_at': time.monotonic()
+            }
+            entry = (priority, next(self._seq), job)
+            self._queue.append(entry)
+            self._queue.sort(key=lambda item: item[:2])
+            if key is not None:
+                self._keys.add(key)
+            self._stats['submitted'] += 1
+            self._cond.notify()
+            return self._queue.index(entry)
+
+    def _take(self):
+        """调用方持有锁；返回优先级最高、且所属用户未达并发上限的任务"""
+        for index, (_, _, job) in enumerate(self._queue):
+            if self._running.get(job['user_id'], 0) < self.max_per_user:
+                del self._queue[index]
+                self._running[job['user_id']] = self._running.get(job['user_id'], 0) + 1
+                return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopped:
+                    job = self._take()
+                    if job:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+            started = time.monotonic()
+            self._waits.append(started - job['enqueued_at'])
+            failed = False
+            try:
+                job['func'](*job['args'])
+            except Exception as e:
+                failed = True
+                logger.error(f"分析任务 {job['name']} (用户 {job['user_id']}) 执行失败: {str(e)}", exc_info=True)
+            finally:
+                self._runs.append(time.monotonic() - started)
+                with self._cond:
+                    user_id = job['user_id']
+                    self._running[user_id] -= 1
+                    if not self._running[user_id]:
+                        del self._running[user_id]
+                    self._keys.discard(job['key'])
+                    self._stats['failed' if failed else 'completed'] += 1
+                    # 该用户的下一个任务可能正在等待
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return {'count': 0}
+        values = sorted(samples)
+        pick = lambda p: round(values[min(len(values) - 1, int(len(values) * p))], 3)
+        return {
+            'count': len(values),
+            'avg': round(sum(values) / len(values), 3),
+            'p50': pick(0.5),
+            'p95': pick(0.95),
+            'max': round(values[-1], 3)
+        }
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            depth = {}
+            for priority, _, _ in self._queue:
+                label = 'interactive' if priority <= PRIORITY_INTERACTIVE else 'background'
+                depth[label] = depth.get(label, 0) + 1
+            data['queued'] = len(self._queue)
+            data['queue_depth'] = depth
+            data['running'] = sum(self._running.values())
+            data['running_users'] = len(self._running)
+            data['workers'] = self.workers
+            data['max_per_user'] = self.max_per_user
+            waits, runs = list(self._waits), list(self._runs)
+        data['wait_seconds'] = self._summary(waits)
+        data['run_seconds'] = self._summary(runs)
+        return data
@@ -0,0 +1,191 @@
+"""
+AI调用准入控制基准测试
+在本地启动一个有限额的模拟服务商（OpenAI兼容接口）：同时进行的请求数和每分钟请求数超限时返回 429 + Retry-After。
+一个"重度"用户一次提交大量请求，随后若干"轻度"用户各提交少量请求，全部使用同一个API密钥，对比：
+  - 关闭准入控制：HTTP层对429按指数退避重试（原方式）
+  - 开启准入控制：按密钥排队放行，用户之间轮转，收到429时按 Retry-After 暂停
+统计成功/失败数、服务商收到的请求数与429次数、总耗时，以及轻度用户的等待耗时。
+
+用法: python bench_ai_admission.py [--heavy 60] [--light-users 10] [--light 3] [--in-flight 4] [--rpm 600] [--latency-ms 200]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+RESPONSE_BODY = json.dumps({
+    'choices': [{'message': {'role': 'assistant', 'content': '基准测试报告'}}],
+    'usage': {'total_tokens': 300}
+}, ensure_ascii=False).encode('utf-8')
+
+
+class LimitedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        server = self.server
+        admitted = server.enter()
+        try:
+            if admitted:
+                time.sleep(server.latency)
+                status, body = 200, RESPONSE_BODY
+            else:
+                status, body = 429, b'{"error": "rate limited"}'
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '1')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            if admitted:
+                server.leave()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LimitedProvider(ThreadingHTTPServer):
+    """同时进行的请求数上限 + 每分钟请求数令牌桶（容量为每分钟限额）"""
+    daemon_threads = True
+
+    def __init__(self, in_flight, rpm, latency):
+        super().__init__(('127.0.0.1', 0), LimitedHandler)
+        self.max_in_flight = in_flight
+        self.rpm = rpm
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.in_flight = 0
+            self.tokens = float(self.rpm)
+            self.updated = time.monotonic()
+            self.requests = 0
+            self.throttled = 0
+
+    def enter(self):
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            self.tokens = min(self.rpm, self.tokens + (now - self.updated) * self.rpm / 60)
+            self.updated = now
+            if self.in_flight >= self.max_in_flight or self.tokens < 1:
+                self.throttled += 1
+                return False
+            self.tokens -= 1
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1/chat/completions'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def run_scenario(call, heavy, light_users, light):
+    """重度用户先提交 heavy 个请求，0.1秒后轻度用户各提交 light 个；返回 {用户类型: [(是否成功, 耗时)]} 与总耗时"""
+    results = {'heavy': [], 'light': []}
+    lock = threading.Lock()
+
+    def worker(kind, user_id, delay):
+        time.sleep(delay)
+        start = time.perf_counter()
+        try:
+            call(user_id)
+            ok = True
+        except Exception:
+            ok = False
+        with lock:
+            results[kind].append((ok, time.perf_counter() - start))
+
+    threads = [threading.Thread(target=worker, args=('heavy', 0, 0)) for _ in range(heavy)]
+    for user_id in range(1, light_users + 1):
+        threads += [threading.Thread(target=worker, args=('light', user_id, 0.1)) for _ in range(light)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm AI调用准入控制基准测试')
+    parser.add_argument('--heavy', type=int, default=60, help='重度用户一次提交的请求数')
+    parser.add_argument('--light-users', type=int, default=10, help='轻度用户数')
+    parser.add_argument('--light', type=int, default=3, help='每个轻度用户的请求数')
+    parser.add_argument('--in-flight', type=int, default=4, help='服务商允许同时进行的请求数')
+    parser.add_argument('--rpm', type=int, default=600, help='服务商每分钟请求数限额')
+    parser.add_argument('--latency-ms', type=float, default=200, help='服务商处理一个请求的耗时')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    # 在导入服务模块前设置：关闭响应缓存、故障转移和对冲，只观察准入控制
+    os.environ['QUICKFORM_AI_CACHE'] = '0'
+    os.environ['QUICKFORM_AI_FAILOVER'] = '0'
+    os.environ['QUICKFORM_AI_HEDGE'] = '0'
+    import ai_service
+    import http_client_service
+    from ai_admission_service import ai_admission
+
+    provider = LimitedProvider(args.in_flight, args.rpm, args.latency_ms / 1000)
+    http_client_service.PROVIDER_URLS['deepseek'] = provider.url
+    ai_admission.limits = {'deepseek': {'in_flight': args.in_flight, 'rpm': args.rpm, 'tpm': 10 ** 9,
+                                        'max_waiting': 10 ** 6}}
+    retry_status = http_client_service.RETRY_STATUS
+
+    def call(user_id):
+        ai_config = SimpleNamespace(selected_model='deepseek', deepseek_api_key='bench', user_id=user_id)
+        return ai_service.call_ai_model(f'用户 {user_id} 的提示词', ai_config, use_cache=False)
+
+    total = args.heavy + args.light_users * args.light
+    print("=" * 60)
+    print(f"AI调用准入控制基准测试：重度用户 {args.heavy} 个请求，轻度用户 {args.light_users}×{args.light} 个请求；"
+          f"服务商限额 并发{args.in_flight}、每分钟{args.rpm}次，单次耗时 {args.latency_ms:g}ms")
+    print("=" * 60)
+    print(f"{'方式':<22}{'成功':>6}{'失败':>6}{'服务商请求':>10}{'429':>6}{'总耗时':>10}"
+          f"{'轻度p50':>10}{'轻度p95':>10}{'重度p95':>10}")
+    for label, enabled in (('关闭准入（HTTP重试429）', False), ('开启准入控制', True)):
+        ai_admission.enabled = enabled
+        # 原方式在HTTP层对429重试；重新创建连接池使重试配置生效
+        http_client_service.RETRY_STATUS = retry_status if enabled else (429,) + tuple(retry_status)
+        http_client_service.provider_clients.close()
+        provider.reset()
+        results, elapsed = run_scenario(call, args.heavy, args.light_users, args.light)
+        samples = results['heavy'] + results['light']
+        successes = sum(1 for ok, _ in samples if ok)
+        light = [seconds for ok, seconds in results['light'] if ok]
+        heavy = [seconds for ok, seconds in results['heavy'] if ok]
+        print(f"{label:<22}{successes:>6}{total - successes:>6}{provider.requests:>10}{provider.throttled:>6}"
+              f"{elapsed:>9.1f}s{percentile(light, 0.5):>9.2f}s{percentile(light, 0.95):>9.2f}s"
+              f"{percentile(heavy, 0.95):>9.2f}s")
+    http_client_service.RETRY_STATUS = retry_status
+    provider.shutdown()
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+AI服务商故障转移与对冲请求基准测试
+在本地启动两个模拟服务商的HTTP桩服务（OpenAI兼容接口），把 DeepSeek 设为所选模型、豆包为备用模型，对比：
+  - 主服务商持续返回500：关闭/开启故障转移时的成功率和耗时
+  - 主服务商有长尾（一部分请求很慢）：关闭/开启对冲请求时的 p50/p95/最大耗时
+  - 流式调用时主服务商返回500：开启故障转移后改用备用服务商
+桩服务的响应耗时为 --latency-ms，长尾请求额外等待 --tail-ms。
+运行时关闭响应缓存和准入控制，HTTP重试次数默认设为0（--retries），只观察故障转移本身的效果。
+
+对冲按主服务商历史耗时的p95发出，长尾比例需小于5%才能触发（比例更高时p95本身就落在长尾中）。
+
+用法: python bench_ai_failover.py [--requests 100] [--latency-ms 50] [--tail-ms 1000] [--tail-ratio 0.02]
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+
+def completion_body(provider):
+    return json.dumps({'choices': [{'message': {'role': 'assistant', 'content': f'{provider} 的报告'}}]},
+                      ensure_ascii=False).encode('utf-8')
+
+
+def stream_body(provider):
+    events = [
+        json.dumps({'choices': [{'delta': {'content': part}}]}, ensure_ascii=False)
+        for part in (provider, ' 的', '报告')
+    ]
+    return ''.join(f'data: {event}\n\n' for event in events + ['[DONE]']).encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.mode == 'fail':
+            body = b'{"error": "stub failure"}'
+            self.send_response(500)
+            content_type = 'application/json'
+        else:
+            delay = server.latency
+            if server.mode == 'tail' and server.rng.random() < server.tail_ratio:
+                delay += server.tail
+            time.sleep(delay)
+            self.send_response(200)
+            if payload.get('stream'):
+                body, content_type = stream_body(server.provider), 'text/event-stream'
+            else:
+                body, content_type = completion_body(server.provider), 'application/json'
+        try:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 对冲请求先返回后，落后的请求被取消、连接已关闭
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubProvider(ThreadingHTTPServer):
+    """模拟服务商；mode 为 ok / fail / tail"""
+    daemon_threads = True
+
+    def __init__(self, provider, latency, tail, tail_ratio):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.provider = provider
+        self.mode = 'ok'
+        self.latency = latency
+        self.tail = tail
+        self.tail_ratio = tail_ratio
+        self.rng = random.Random(42)
+        self.requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1/chat/completions'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(call, total):
+    """串行调用 total 次，返回 (成功耗时列表, 失败次数, 应答内容计数)"""
+    latencies, failures, answers = [], 0, {}
+    for _ in range(total):
+        start = time.perf_counter()
+        try:
+            content = call()
+        except Exception:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        answers[content] = answers.get(content, 0) + 1
+    return latencies, failures, answers
+
+
+def report(label, latencies, failures, answers, extra=''):
+    if latencies:
+        print(f"{label:<20}{len(latencies):>6}{failures:>6}{percentile(latencies, 0.5) * 1000:>10.1f}ms"
+              f"{percentile(latencies, 0.95) * 1000:>10.1f}ms{max(latencies) * 1000:>10.1f}ms  {extra}")
+    else:
+        print(f"{label:<20}{0:>6}{failures:>6}{'-':>12}{'-':>12}{'-':>12}  {extra}")
+    if answers:
+        print(f"{'':<20}应答来源: " + '，'.join(f'{content}×{count}' for content, count in answers.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm AI服务商故障转移与对冲请求基准测试')
+    parser.add_argument('--requests', type=int, default=100, help='每种场景的调用次数')
+    parser.add_argument('--latency-ms', type=float, default=50, help='桩服务的正常响应耗时')
+    parser.add_argument('--tail-ms', type=float, default=1000, help='长尾请求额外等待的毫秒数')
+    parser.add_argument('--tail-ratio', type=float, default=0.02, help='长尾请求的比例')
+    parser.add_argument('--min-delay-ms', type=float, default=100, help='对冲等待时间下限')
+    parser.add_argument('--retries', type=int, default=0, help='HTTP层的重试次数')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)  # 失败与切换的日志会逐条输出，这里只看汇总
+    # 在导入服务模块前设置：关闭响应缓存和准入控制（默认每分钟限额会让连续调用排队），控制HTTP重试
+    os.environ['QUICKFORM_AI_CACHE'] = '0'
+    os.environ['QUICKFORM_AI_ADMISSION'] = '0'
+    os.environ['QUICKFORM_HTTP_RETRIES'] = str(args.retries)
+    import ai_service
+    import ai_provider_service
+    from http_client_service import PROVIDER_URLS
+
+    primary = StubProvider('DeepSeek', args.latency_ms / 1000, args.tail_ms / 1000, args.tail_ratio)
+    backup = StubProvider('豆包', args.latency_ms / 1000, args.tail_ms / 1000, args.tail_ratio)
+    PROVIDER_URLS['deepseek'] = primary.url
+    PROVIDER_URLS['doubao'] = backup.url
+    ai_provider_service.AI_HEDGE_MIN_DELAY = args.min_delay_ms / 1000
+    ai_provider_service.AI_HEDGE_MIN_SAMPLES = min(ai_provider_service.AI_HEDGE_MIN_SAMPLES, args.requests // 2)
+    ai_config = SimpleNamespace(selected_model='deepseek', deepseek_api_key='bench', doubao_api_key='bench',
+                                qwen_api_key=None, chat_server_api_token=None)
+    os.environ.pop('CHAT_SERVER_API_TOKEN', None)  # 只用两个桩服务作为候选
+    health = ai_provider_service.provider_health
+    call = lambda: ai_service.call_ai_model('基准测试提示词', ai_config, use_cache=False)
+
+    def configure(failover, hedge):
+        ai_provider_service.AI_FAILOVER_ENABLED = failover
+        ai_provider_service.AI_HEDGE_ENABLED = hedge
+
+    header = f"{'方式':<20}{'成功':>6}{'失败':>6}{'p50':>12}{'p95':>12}{'最大':>12}"
+    print("=" * 60)
+    print(f"AI服务商故障转移与对冲基准测试：每种场景 {args.requests} 次调用，正常耗时 {args.latency_ms:g}ms，"
+          f"长尾 {args.tail_ratio:.0%} 的请求额外 {args.tail_ms:g}ms")
+    print("=" * 60)
+
+    print("\n[主服务商持续返回500]")
+    print(header)
+    primary.mode, backup.mode = 'fail', 'ok'
+    for label, failover in (('关闭故障转移', False), ('开启故障转移', True)):
+        configure(failover, False)
+        health.reset()
+        report(label, *run(call, args.requests))
+
+    print("\n[主服务商长尾]")
+    print(header)
+    primary.mode, backup.mode = 'tail', 'ok'
+    health.reset()
+    configure(True, False)
+    report('关闭对冲', *run(call, args.requests))
+    # 保留关闭对冲时积累的耗时样本，对冲等待时间由其p95决定
+    configure(True, True)
+    delay = ai_provider_service.hedge_delay('deepseek')
+    before_backup = backup.requests
+    latencies, failures, answers = run(call, args.requests)
+    events = health.stats()['events']
+    report('开启对冲', latencies, failures, answers,
+           f"对冲等待 {delay * 1000:.0f}ms，发出 {events['hedged']} 次，备用服务商收到 {backup.requests - before_backup} 次请求")
+
+    print("\n[流式调用，主服务商返回500]")
+    print(header)
+    primary.mode, backup.mode = 'fail', 'ok'
+    stream_call = lambda: ai_service.stream_ai_model('基准测试提示词', ai_config, lambda delta: None, timeout=30,
+                                                     use_cache=False)
+    for label, failover in (('关闭故障转移', False), ('开启故障转移', True)):
+        configure(failover, False)
+        health.reset()
+        report(label, *run(stream_call, max(1, args.requests // 5)))
+
+    primary.shutdown()
+    backup.shutdown()
+    print("\n" + "=" * 60)
+
+
+if __name__ == '__main__':
+    main()
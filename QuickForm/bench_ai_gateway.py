@@ -0,0 +1,156 @@
+"""
+AI请求网关基准测试
+在子进程中启动一个响应很慢的模拟服务商（OpenAI兼容接口），同时发起大量补全请求，对比：
+  - 每个请求一个线程：线程中用共享连接池同步调用并等待（原方式，相当于每个提问占用一个处理线程）
+  - AI请求网关：主线程提交请求后立即返回，应答在事件循环线程中通过回调处理
+统计全部完成的耗时、成功数，以及本进程同时存在的线程数峰值。
+
+用法: python bench_ai_gateway.py [--requests 300] [--latency-ms 2000]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+RESPONSE_BODY = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': '回答'}}]},
+                           ensure_ascii=False).encode('utf-8')
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlowProvider(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 同时建立大量连接时不因监听队列溢出而重传SYN
+
+
+def serve(latency, port_queue):
+    """在子进程中运行，服务商的线程不计入本进程"""
+    server = SlowProvider(('127.0.0.1', 0), SlowHandler)
+    server.latency = latency
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class ThreadPeak:
+    """后台采样本进程的线程数峰值"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak - 1  # 不计采样线程本身
+
+
+def run_threads(url, total):
+    """原方式：每个请求一个线程，同步等待应答"""
+    from http_client_service import provider_clients
+    results = []
+
+    def worker():
+        try:
+            results.append(provider_clients.post('bench', url, json={'messages': []}, timeout=(5, 60)).status_code == 200)
+        except Exception:
+            results.append(False)
+
+    threads = [threading.Thread(target=worker) for _ in range(total)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(results)
+
+
+def run_gateway(url, total):
+    """网关：提交后立即返回，应答在回调中处理"""
+    from ai_gateway_service import ai_gateway
+    results = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def finish(future):
+        try:
+            ok = future.result().status_code == 200
+        except Exception:
+            ok = False
+        with lock:
+            results.append(ok)
+            if len(results) == total:
+                done.set()
+
+    for _ in range(total):
+        ai_gateway.post('bench', url, json={'messages': []}, timeout=(5, 60)).add_done_callback(finish)
+    done.wait()
+    return sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm AI请求网关基准测试')
+    parser.add_argument('--requests', type=int, default=300, help='同时发起的请求数')
+    parser.add_argument('--latency-ms', type=float, default=2000, help='模拟服务商每个请求的耗时')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    port_queue = multiprocessing.Queue()
+    provider = multiprocessing.Process(target=serve, args=(args.latency_ms / 1000, port_queue), daemon=True)
+    provider.start()
+    url = f'http://127.0.0.1:{port_queue.get()}/v1/chat/completions'
+
+    from ai_gateway_service import ai_gateway
+    if not ai_gateway.enabled:
+        print("未安装httpx（或 QUICKFORM_AI_GATEWAY=0），网关使用同步连接池，两种方式结果相同")
+    # 连接数上限不低于请求数，两种方式都同时发出全部请求（应用中同时进行的请求数由准入控制限制）
+    ai_gateway.max_connections = max(ai_gateway.max_connections, args.requests)
+    ai_gateway.start()  # 事件循环线程计入基线
+
+    print("=" * 60)
+    print(f"AI请求网关基准测试：同时发起 {args.requests} 个请求，服务商每个请求耗时 {args.latency_ms:g}ms")
+    print("=" * 60)
+    print(f"{'方式':<20}{'成功':>6}{'总耗时':>10}{'线程数峰值':>12}")
+    baseline = threading.active_count()
+    for label, run in (('每个请求一个线程', run_threads), ('AI请求网关', run_gateway)):
+        sampler = ThreadPeak()
+        start = time.perf_counter()
+        successes = run(url, args.requests)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<20}{successes:>6}{elapsed:>9.2f}s{sampler.stop():>12}")
+    print(f"（空闲时本进程的线程数为 {baseline}，含主线程和网关的事件循环线程）")
+    ai_gateway.stop()
+    provider.terminate()
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
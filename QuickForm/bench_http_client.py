@@ -0,0 +1,187 @@
+"""
+AI服务商HTTP客户端基准测试
+在本地启动自签名证书的HTTPS桩服务（返回OpenAI兼容的固定响应），对比：
+  - requests.post（每次调用新建连接，原 call_ai_model 的方式）
+  - 每次调用新建带重试的 Session（原 ChatServer api_chat 的方式）
+  - 共享连接池（ProviderClientRegistry）
+统计每次调用的耗时和服务端接受的TCP连接数。--handshake-ms 在每个新连接上额外等待，模拟到服务商的网络往返。
+需要 openssl 命令生成临时证书。
+
+用法: python bench_http_client.py [--requests 200] [--threads 8] [--handshake-ms 0]
+"""
+import os
+import ssl
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+from http_client_service import ProviderClientRegistry
+
+RESPONSE_BODY = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': '基准测试响应'}}]}, ensure_ascii=False).encode('utf-8')
+PAYLOAD = {'model': 'bench', 'messages': [{'role': 'user', 'content': '你好'}]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive
+    disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免Nagle与延迟确认叠加的40ms等待
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context, handshake_delay):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.context = context
+        self.handshake_delay = handshake_delay
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        # TLS握手放到处理线程中进行，避免阻塞 accept
+        with self._lock:
+            self.connections += 1
+        if self.handshake_delay:
+            time.sleep(self.handshake_delay)
+        tls = self.context.wrap_socket(request, server_side=True)
+        try:
+            super().finish_request(tls, client_address)
+        finally:
+            tls.close()
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+         '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', key, '-out', cert],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return cert, key
+
+
+def bare_post(url, cert):
+    return requests.post(url, json=PAYLOAD, timeout=(5, 30), verify=cert)
+
+
+def session_per_call(url, cert):
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["POST"])
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    try:
+        return session.post(url, json=PAYLOAD, timeout=(5, 30), verify=cert)
+    finally:
+        session.close()
+
+
+def run(server, call, total, threads):
+    """threads 个线程共发送 total 个请求，返回 (每次耗时列表, 总耗时, 新建连接数)"""
+    before = server.connections
+    latencies = []
+    lock = threading.Lock()
+    per_thread = total // threads
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        local = []
+        barrier.wait()
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            resp = call()
+            local.append(time.perf_counter() - start)
+            assert resp.status_code == 200, resp.status_code
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, time.perf_counter() - start, server.connections - before
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm AI服务商HTTP客户端基准测试')
+    parser.add_argument('--requests', type=int, default=200, help='每种方式每轮的请求数')
+    parser.add_argument('--threads', type=int, default=8, help='并发轮的线程数')
+    parser.add_argument('--handshake-ms', type=float, default=0, help='每个新连接额外等待的毫秒数（模拟网络往返）')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='quickform_bench_http_')
+    try:
+        cert, key = make_certificate(workdir)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server = StubServer(context, args.handshake_ms / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'https://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+
+        registry = ProviderClientRegistry(pool_size=max(args.threads, 1))
+
+        print("=" * 60)
+        print(f"AI服务商HTTP客户端基准测试：每轮 {args.requests} 次请求，并发 {args.threads} 线程，"
+              f"新连接额外等待 {args.handshake_ms:g}ms")
+        print("=" * 60)
+        modes = [
+            ('requests.post（每次新连接）', lambda: bare_post(url, cert)),
+            ('每次新建Session', lambda: session_per_call(url, cert)),
+            ('共享连接池', lambda: registry.post('bench', url, json=PAYLOAD, timeout=(5, 30), verify=cert)),
+        ]
+        results = {}
+        for threads, title in ((1, '串行'), (args.threads, f'{args.threads}线程并发')):
+            print(f"\n[{title}]")
+            print(f"{'方式':<28}{'平均':>10}{'p50':>10}{'p95':>10}{'吞吐':>12}{'新建连接':>10}")
+            for label, call in modes:
+                call()  # 预热（共享连接池在此建立首个连接）
+                latencies, elapsed, connections = run(server, call, args.requests, threads)
+                mean = sum(latencies) / len(latencies)
+                results[(threads, label)] = mean
+                print(f"{label:<28}{mean * 1000:>8.2f}ms{percentile(latencies, 0.5) * 1000:>8.2f}ms"
+                      f"{percentile(latencies, 0.95) * 1000:>8.2f}ms{len(latencies) / elapsed:>9.0f}/s{connections:>10}")
+            baseline = results[(threads, modes[0][0])]
+            pooled = results[(threads, modes[-1][0])]
+            print(f"共享连接池平均每次节省 {(baseline - pooled) * 1000:.2f}ms（{baseline / pooled:.1f}倍）")
+
+        registry.close()
+        server.shutdown()
+        print("\n" + "=" * 60)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
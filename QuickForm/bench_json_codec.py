@@ -0,0 +1,147 @@
+"""
+JSON编解码基准测试
+模拟一个10万条提交的任务，对比 /api/submit/<task_id>/all 的几种输出方式：
+  - 原方式：标准库 json.loads 逐条解析（含双重编码探测）+ 整体 json.dumps
+  - 编解码器：json_codec.loads / dumps（orjson可用时使用orjson，否则为标准库）
+  - 透传：已规范化的数据直接拼接存储的JSON文本，不解析也不重新编码
+以及写入时的规范化（canonicalize_payload）耗时。不访问数据库。
+
+用法: python bench_json_codec.py [--rows 100000] [--repeat 3]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+import json_codec
+from json_codec import splice_raw_array
+from submission_service import canonicalize_payload, decode_submission, submission_json
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何林罗高'
+GIVEN = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚'
+COMMENTS = ['实验现象明显，结论正确', '数据记录不完整', '小组合作良好', '需要重新测量第三组数据',
+            '图像绘制规范', '误差分析较为充分', '']
+
+
+def make_payload(rng, i):
+    """一条典型的课堂表单提交"""
+    return {
+        'name': rng.choice(SURNAMES) + rng.choice(GIVEN) + rng.choice(GIVEN),
+        'class': f'高一（{rng.randint(1, 12)}）班',
+        'student_no': f'2024{i:06d}',
+        'score': rng.randint(40, 100),
+        'duration': round(rng.uniform(30, 900), 2),
+        'answers': [rng.choice('ABCD') for _ in range(10)],
+        'correct': rng.random() > 0.3,
+        'comment': rng.choice(COMMENTS)
+    }
+
+
+def make_rows(count):
+    """生成 (data, submitted_at, schema_fp) 行，与数据库中规范化后的存储一致"""
+    rng = random.Random(42)
+    start = datetime(2024, 9, 1, 8, 0, 0)
+    rows = []
+    for i in range(count):
+        data_json, schema_fp = canonicalize_payload(make_payload(rng, i))
+        rows.append((data_json, start + timedelta(seconds=i), schema_fp))
+    return rows
+
+
+def legacy_all(rows):
+    """原方式：逐条 json.loads（含双重编码探测）后整体 json.dumps"""
+    data_list = []
+    for raw_data, submitted_at, _ in rows:
+        data = json.loads(raw_data)
+        if isinstance(data, str):
+            data = json.loads(data)
+        data['submitted_at'] = submitted_at.strftime('%Y-%m-%d %H:%M:%S')
+        data_list.append(data)
+    return json.dumps({'task_id': 'bench', 'total_submissions': len(data_list), 'submissions': data_list})
+
+
+def codec_all(rows):
+    """逐条解析后用编解码器整体序列化"""
+    data_list = [decode_submission(raw_data, submitted_at, schema_fp) for raw_data, submitted_at, schema_fp in rows]
+    return json_codec.dumps({'task_id': 'bench', 'total_submissions': len(data_list), 'submissions': data_list})
+
+
+def passthrough_all(rows):
+    """透传：拼接已存储的JSON文本"""
+    items = [submission_json(raw_data, submitted_at, schema_fp) for raw_data, submitted_at, schema_fp in rows]
+    return splice_raw_array({'task_id': 'bench', 'total_submissions': len(items)}, 'submissions', items)
+
+
+def canonicalize_all(payloads):
+    for payload in payloads:
+        canonicalize_payload(payload)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm JSON编解码基准测试')
+    parser.add_argument('--rows', type=int, default=100000, help='任务的提交条数')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快一次')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"JSON编解码基准测试：{args.rows:,} 条提交，编解码器后端: {json_codec.BACKEND}")
+    print("=" * 60)
+
+    rows = make_rows(args.rows)
+    rng = random.Random(7)
+    payloads = [make_payload(rng, i) for i in range(args.rows)]
+    print(f"平均每条存储大小: {sum(len(r[0].encode('utf-8')) for r in rows) / len(rows):.0f} 字节")
+
+    # 三种方式输出的数据必须一致
+    expected = json.loads(legacy_all(rows[:1000]))
+    assert json.loads(codec_all(rows[:1000])) == expected
+    assert json.loads(passthrough_all(rows[:1000])) == expected
+
+    backends = [json_codec.BACKEND]
+    if json_codec.orjson:
+        backends.append('json')
+
+    results = []
+    elapsed, body = best_of(args.repeat, legacy_all, rows)
+    results.append(('原方式（标准库 loads + dumps）', elapsed, len(body.encode('utf-8'))))
+    saved_orjson = json_codec.orjson
+    try:
+        for backend in backends:
+            # 对比时临时禁用orjson，测量标准库回退路径
+            json_codec.orjson = saved_orjson if backend == 'orjson' else None
+            elapsed, body = best_of(args.repeat, codec_all, rows)
+            results.append((f'编解码器 [{backend}] loads + dumps', elapsed, len(body.encode('utf-8'))))
+            elapsed, body = best_of(args.repeat, passthrough_all, rows)
+            results.append((f'透传存储的JSON [{backend}]', elapsed, len(body.encode('utf-8'))))
+            elapsed, _ = best_of(args.repeat, canonicalize_all, payloads)
+            results.append((f'写入规范化 canonicalize [{backend}]', elapsed, None))
+    finally:
+        json_codec.orjson = saved_orjson
+
+    baseline = results[0][1]
+    print(f"\n{'方式':<40}{'耗时':>10}{'每秒条数':>14}{'相对原方式':>10}")
+    for name, elapsed, size in results:
+        print(f"{name:<40}{elapsed * 1000:>8.0f}ms{args.rows / elapsed:>14,.0f}{baseline / elapsed:>9.1f}x"
+              + (f"  响应 {size / 1024 / 1024:.1f}MB" if size else ''))
+    print("\n" + "=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+分析提示词生成基准测试
+验证 build_data_section 单遍遍历、只保留样例：耗时随提交数线性增长，内存峰值与提交数无关。
+分别测量三种情况：
+  - 遍历中统计字段（无数据库时的路径，每条都要解析）
+  - 使用预先汇总的字段统计（只解析被选中的样例）
+  - 总数未知（生成器输入，蓄水池采样）
+提交数据由生成器逐条产出，输入本身不占用内存。不访问数据库。
+
+用法: python bench_prompt_builder.py [--sizes 10000,100000,1000000] [--no-memory]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+from ai_service import build_data_section
+from field_stats_service import summarize_payloads
+from submission_service import canonicalize_payload, load_submission_data
+from bench_json_codec import make_payload
+
+POOL_SIZE = 1000  # 预先规范化的不同提交条数，循环使用
+
+
+def make_pool():
+    rng = random.Random(42)
+    pool = []
+    for i in range(POOL_SIZE):
+        data_json, schema_fp = canonicalize_payload(make_payload(rng, i))
+        pool.append(SimpleNamespace(data=data_json, schema_fp=schema_fp))
+    return pool
+
+
+def iter_rows(pool, count):
+    for i in range(count):
+        yield pool[i % POOL_SIZE]
+
+
+def run(pool, count, mode, field_stats):
+    task = SimpleNamespace(title='基准测试', description=None)
+    rows = iter_rows(pool, count)
+    if mode == 'stats':
+        return build_data_section(task, rows, total_count=count)
+    if mode == 'precomputed':
+        return build_data_section(task, rows, total_count=count, field_stats=field_stats)
+    return build_data_section(task, rows)
+
+
+def measure(pool, count, mode, field_stats, memory):
+    start = time.perf_counter()
+    section = run(pool, count, mode, field_stats)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        run(pool, count, mode, field_stats)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, len(section)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm 分析提示词生成基准测试')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='逗号分隔的提交条数')
+    parser.add_argument('--no-memory', action='store_true', help='不测量内存峰值（tracemalloc会拖慢运行）')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    print("=" * 60)
+    print(f"分析提示词生成基准测试：{', '.join(f'{size:,}' for size in sizes)} 条提交")
+    print("=" * 60)
+
+    pool = make_pool()
+    field_stats = summarize_payloads(load_submission_data(row.data, row.schema_fp) for row in pool)
+    modes = [
+        ('stats', '遍历中统计字段'),
+        ('precomputed', '预先汇总的字段统计'),
+        ('reservoir', '总数未知（蓄水池采样）'),
+    ]
+
+    print(f"\n{'方式':<24}{'提交数':>12}{'耗时':>10}{'每条耗时':>12}{'内存峰值':>12}{'提示词长度':>12}")
+    linear = True
+    for mode, label in modes:
+        per_row = []
+        for size in sizes:
+            elapsed, peak, length = measure(pool, size, mode, field_stats, not args.no_memory)
+            per_row.append(elapsed / size)
+            peak_text = f"{peak / 1024:.0f}KB" if peak is not None else '-'
+            print(f"{label:<24}{size:>12,}{elapsed * 1000:>8.0f}ms{elapsed / size * 1e9:>10.0f}ns{peak_text:>12}{length:>12,}")
+        ratio = max(per_row) / min(per_row)
+        print(f"{'':<24}每条耗时最大/最小: {ratio:.2f}")
+        linear = linear and ratio < 2
+    print("\n" + "=" * 60)
+    print("✓ 耗时随提交数线性增长" if linear else "⚠ 每条耗时随规模明显变化，请检查")
+
+
+if __name__ == '__main__':
+    main()
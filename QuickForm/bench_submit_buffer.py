@@ -0,0 +1,151 @@
+"""
+提交写缓冲基准测试
+在临时SQLite数据库上对比：逐条提交事务（原方式） vs 批量写缓冲（SubmissionWriter）
+
+用法: python bench_submit_buffer.py [--threads 50] [--count 40] [--batch-size 200] [--latency-ms 50] [--no-fsync]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+from models import Base, User, Task, Submission
+from submission_service import SubmissionWriter
+
+
+def make_session_factory(db_path):
+    engine = create_engine(f'sqlite:///{db_path}', connect_args={'check_same_thread': False, 'timeout': 60})
+
+    def _fk_pragma_on_connect(dbapi_con, connection_record):
+        dbapi_con.execute('PRAGMA foreign_keys=ON')
+
+    event.listen(engine, 'connect', _fk_pragma_on_connect)
+    Base.metadata.create_all(engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def create_task(SessionLocal):
+    db = SessionLocal()
+    try:
+        user = User(username='bench', email='bench@example.com', password='x')
+        db.add(user)
+        db.flush()
+        task = Task(title='基准测试任务', user_id=user.id)
+        db.add(task)
+        db.commit()
+        return task.id
+    finally:
+        db.close()
+
+
+def sample_payload(i):
+    return json.dumps({'姓名': f'学生{i}', '班级': f'{i % 12 + 1}班', '成绩': i % 100, '备注': '基准测试'}, ensure_ascii=False)
+
+
+def run_threads(threads, count, worker):
+    barrier = threading.Barrier(threads)
+
+    def target(tid):
+        barrier.wait()
+        for n in range(count):
+            worker(tid * count + n)
+
+    pool = [threading.Thread(target=target, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - start
+
+
+def count_rows(SessionLocal, task_pk):
+    db = SessionLocal()
+    try:
+        return db.query(func.count(Submission.id)).filter(Submission.task_id == task_pk).scalar()
+    finally:
+        db.close()
+
+
+def bench_direct(workdir, threads, count):
+    """原方式：每个请求一个会话、一次提交"""
+    engine, SessionLocal = make_session_factory(os.path.join(workdir, 'direct.db'))
+    task_pk = create_task(SessionLocal)
+
+    def worker(i):
+        db = SessionLocal()
+        try:
+            db.add(Submission(task_id=task_pk, data=sample_payload(i)))
+            db.commit()
+        finally:
+            db.close()
+
+    elapsed = run_threads(threads, count, worker)
+    rows = count_rows(SessionLocal, task_pk)
+    engine.dispose()
+    return elapsed, rows
+
+
+def bench_buffered(workdir, threads, count, batch_size, latency_ms, fsync):
+    """写缓冲：请求线程写落盘文件后返回，后台批量入库"""
+    engine, SessionLocal = make_session_factory(os.path.join(workdir, 'buffered.db'))
+    task_pk = create_task(SessionLocal)
+    writer = SubmissionWriter(SessionLocal, os.path.join(workdir, 'spool'),
+                              batch_size=batch_size, max_latency=latency_ms / 1000.0, fsync=fsync)
+    writer.start()
+
+    start = time.perf_counter()
+    ack_elapsed = run_threads(threads, count, lambda i: writer.submit(task_pk, sample_payload(i)))
+    writer.flush()
+    total_elapsed = time.perf_counter() - start
+    stats = writer.stats()
+    writer.stop()
+    rows = count_rows(SessionLocal, task_pk)
+    engine.dispose()
+    return ack_elapsed, total_elapsed, rows, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QuickForm 提交写缓冲基准测试')
+    parser.add_argument('--threads', type=int, default=50, help='并发提交线程数（模拟同时提交的学生）')
+    parser.add_argument('--count', type=int, default=40, help='每个线程提交次数')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--latency-ms', type=int, default=50)
+    parser.add_argument('--no-fsync', action='store_true', help='确认前不fsync落盘文件')
+    args = parser.parse_args()
+
+    total = args.threads * args.count
+    workdir = tempfile.mkdtemp(prefix='quickform_bench_')
+    try:
+        print("=" * 60)
+        print(f"提交写缓冲基准测试：{args.threads} 线程 × {args.count} 次 = {total} 条")
+        print("=" * 60)
+
+        elapsed, rows = bench_direct(workdir, args.threads, args.count)
+        print("\n【逐条事务（原方式）】")
+        print(f"耗时: {elapsed:.2f}s, 吞吐: {total / elapsed:,.0f} 条/秒, 入库: {rows:,} 条")
+
+        ack_elapsed, total_elapsed, rows, stats = bench_buffered(
+            workdir, args.threads, args.count, args.batch_size, args.latency_ms, not args.no_fsync
+        )
+        print(f"\n【批量写缓冲】batch_size={args.batch_size}, latency={args.latency_ms}ms, fsync={not args.no_fsync}")
+        print(f"确认耗时: {ack_elapsed:.2f}s, 确认吞吐: {total / ack_elapsed:,.0f} 条/秒")
+        print(f"全部入库耗时: {total_elapsed:.2f}s, 入库吞吐: {total / total_elapsed:,.0f} 条/秒, 入库: {rows:,} 条")
+        print(f"事务数: {stats['batches']}, 平均每批: {stats['avg_batch_size']} 条")
+        print("\n" + "=" * 60)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
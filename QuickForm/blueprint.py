@@ -3,40 +3,53 @@ QuickForm Blueprint
 将QuickForm改造为Blueprint，可以整合到主应用中
 """
 import os
-import json
 import math
 import random
 import re
-import threading
 import html
 import base64
 import uuid
+import hashlib
 from urllib.parse import unquote_plus
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, make_response, send_file, send_from_directory, current_app
-from sqlalchemy import create_engine, or_, text
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, make_response, Response, send_file, send_from_directory, current_app
+from sqlalchemy import create_engine, or_, text, func
 from sqlalchemy.orm import sessionmaker
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from flask_socketio import join_room
 from flask_bcrypt import Bcrypt
 from datetime import datetime
-import pandas as pd
-import io
 import matplotlib
 matplotlib.use('Agg')  # 使用非交互式后端
 import matplotlib.pyplot as plt
 from dotenv import load_dotenv
 import logging
-from functools import wraps
-from collections import deque
-from typing import Deque
+from functools import wraps, partial
+from collections import namedtuple
 
 # 导入分离的模块
-from models import Base, User, Task, Submission, AIConfig, migrate_database, CertificationRequest
+from models import Base, User, Task, Submission, AIConfig, migrate_database, CertificationRequest, stored_filename_of, RateLimitEvent, SubmissionFieldStat
 from file_service import save_uploaded_file, read_file_content, ALLOWED_EXTENSIONS, allowed_file, CERTIFICATION_ALLOWED_EXTENSIONS
-from ai_service import call_ai_model, generate_analysis_prompt, analyze_html_file
+from ai_service import call_ai_model, stream_ai_model, generate_analysis_prompt, analyze_html_file
 from report_service import (
     save_analysis_report, generate_report_image, perform_analysis_with_custom_prompt,
-    analysis_progress, analysis_results, completed_reports, progress_lock, timeout
+    analysis_state
 )
+from submission_service import (
+    SubmissionWriter, apply_submission_delta, refresh_last_submitted_at, keyset_page, decode_submission,
+    canonicalize_payload, submission_json, load_submission_data, count_task_submissions
+)
+from cache_service import LRUCache
+from rate_limit_service import build_rate_limiter, client_key, RateLimitEventRecorder, active_bans
+from export_service import iter_submission_rows, stream_ndjson, export_submissions, EXPORT_FORMATS, available_formats
+from export_job_service import ExportJobManager
+from http_client_service import provider_clients
+from ai_cache_service import ai_response_cache
+from ai_provider_service import provider_health
+from ai_admission_service import ai_admission
+from ai_gateway_service import ai_gateway
+from analysis_job_service import AnalysisJobExecutor, AnalysisQueueFull, PRIORITY_INTERACTIVE
+from field_stats_service import apply_field_stats, reset_field_stats, load_field_stats
+from json_codec import raw_json_response, splice_raw_array
 
 # 配置日志
 logging.basicConfig(
@@ -431,6 +444,7 @@ def create_task():
                     
                     task.file_name = file_name_base64
                     task.file_path = filepath
+                    task.stored_filename = stored_filename_of(filepath)
                     
                     # 如果是HTML文件，设置审核状态
                     if filepath.lower().endswith(('.html', '.htm')):
@@ -459,6 +473,7 @@ def create_task():
                     
                     task.file_name = file.filename
                     task.file_path = filepath
+                    task.stored_filename = stored_filename_of(filepath)
                     
                     # 如果是HTML文件，设置审核状态
                     if filepath.lower().endswith(('.html', '.htm')):
@@ -479,7 +494,7 @@ def create_task():
             # 如果是HTML文件，在任务保存后自动在后台分析
             if task.file_path and task.file_path.lower().endswith(('.html', '.htm')):
                 try:
-                    analyze_html_file(task.id, current_user.id, task.file_path, SessionLocal, Task, AIConfig, read_file_content, call_ai_model)
+                    analyze_html_file(task.id, current_user.id, task.file_path, SessionLocal, Task, AIConfig, read_file_content, call_ai_model, analysis_jobs)
                 except Exception as e:
                     logger.error(f"启动HTML文件分析失败: {str(e)}", exc_info=True)
             
@@ -517,31 +532,22 @@ def task_detail(task_id):
             flash('无权访问此任务', 'danger')
             return redirect(url_for('quickform.dashboard'))
         
-        page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
-        if page < 1:
-            page = 1
         if per_page < 1:
             per_page = 20
         elif per_page > 200:
             per_page = 200
+        cursor = request.args.get('cursor') or None
+        before = request.args.get('before') or None
 
-        submission_query = (
-            db.query(Submission)
-            .filter_by(task_id=task.id)
-            .order_by(Submission.submitted_at.desc())
-        )
-        total_submissions = submission_query.count()
-        total_pages = max(math.ceil(total_submissions / per_page), 1) if total_submissions else 1
-        if page > total_pages:
-            page = total_pages
-
-        submissions = (
-            submission_query
-            .offset((page - 1) * per_page)
-            .limit(per_page)
-            .all()
-        )
+        # 键集分页：按 (submitted_at, id) 定位，翻到任何位置耗时都不随偏移量增长
+        total_submissions = task.submission_count or 0
+        try:
+            submissions, next_cursor, prev_cursor = keyset_page(
+                db.query(Submission).filter_by(task_id=task.id), per_page, cursor=cursor, before=before
+            )
+        except ValueError:
+            return redirect(url_for('quickform.task_detail', task_id=task.id, per_page=per_page))
 
         saved_filename = None
         try:
@@ -551,18 +557,23 @@ def task_detail(task_id):
             saved_filename = None
 
         pagination = {
-            'page': page,
             'per_page': per_page,
-            'pages': total_pages
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+            'is_first': prev_cursor is None
         }
 
+        rate_limit_bans = active_bans(db, task.id, SUBMIT_BLACKLIST_DURATION)
+
         return render_template(
             'task_detail.html',
             task=task,
             submissions=submissions,
             total_submissions=total_submissions,
             pagination=pagination,
-            saved_filename=saved_filename
+            saved_filename=saved_filename,
+            rate_limit_bans=rate_limit_bans,
+            export_formats=available_formats()
         )
     finally:
         db.close()
@@ -620,6 +631,7 @@ def edit_task(task_id):
                     
                     task.file_name = file_name_base64
                     task.file_path = filepath
+                    task.stored_filename = stored_filename_of(filepath)
                     
                     # 如果是HTML文件，设置审核状态
                     if filepath.lower().endswith(('.html', '.htm')):
@@ -637,7 +649,7 @@ def edit_task(task_id):
                         
                         # 后台分析（不影响上传成功）
                         try:
-                            analyze_html_file(task.id, current_user.id, filepath, SessionLocal, Task, AIConfig, read_file_content, call_ai_model)
+                            analyze_html_file(task.id, current_user.id, filepath, SessionLocal, Task, AIConfig, read_file_content, call_ai_model, analysis_jobs)
                         except Exception as e:
                             logger.error(f"启动HTML文件分析失败(编辑): {str(e)}", exc_info=True)
                 except Exception as e:
@@ -659,6 +671,7 @@ def edit_task(task_id):
                     
                     task.file_name = file.filename
                     task.file_path = filepath
+                    task.stored_filename = stored_filename_of(filepath)
                     
                     # 如果是HTML文件，设置审核状态
                     if filepath.lower().endswith(('.html', '.htm')):
@@ -676,7 +689,7 @@ def edit_task(task_id):
                         
                         # 后台分析（不影响上传成功）
                         try:
-                            analyze_html_file(task.id, current_user.id, filepath, SessionLocal, Task, AIConfig, read_file_content, call_ai_model)
+                            analyze_html_file(task.id, current_user.id, filepath, SessionLocal, Task, AIConfig, read_file_content, call_ai_model, analysis_jobs)
                         except Exception as e:
                             logger.error(f"启动HTML文件分析失败(编辑): {str(e)}", exc_info=True)
             if remove_file:
@@ -684,9 +697,11 @@ def edit_task(task_id):
                     os.remove(task.file_path)
                 task.file_name = None
                 task.file_path = None
+                task.stored_filename = None
                 task.html_review_note = None
             
             db.commit()
+            task_slug_cache.pop(task.task_id)
             
             flash('任务更新成功', 'success')
             return redirect(url_for('quickform.task_detail', task_id=task.id))
@@ -715,12 +730,14 @@ def delete_task(task_id):
             flash('无权删除此任务', 'danger')
             return redirect(url_for('quickform.dashboard'))
         
-        # 显式删除所有相关的提交数据
-        submissions = db.query(Submission).filter_by(task_id=task.id).all()
-        submission_count = len(submissions)
-        
-        for submission in submissions:
-            db.delete(submission)
+        # 显式删除所有相关的提交数据（批量DELETE，不逐条加载）
+        submission_count = (
+            db.query(Submission)
+            .filter_by(task_id=task.id)
+            .delete(synchronize_session=False)
+        )
+        db.query(RateLimitEvent).filter_by(task_id=task.id).delete(synchronize_session=False)
+        db.query(SubmissionFieldStat).filter_by(task_id=task.id).delete(synchronize_session=False)
         
         # 删除任务文件（如果存在）
         if task.file_path and os.path.exists(task.file_path):
@@ -731,8 +748,12 @@ def delete_task(task_id):
                 logger.warning(f"删除任务文件失败: {task.file_path}, 错误: {str(e)}")
         
         # 删除任务
+        task_slug = task.task_id
         db.delete(task)
         db.commit()
+        task_slug_cache.pop(task_slug)
+        if export_jobs:
+            export_jobs.discard_task(task_id)
         
         if submission_count > 0:
             flash(f'任务已删除，同时删除了 {submission_count} 条提交数据', 'success')
@@ -760,7 +781,111 @@ SUBMIT_RATE_LIMIT_WINDOW = 10  # seconds
 SUBMIT_RATE_LIMIT_THRESHOLD = 50
 SUBMIT_BLACKLIST_DURATION = 300  # seconds
 
-rate_limit_cache = {}
+# 限流存储后端：memory（进程内）或 sqlite（多个worker进程共享同一数据库文件）
+SUBMIT_RATE_LIMIT_BACKEND = os.getenv('QUICKFORM_RATE_LIMIT_BACKEND', 'memory')
+SUBMIT_RATE_LIMIT_MAX_KEYS = int(os.getenv('QUICKFORM_RATE_LIMIT_MAX_KEYS', '10000'))
+SUBMIT_RATE_LIMIT_DB = os.getenv('QUICKFORM_RATE_LIMIT_DB', os.path.join(QUICKFORM_DIR, 'rate_limit.db'))
+
+submit_rate_limiter = build_rate_limiter(
+    SUBMIT_RATE_LIMIT_BACKEND, SUBMIT_RATE_LIMIT_WINDOW, SUBMIT_RATE_LIMIT_THRESHOLD,
+    SUBMIT_BLACKLIST_DURATION, max_keys=SUBMIT_RATE_LIMIT_MAX_KEYS, sqlite_path=SUBMIT_RATE_LIMIT_DB
+)
+
+# 封禁事件保留天数；事件由后台线程批量写入rate_limit_event表
+RATE_LIMIT_EVENT_RETENTION_DAYS = int(os.getenv('QUICKFORM_RATE_LIMIT_EVENT_RETENTION_DAYS', '30'))
+rate_limit_recorder = None  # 在init_quickform中启动
+
+# 提交写缓冲配置（可通过环境变量覆盖）：多条提交合并到一个事务写库
+SUBMIT_BUFFER_ENABLED = os.getenv('QUICKFORM_SUBMIT_BUFFER', '1') != '0'
+SUBMIT_BATCH_SIZE = int(os.getenv('QUICKFORM_SUBMIT_BATCH_SIZE', '200'))
+SUBMIT_BATCH_MAX_LATENCY_MS = int(os.getenv('QUICKFORM_SUBMIT_BATCH_LATENCY_MS', '50'))
+SUBMIT_SPOOL_FSYNC = os.getenv('QUICKFORM_SUBMIT_SPOOL_FSYNC', '1') != '0'
+SUBMIT_SPOOL_DIR = os.path.join(QUICKFORM_DIR, 'spool')
+
+submission_writer = None  # 在init_quickform中启动
+
+# 后台导出任务：导出文件缓存目录及其大小/年龄上限、并发导出数
+EXPORT_CACHE_DIR = os.getenv('QUICKFORM_EXPORT_CACHE_DIR', os.path.join(QUICKFORM_DIR, 'export_cache'))
+EXPORT_CACHE_MAX_MB = int(os.getenv('QUICKFORM_EXPORT_CACHE_MAX_MB', '512'))
+EXPORT_CACHE_MAX_AGE_HOURS = float(os.getenv('QUICKFORM_EXPORT_CACHE_MAX_AGE_HOURS', '24'))
+EXPORT_WORKERS = int(os.getenv('QUICKFORM_EXPORT_WORKERS', '2'))
+
+export_jobs = None  # 在init_quickform中启动
+
+# AI分析任务执行器：工作线程数（全局并发上限）、每用户并发数、排队上限
+ANALYSIS_WORKERS = int(os.getenv('QUICKFORM_ANALYSIS_WORKERS', '4'))
+ANALYSIS_MAX_PER_USER = int(os.getenv('QUICKFORM_ANALYSIS_MAX_PER_USER', '1'))
+ANALYSIS_MAX_QUEUE = int(os.getenv('QUICKFORM_ANALYSIS_MAX_QUEUE', '100'))
+ANALYSIS_MAX_QUEUED_PER_USER = int(os.getenv('QUICKFORM_ANALYSIS_MAX_QUEUED_PER_USER', '5'))
+
+analysis_jobs = None  # 在init_quickform中启动
+
+# 智能分析报告以流式方式生成，输出通过SocketIO实时推送给任务所有者（关闭后只能轮询完整报告）
+AI_STREAM_ENABLED = os.getenv('QUICKFORM_AI_STREAM', '1') != '0'
+SOCKETIO_NAMESPACE = '/quickform'
+socketio = None  # 在register_socketio中设置
+
+# /api/submit/<task_id>/all 分页参数
+SUBMISSIONS_API_DEFAULT_LIMIT = 100
+SUBMISSIONS_API_MAX_LIMIT = 1000
+
+# 公开提交API的任务缓存：公开task_id -> 任务主键与标题，避免每次请求都查询task表
+# 在edit_task/delete_task中显式失效；TTL兜底多进程部署下其他进程的修改
+TASK_SLUG_CACHE_SIZE = int(os.getenv('QUICKFORM_TASK_CACHE_SIZE', '2048'))
+TASK_SLUG_CACHE_TTL = int(os.getenv('QUICKFORM_TASK_CACHE_TTL', '300'))
+task_slug_cache = LRUCache(maxsize=TASK_SLUG_CACHE_SIZE, ttl=TASK_SLUG_CACHE_TTL)
+
+# 智能分析页的预览提示词缓存：键包含任务的数据水位以及模板/HTML分析结果等文本的摘要，任一变化即不再命中
+PROMPT_PREVIEW_CACHE_SIZE = int(os.getenv('QUICKFORM_PROMPT_CACHE_SIZE', '256'))
+prompt_preview_cache = LRUCache(maxsize=PROMPT_PREVIEW_CACHE_SIZE)
+
+TaskRef = namedtuple('TaskRef', ['id', 'task_id', 'title'])
+
+
+def _lookup_task_ref(db, task_id):
+    """按公开task_id查找任务，命中缓存时不访问数据库"""
+    ref = task_slug_cache.get(task_id)
+    if ref is None:
+        row = db.query(Task.id, Task.task_id, Task.title).filter_by(task_id=task_id).first()
+        if not row:
+            return None
+        ref = TaskRef(row.id, row.task_id, row.title)
+        task_slug_cache.set(task_id, ref)
+    return ref
+
+
+def _submission_etag(db, task, variant=''):
+    """根据任务的提交计数与最后提交时间生成ETag，只读task表，不访问submission表
+
+    Returns:
+        (etag, submission_count)；任务不存在时返回 (None, 0)
+    """
+    row = db.query(Task.submission_count, Task.last_submitted_at).filter_by(id=task.id).first()
+    if not row:
+        return None, 0
+    count = row.submission_count or 0
+    last = row.last_submitted_at.isoformat() if row.last_submitted_at else ''
+    raw = f"{task.id}|{count}|{last}|{task.title}|{variant}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24], count
+
+
+def _not_modified_response(etag, methods):
+    """客户端缓存的数据仍然有效时返回304"""
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = methods
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
+    return response
+
+
+def _set_etag_headers(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
+    return response
 
 
 @quickform_bp.route('/api/submit/<string:task_id>', methods=['GET', 'POST', 'OPTIONS'])
@@ -770,13 +895,20 @@ def submit_form(task_id):
         response = make_response()
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
         response.headers['Content-Type'] = 'text/plain; charset=utf-8'
         return response
+
+    # 已封禁的客户端在查询任务和解析请求体之前直接拒绝
+    if request.method == 'POST':
+        client_ip = client_key(request.headers.get('X-Forwarded-For'), request.remote_addr)
+        if submit_rate_limiter.is_blacklisted(client_ip):
+            logger.warning(f"IP {client_ip} 正在黑名单中，拒绝 task_id={task_id} 的提交")
+            return _rate_limit_response(None, client_ip)
         
     db = SessionLocal()
     try:
-        task = db.query(Task).filter_by(task_id=task_id).first()
+        task = _lookup_task_ref(db, task_id)
         if not task:
             response = jsonify({'error': '任务不存在', 'task_id': task_id, 'message': f'未找到ID为 {task_id} 的任务'})
             response.headers['Access-Control-Allow-Origin'] = '*'
@@ -787,28 +919,14 @@ def submit_form(task_id):
         
         # GET方法：返回任务数据统计（只返回最新的3条）
         if request.method == 'GET':
+            # 数据未变化时直接返回304，不查询submission表
+            etag, total_count = _submission_etag(db, task, 'latest')
+            if etag and request.if_none_match.contains(etag):
+                return _not_modified_response(etag, 'GET, POST, OPTIONS')
+
             # 只获取最新的3条数据
             submissions = db.query(Submission).filter_by(task_id=task.id).order_by(Submission.submitted_at.desc()).limit(3).all()
-            total_count = db.query(Submission).filter_by(task_id=task.id).count()
-            data_list = []
-            for sub in submissions:
-                try:
-                    # 尝试解析JSON数据
-                    data = json.loads(sub.data)
-                    # 如果解析后是字符串，可能是双重编码，再解析一次
-                    if isinstance(data, str):
-                        try:
-                            data = json.loads(data)
-                        except:
-                            pass
-                    data['submitted_at'] = sub.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-                    data_list.append(data)
-                except (json.JSONDecodeError, TypeError):
-                    # 如果解析失败，返回原始数据作为raw_data
-                    data_list.append({
-                        'submitted_at': sub.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
-                        'raw_data': sub.data
-                    })
+            data_list = [decode_submission(sub.data, sub.submitted_at, sub.schema_fp) for sub in submissions]
             
             response = jsonify({
                 'task_id': task.task_id,
@@ -816,26 +934,14 @@ def submit_form(task_id):
                 'total_submissions': total_count,
                 'submissions': data_list
             })
+            if etag:
+                _set_etag_headers(response, etag)
             response.headers['Access-Control-Allow-Origin'] = '*'
             response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
             return response, 200
         
         # POST方法：提交数据
-        client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        now_ts = datetime.utcnow().timestamp()
-
-        ip_info = rate_limit_cache.setdefault(client_ip, {
-            'events': deque(),
-            'blacklist_until': 0,
-            'blocked_tasks': {}
-        })
-
-        # 检查黑名单
-        if ip_info['blacklist_until'] and now_ts < ip_info['blacklist_until']:
-            logger.warning(f"IP {client_ip} 正在黑名单中，拒绝 task_id={task_id} 的提交")
-            return _rate_limit_response(task_id, client_ip, now_ts, db)
-        
         # 获取提交的数据
         try:
             if request.is_json:
@@ -850,25 +956,29 @@ def submit_form(task_id):
             response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
             return response, 400
         
-        # 速率限制处理
-        events: Deque = ip_info['events']
-        while events and now_ts - events[0] > SUBMIT_RATE_LIMIT_WINDOW:
-            events.popleft()
-        events.append(now_ts)
-
-        if len(events) > SUBMIT_RATE_LIMIT_THRESHOLD:
-            ip_info['blacklist_until'] = now_ts + SUBMIT_BLACKLIST_DURATION
-            ip_info['blocked_tasks'][task.id] = now_ts
+        # 速率限制处理（使用限流器自己的时钟 time.time()，与预检查 is_blacklisted 一致）
+        limit_result = submit_rate_limiter.hit(client_ip)
+        if not limit_result.allowed:
+            if not limit_result.blacklisted_now:
+                # 并发请求在预检查之后才被其他请求封禁，不重复记录日志
+                return _rate_limit_response(None, client_ip)
             logger.warning(
-                f"IP {client_ip} 在 {SUBMIT_RATE_LIMIT_WINDOW}s 内提交 {len(events)} 次，已加入黑名单 {SUBMIT_BLACKLIST_DURATION}s"
+                f"IP {client_ip} 在 {SUBMIT_RATE_LIMIT_WINDOW}s 内提交约 {int(limit_result.count)} 次，已加入黑名单 {SUBMIT_BLACKLIST_DURATION}s"
             )
-            return _rate_limit_response(task_id, client_ip, now_ts, db)
+            return _rate_limit_response(task, client_ip)
         
-        # 将数据转换为JSON字符串存储
+        # 规范化为紧凑JSON（解开双重编码）并计算结构指纹，读取时无需再做兼容处理
         try:
-            submission = Submission(task_id=task.id, data=json.dumps(form_data, ensure_ascii=False))
-            db.add(submission)
-            db.commit()
+            data_json, schema_fp = canonicalize_payload(form_data)
+            if submission_writer:
+                # 写入落盘文件后即返回，由后台线程批量入库
+                submission_writer.submit(task.id, data_json, schema_fp=schema_fp)
+            else:
+                submitted_at = datetime.now()
+                db.add(Submission(task_id=task.id, data=data_json, submitted_at=submitted_at, schema_fp=schema_fp))
+                apply_submission_delta(db, task.id, 1, submitted_at)
+                apply_field_stats(db, task.id, [load_submission_data(data_json, schema_fp)])
+                db.commit()
         except Exception as e:
             db.rollback()
             logger.error(f"保存提交数据失败: {str(e)}")
@@ -894,23 +1004,25 @@ def submit_form(task_id):
         db.close()
 
 
-def _rate_limit_response(task_id, client_ip, ts, db):
-    if db:
-        task = db.query(Task).filter_by(task_id=task_id).first()
-        if task:
-            notice = f"IP {client_ip} 在 {SUBMIT_RATE_LIMIT_WINDOW}s 内多次提交，已暂时封禁 {SUBMIT_BLACKLIST_DURATION // 60} 分钟"
-            log_entry = f"[{datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {notice}"
-            existing = task.rate_limit_log or ''
-            if existing:
-                task.rate_limit_log = existing + '\n' + log_entry
-            else:
-                task.rate_limit_log = log_entry
+def _rate_limit_response(task_ref, client_ip):
+    """返回429；task_ref不为空时（本次请求触发了封禁）记录一条封禁事件"""
+    if task_ref:
+        if rate_limit_recorder:
+            rate_limit_recorder.record(task_ref.id, client_ip, SUBMIT_RATE_LIMIT_WINDOW, SUBMIT_BLACKLIST_DURATION)
+        else:
+            db = SessionLocal()
             try:
+                db.add(RateLimitEvent(
+                    task_id=task_ref.id, client_ip=client_ip[:64],
+                    window_seconds=SUBMIT_RATE_LIMIT_WINDOW, ban_seconds=SUBMIT_BLACKLIST_DURATION
+                ))
                 db.commit()
             except Exception as e:
                 db.rollback()
-                logger.error(f"记录限流日志失败: {str(e)}")
- 
+                logger.error(f"记录限流事件失败: {str(e)}")
+            finally:
+                db.close()
+
     response = jsonify({'error': 'rate_limit', 'message': '提交过于频繁，请稍后再试'})
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
@@ -924,13 +1036,13 @@ def submit_form_all(task_id):
         response = make_response()
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
         response.headers['Content-Type'] = 'text/plain; charset=utf-8'
         return response
     
     db = SessionLocal()
     try:
-        task = db.query(Task).filter_by(task_id=task_id).first()
+        task = _lookup_task_ref(db, task_id)
         if not task:
             response = jsonify({'error': '任务不存在', 'task_id': task_id, 'message': f'未找到ID为 {task_id} 的任务'})
             response.headers['Access-Control-Allow-Origin'] = '*'
@@ -939,37 +1051,72 @@ def submit_form_all(task_id):
             logger.warning(f"请求失败: 任务不存在 - task_id: {task_id}")
             return response, 404
         
-        # 返回全部数据
-        submissions = db.query(Submission).filter_by(task_id=task.id).order_by(Submission.submitted_at.desc()).all()
-        data_list = []
-        for sub in submissions:
+        # ETag 按查询参数区分不同的表示；数据未变化时直接返回304，不查询submission表
+        variant = 'all?' + '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        etag, total_count = _submission_etag(db, task, variant)
+        if etag and request.if_none_match.contains(etag):
+            return _not_modified_response(etag, 'GET, OPTIONS')
+
+        # format=ndjson/csv 时流式输出：服务端游标逐批读取，边解析边发送，内存占用恒定
+        fmt = (request.args.get('format') or '').lower()
+        if fmt in ('ndjson', 'csv'):
+            if fmt == 'ndjson':
+                rows = iter_submission_rows(SessionLocal, task.id, as_json=True)
+                response = Response(stream_ndjson(rows), content_type='application/x-ndjson; charset=utf-8')
+            else:
+                response = Response(
+                    export_submissions(SessionLocal, task.id, 'csv', newest_first=True),
+                    content_type='text/csv; charset=utf-8'
+                )
+                response.headers['Content-Disposition'] = f'attachment; filename="{task.task_id}.csv"'
+            if etag:
+                _set_etag_headers(response, etag)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
+            return response, 200
+
+        # 传入 limit/cursor 时按游标分页返回，否则返回全部数据（兼容旧调用方）
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor') or None
+        paginated = bool(limit or cursor)
+        next_cursor = None
+        if paginated:
+            limit = min(max(limit or SUBMISSIONS_API_DEFAULT_LIMIT, 1), SUBMISSIONS_API_MAX_LIMIT)
             try:
-                # 尝试解析JSON数据
-                data = json.loads(sub.data)
-                # 如果解析后是字符串，可能是双重编码，再解析一次
-                if isinstance(data, str):
-                    try:
-                        data = json.loads(data)
-                    except:
-                        pass
-                data['submitted_at'] = sub.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-                data_list.append(data)
-            except (json.JSONDecodeError, TypeError):
-                # 如果解析失败，返回原始数据作为raw_data
-                data_list.append({
-                    'submitted_at': sub.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'raw_data': sub.data
-                })
+                submissions, next_cursor, _ = keyset_page(
+                    db.query(Submission).filter_by(task_id=task.id), limit, cursor=cursor
+                )
+            except ValueError as e:
+                response = jsonify({'error': '参数错误', 'message': str(e)})
+                response.headers['Access-Control-Allow-Origin'] = '*'
+                response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+                response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+                return response, 400
+        else:
+            submissions = (
+                db.query(Submission)
+                .filter_by(task_id=task.id)
+                .order_by(Submission.submitted_at.desc(), Submission.id.desc())
+                .all()
+            )
+        # 已规范化的提交直接拼接存储的JSON，不做解析和重新编码
+        items = [submission_json(sub.data, sub.submitted_at, sub.schema_fp) for sub in submissions]
         
-        response = jsonify({
+        payload = {
             'task_id': task.task_id,
             'task_title': task.title,
-            'total_submissions': len(data_list),
-            'submissions': data_list
-        })
+            'total_submissions': len(items)
+        }
+        if paginated:
+            payload['total_submissions'] = total_count
+            payload['next_cursor'] = next_cursor
+        response = raw_json_response(splice_raw_array(payload, 'submissions', items))
+        if etag:
+            _set_etag_headers(response, etag)
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
         return response, 200
     except Exception as e:
         logger.error(f"API异常: {str(e)}", exc_info=True)
@@ -1013,7 +1160,8 @@ def list_tasks():
 @quickform_bp.route('/export/<int:task_id>')
 @login_required
 def export_data(task_id):
-    """导出数据"""
+    """导出数据（?format=xlsx/csv/parquet，默认xlsx）；逐批读取数据库并分块发送，内存占用与数据量无关"""
+    fmt = (request.args.get('format') or 'xlsx').lower()
     db = SessionLocal()
     try:
         task = db.get(Task, task_id)
@@ -1021,41 +1169,121 @@ def export_data(task_id):
             flash('无权访问此数据', 'danger')
             return redirect(url_for('quickform.dashboard'))
         
-        submission = db.query(Submission).filter_by(task_id=task.id).all()
-        
-        if not submission:
+        if not task.submission_count:
             flash('没有可导出的数据', 'info')
             return redirect(url_for('quickform.task_detail', task_id=task_id))
+
+        if fmt not in available_formats():
+            flash(f'不支持的导出格式: {fmt}' + ('（需要安装pyarrow）' if fmt == 'parquet' else ''), 'warning')
+            return redirect(url_for('quickform.task_detail', task_id=task_id))
         
-        data_list = []
-        for sub in submission:
-            try:
-                data = json.loads(sub.data)
-                data['submitted_at'] = sub.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-                data_list.append(data)
-            except:
-                data_list.append({
-                    'submitted_at': sub.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'raw_data': sub.data
-                })
-        
-        df = pd.DataFrame(data_list)
-        
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='提交数据')
-        output.seek(0)
-        
-        filename = f"{task.title}_数据导出_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        try:
-            return send_file(output, download_name=filename, as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        except TypeError:
-            return send_file(output, attachment_filename=filename, as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        title = task.title
+    finally:
+        db.close()
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    filename = f"{title}_数据导出_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+    # 数据未变化时直接发送缓存的导出文件
+    cached_path = export_jobs.cached_artifact(task_id, fmt) if export_jobs else None
+    if cached_path:
+        return send_file(cached_path, mimetype=content_type, as_attachment=True, download_name=filename)
+
+    try:
+        body = export_submissions(SessionLocal, task_id, fmt)
     except Exception as e:
+        logger.error(f"导出数据失败: {str(e)}", exc_info=True)
         flash(f'导出数据时出错: {str(e)}', 'danger')
         return redirect(url_for('quickform.task_detail', task_id=task_id))
+
+    response = Response(body, content_type=content_type)
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+def _export_job_json(job):
+    """导出任务状态（不含服务器路径等内部字段）"""
+    result = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'format': job['format'],
+        'rows': job['rows'],
+        'total': job['total'],
+        'progress': min(100, int(job['rows'] * 100 / job['total'])) if job['total'] else 100,
+        'cached': job['cached']
+    }
+    if job['status'] == 'completed':
+        result['download_url'] = url_for('quickform.export_job_download', job_id=job['job_id'])
+    if job['status'] == 'error':
+        result['message'] = job['error']
+    return result
+
+def _owned_export_job(job_id):
+    job = export_jobs.get(job_id) if export_jobs else None
+    if not job or job['user_id'] != current_user.id:
+        return None
+    return job
+
+@quickform_bp.route('/export/<int:task_id>/jobs', methods=['POST'])
+@login_required
+def export_job_create(task_id):
+    """创建后台导出任务（?format=xlsx/csv/parquet），返回任务状态；数据未变化时直接返回已完成的任务"""
+    if not export_jobs:
+        return jsonify({'status': 'error', 'message': '导出服务未启动'}), 503
+    fmt = (request.args.get('format') or 'xlsx').lower()
+    db = SessionLocal()
+    try:
+        task = db.get(Task, task_id)
+        if not task or task.user_id != current_user.id:
+            return jsonify({'status': 'error', 'message': '无权访问此数据'}), 403
+        title = task.title
+    finally:
+        db.close()
+
+    try:
+        job = export_jobs.submit(task_id, current_user.id, fmt, f"{title}_数据导出_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"创建导出任务失败: {str(e)}", exc_info=True)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return jsonify(_export_job_json(job)), 202 if job['status'] in ('queued', 'running') else 200
+
+@quickform_bp.route('/export/jobs/<job_id>', methods=['GET'])
+@login_required
+def export_job_status(job_id):
+    """查询导出任务进度（供前端轮询）"""
+    job = _owned_export_job(job_id)
+    if not job:
+        return jsonify({'status': 'not_found'}), 404
+    return jsonify(_export_job_json(job)), 200
+
+@quickform_bp.route('/export/jobs/<job_id>/download', methods=['GET'])
+@login_required
+def export_job_download(job_id):
+    """下载已完成的导出文件"""
+    job = _owned_export_job(job_id)
+    if not job or job['status'] != 'completed':
+        flash('导出任务不存在或尚未完成', 'warning')
+        return redirect(url_for('quickform.dashboard'))
+    if not os.path.exists(job['path']):
+        # 文件已被淘汰或数据已变化，重新导出
+        flash('导出文件已过期，请重新导出', 'info')
+        return redirect(url_for('quickform.task_detail', task_id=job['task_id']))
+    return send_file(job['path'], mimetype=EXPORT_FORMATS[job['format']][0], as_attachment=True, download_name=job['filename'])
+
+@quickform_bp.route('/task/<int:task_id>/field_stats', methods=['GET'])
+@login_required
+def task_field_stats(task_id):
+    """任务各字段的汇总统计（增量维护，读取代价与字段数成正比）"""
+    db = SessionLocal()
+    try:
+        task = db.get(Task, task_id)
+        if not task or task.user_id != current_user.id:
+            return jsonify({'error': '无权访问此数据'}), 403
+        total = task.submission_count or 0
     finally:
         db.close()
+    return jsonify({'task_id': task_id, 'total_submissions': total, 'fields': load_field_stats(SessionLocal, task_id)})
 
 @quickform_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -1234,7 +1462,9 @@ def test_ai_api():
             test_prompt = '这是一次连通性测试，请简短回复“OK”。'
 
         try:
-            response_text = call_ai_model(test_prompt, ai_config)
+            # 连通性测试总是实际调用服务商：缓存的响应说明不了服务商当前是否可用
+            # 只测试所选模型：不故障转移到其他服务商，也不对冲，否则无效的密钥也会显示成功
+            response_text = call_ai_model(test_prompt, ai_config, use_cache=False, failover=False)
         except Exception as e:
             logger.error(f"AI配置测试失败: {str(e)}")
             return jsonify({'success': False, 'message': str(e)}), 500
@@ -1254,6 +1484,57 @@ def test_ai_api():
     finally:
         db.close()
 
+def _build_preview_prompt(db, task):
+    """生成智能分析页的预览提示词：保存的提示词中的数据条数与当前一致且没有用户模板时沿用保存的提示词"""
+    current_submission_count = count_task_submissions(db, task.id)
+    
+    # 检查保存的提示词中的数据条数是否与当前实际数据条数一致
+    should_regenerate_prompt = False
+    if task.custom_prompt and task.custom_prompt.strip():
+        # 尝试从提示词中提取数据条数
+        # 匹配 "总提交数量：X 条" 或 "共有 X 条提交记录"
+        count_patterns = [
+            r'总提交数量[：:]\s*(\d+)\s*条',
+            r'共有\s*(\d+)\s*条提交记录',
+            r'总提交数量[：:]\s*(\d+)',
+        ]
+        saved_count = None
+        for pattern in count_patterns:
+            match = re.search(pattern, task.custom_prompt)
+            if match:
+                saved_count = int(match.group(1))
+                break
+        
+        # 如果提取到数量且与当前数量不一致，需要重新生成
+        if saved_count is not None and saved_count != current_submission_count:
+            should_regenerate_prompt = True
+            logger.info(f"任务 {task.id} 的数据条数已更新：{saved_count} -> {current_submission_count}，重新生成提示词")
+    else:
+        # 如果没有保存的提示词，需要生成
+        should_regenerate_prompt = True
+    
+    # 根据检查结果决定使用保存的提示词还是重新生成
+    # 使用用户模板（如果有）生成预览提示词
+    user_template = task.user_prompt_template if task.user_prompt_template else None
+    if should_regenerate_prompt:
+        preview_prompt = generate_analysis_prompt(task, None, None, SessionLocal, Submission, user_template=user_template)
+        # 更新保存的提示词（但不立即提交，让用户可以选择是否保存）
+    else:
+        # 如果数据条数没有变化，但用户模板可能已更新，使用用户模板重新生成
+        if user_template:
+            preview_prompt = generate_analysis_prompt(task, None, None, SessionLocal, Submission, user_template=user_template)
+        else:
+            preview_prompt = task.custom_prompt
+    return preview_prompt
+
+def _prompt_preview_key(task):
+    """(任务, 提交数, 最后提交时间, 文本摘要)；只使用任务行上的字段，计算时不访问提交表"""
+    digest = hashlib.sha1()
+    for value in (task.title, task.description, task.user_prompt_template, task.html_analysis, task.custom_prompt):
+        digest.update((value or '').encode('utf-8'))
+        digest.update(b'\0')
+    return (task.id, task.submission_count or 0, task.last_submitted_at, digest.hexdigest())
+
 @quickform_bp.route('/analyze/<int:task_id>/smart_analyze', methods=['GET', 'POST'])
 @login_required
 def smart_analyze(task_id):
@@ -1298,12 +1579,7 @@ def smart_analyze(task_id):
                 return redirect(url_for('quickform.smart_analyze', task_id=task.id))
             
             # 生成报告的逻辑
-            # 获取提交数据并生成完整提示词
-            submission_for_prompt = db.query(Submission).filter_by(task_id=task_id).all()
-            file_content_for_prompt = None
-            if task.file_path and os.path.exists(task.file_path):
-                file_content_for_prompt = read_file_content(task.file_path)
-            
+            # 生成完整提示词（样例在数据库中选取，不加载全部提交）
             # 检查是否有自定义的完整提示词（用户可能直接编辑了完整提示词）
             custom_prompt = request.form.get('custom_prompt', '').strip()
             if custom_prompt:
@@ -1312,71 +1588,60 @@ def smart_analyze(task_id):
             else:
                 # 使用用户模板（如果有）生成完整提示词
                 user_template = task.user_prompt_template if task.user_prompt_template else None
-                custom_prompt = generate_analysis_prompt(task, submission_for_prompt, file_content_for_prompt, SessionLocal, Submission, user_template=user_template)
+                custom_prompt = generate_analysis_prompt(task, None, None, SessionLocal, Submission, user_template=user_template)
             
             # 保存完整提示词（用于兼容旧代码）
             task.custom_prompt = custom_prompt
             db.commit()
             
+            # 勾选"不使用缓存"时重新调用模型，新的结果会覆盖缓存
+            call_model, stream_model = call_ai_model, stream_ai_model
+            if request.form.get('no_cache') == '1':
+                call_model, stream_model = partial(call_ai_model, use_cache=False), partial(stream_ai_model, use_cache=False)
+            
+            # 交给分析任务执行器（优先于后台HTML分析），进度在执行前显示为排队中
+            # 排队状态带有本次提交的标记，执行开始后会被任务自己的进度覆盖
+            queued_token = uuid.uuid4().hex
+            queued = {'status': 'in_progress', 'progress': 0, 'message': '已提交，等待执行...', 'queued_token': queued_token}
+            previous = analysis_state.get(task_id)
+            analysis_state.set(task_id, queued)
             try:
-                # 后台线程执行，避免阻塞主请求线程
-                t = threading.Thread(target=perform_analysis_with_custom_prompt, args=(
+                ahead = analysis_jobs.submit(
+                    current_user.id, perform_analysis_with_custom_prompt,
                     task_id, current_user.id, ai_config.id, custom_prompt,
                     SessionLocal, Task, Submission, AIConfig,
-                    read_file_content, call_ai_model, save_analysis_report
-                ), daemon=True)
-                t.start()
-                # 跳转到本页并标记运行中，前端据此开始轮询
-                return redirect(url_for('quickform.smart_analyze', task_id=task.id, running=1))
+                    read_file_content, call_model, save_analysis_report,
+                    stream_model if AI_STREAM_ENABLED else None, emit_to_user,
+                    priority=PRIORITY_INTERACTIVE, key=('report', task_id), name='analysis_report'
+                )
             except Exception as e:
+                if previous is None:
+                    analysis_state.delete(task_id, if_match={'queued_token': queued_token})
+                else:
+                    analysis_state.update(task_id, previous, if_match={'queued_token': queued_token}, replace=True)
+                if isinstance(e, AnalysisQueueFull):
+                    flash(str(e), 'warning')
+                    return redirect(url_for('quickform.smart_analyze', task_id=task.id))
                 return render_template('smart_analyze.html', task=task, error=f'生成报告失败: {str(e)}', ai_config=ai_config, now=datetime.now(), model_label=model_label)
+            if ahead is None:
+                # 该任务的报告已在排队或生成中，沿用原有进度
+                if previous is not None:
+                    analysis_state.update(task_id, previous, if_match={'queued_token': queued_token}, replace=True)
+            elif ahead:
+                analysis_state.update(task_id, {'message': f'排队中，前面还有 {ahead} 个分析任务...'},
+                                      if_match={'queued_token': queued_token})
+            # 跳转到本页并标记运行中，前端据此开始轮询
+            return redirect(url_for('quickform.smart_analyze', task_id=task.id, running=1))
         
         # GET 或 POST 完成后，准备页面所需数据
         # 刷新task对象以获取最新的html_analysis和custom_prompt
         db.refresh(task)
-        submission = db.query(Submission).filter_by(task_id=task_id).all()
-        current_submission_count = len(submission)
-        file_content = None
-        if task.file_path and os.path.exists(task.file_path):
-            file_content = read_file_content(task.file_path)
-        
-        # 检查保存的提示词中的数据条数是否与当前实际数据条数一致
-        should_regenerate_prompt = False
-        if task.custom_prompt and task.custom_prompt.strip():
-            # 尝试从提示词中提取数据条数
-            # 匹配 "总提交数量：X 条" 或 "共有 X 条提交记录"
-            count_patterns = [
-                r'总提交数量[：:]\s*(\d+)\s*条',
-                r'共有\s*(\d+)\s*条提交记录',
-                r'总提交数量[：:]\s*(\d+)',
-            ]
-            saved_count = None
-            for pattern in count_patterns:
-                match = re.search(pattern, task.custom_prompt)
-                if match:
-                    saved_count = int(match.group(1))
-                    break
-            
-            # 如果提取到数量且与当前数量不一致，需要重新生成
-            if saved_count is not None and saved_count != current_submission_count:
-                should_regenerate_prompt = True
-                logger.info(f"任务 {task_id} 的数据条数已更新：{saved_count} -> {current_submission_count}，重新生成提示词")
-        else:
-            # 如果没有保存的提示词，需要生成
-            should_regenerate_prompt = True
-        
-        # 根据检查结果决定使用保存的提示词还是重新生成
-        # 使用用户模板（如果有）生成预览提示词
-        user_template = task.user_prompt_template if task.user_prompt_template else None
-        if should_regenerate_prompt:
-            preview_prompt = generate_analysis_prompt(task, submission, file_content, SessionLocal, Submission, user_template=user_template)
-            # 更新保存的提示词（但不立即提交，让用户可以选择是否保存）
-        else:
-            # 如果数据条数没有变化，但用户模板可能已更新，使用用户模板重新生成
-            if user_template:
-                preview_prompt = generate_analysis_prompt(task, submission, file_content, SessionLocal, Submission, user_template=user_template)
-            else:
-                preview_prompt = task.custom_prompt
+        # 数据、模板、HTML分析结果都没有变化时直接使用缓存的预览提示词
+        preview_key = _prompt_preview_key(task)
+        preview_prompt = prompt_preview_cache.get(preview_key)
+        if preview_prompt is None:
+            preview_prompt = _build_preview_prompt(db, task)
+            prompt_preview_cache.set(preview_key, preview_prompt)
         
         report = task.analysis_report if task and task.analysis_report else None
         user_prompt_template = task.user_prompt_template if task.user_prompt_template else ''
@@ -1384,8 +1649,7 @@ def smart_analyze(task_id):
         running_flag = request.args.get('running') == '1'
         should_redirect = False
         if running_flag:
-            with progress_lock:
-                prog = analysis_progress.get(task.id)
+            prog = analysis_state.get(task.id)
             if prog and prog.get('status') == 'completed':
                 should_redirect = True
         if should_redirect:
@@ -1445,7 +1709,7 @@ def uploaded_file(filename):
             db = SessionLocal()
             try:
                 # 查找包含此文件名的任务
-                task = db.query(Task).filter(Task.file_path.like(f'%{filename}')).first()
+                task = db.query(Task).filter(Task.stored_filename == stored_filename_of(filename)).first()
                 if task:
                     # 管理员可直接访问原始文件
                     if current_user.is_authenticated and current_user.is_admin():
@@ -1531,18 +1795,17 @@ def generate_report(task_id):
 def report_status(task_id):
     """查询报告生成进度/结果（供前端轮询）"""
     try:
-        with progress_lock:
-            prog = analysis_progress.get(task_id)
-            if prog:
-                # 如果已完成且内存中有报告，直接返回报告
-                if prog.get('status') == 'completed':
-                    rep = analysis_results.get(task_id)
-                    return jsonify({'status': 'completed', 'report': rep or prog.get('report', '')}), 200
-                if prog.get('status') == 'error':
-                    return jsonify({'status': 'error', 'message': prog.get('message', '未知错误')}), 200
-                # 进行中
-                return jsonify({'status': 'in_progress', 'progress': prog.get('progress', 0), 'message': prog.get('message', '')}), 200
-        # 兜底：查数据库是否已有报告
+        prog = analysis_state.get(task_id)
+        if prog:
+            # 如果已完成且状态中有报告，直接返回报告
+            if prog.get('status') == 'completed':
+                return jsonify({'status': 'completed', 'report': prog.get('report', '')}), 200
+            if prog.get('status') == 'error':
+                return jsonify({'status': 'error', 'message': prog.get('message', '未知错误')}), 200
+            # 进行中（流式生成时附带已输出的部分报告）
+            return jsonify({'status': 'in_progress', 'progress': prog.get('progress', 0), 'message': prog.get('message', ''),
+                            'partial': prog.get('partial', '')}), 200
+        # 兜底：状态已过期或未开始时查数据库是否已有报告
         db = SessionLocal()
         try:
             task = db.get(Task, task_id)
@@ -1688,7 +1951,7 @@ def admin_panel():
         new_tasks_today = db.query(Task).filter(Task.created_at >= today_start).count()
         avg_tasks_per_user = total_tasks / total_users if total_users > 0 else 0
         
-        total_submissions = db.query(Submission).count()
+        total_submissions = db.query(func.coalesce(func.sum(Task.submission_count), 0)).scalar()
         new_submissions_today = db.query(Submission).filter(Submission.submitted_at >= today_start).count()
         avg_submissions_per_task = total_submissions / total_tasks if total_tasks > 0 else 0
         
@@ -1741,6 +2004,27 @@ def admin_panel():
     finally:
         db.close()
 
+@quickform_bp.route('/admin/runtime_stats')
+@admin_required
+def admin_runtime_stats():
+    """运行时指标：缓存命中率、提交写缓冲状态等（当前进程）"""
+    return jsonify({
+        'pid': os.getpid(),
+        'task_slug_cache': task_slug_cache.stats(),
+        'prompt_preview_cache': prompt_preview_cache.stats(),
+        'submit_rate_limiter': submit_rate_limiter.stats(),
+        'rate_limit_events': rate_limit_recorder.stats() if rate_limit_recorder else None,
+        'submission_writer': submission_writer.stats() if submission_writer else None,
+        'export_jobs': export_jobs.stats() if export_jobs else None,
+        'http_clients': provider_clients.stats(),
+        'ai_response_cache': ai_response_cache.stats(),
+        'ai_providers': provider_health.stats(),
+        'ai_admission': ai_admission.stats(),
+        'ai_gateway': ai_gateway.stats(),
+        'analysis_jobs': analysis_jobs.stats() if analysis_jobs else None,
+        'analysis_state': analysis_state.stats()
+    })
+
 @quickform_bp.route('/admin/change_role/<int:user_id>', methods=['POST'])
 @admin_required
 def admin_change_role(user_id):
@@ -2145,6 +2429,11 @@ def remove_submission(task_id):
             return make_response({'success': False, 'message': '提交不存在'}, 404)
         
         db.delete(submission)
+        db.flush()
+        apply_submission_delta(db, task_id, -1)
+        apply_field_stats(db, task_id, [load_submission_data(submission.data, submission.schema_fp)], sign=-1)
+        if task.last_submitted_at and submission.submitted_at and submission.submitted_at >= task.last_submitted_at:
+            refresh_last_submitted_at(db, task_id)
         db.commit()
         logger.info(
             f"[remove_submission] success user={getattr(current_user, 'id', None)} task={task_id} submission={submission_id}"
@@ -2185,14 +2474,17 @@ def clear_all_submissions(task_id):
             )
             return make_response({'success': False, 'message': '无权访问此任务'}, 403)
         
-        submissions = db.query(Submission).filter_by(task_id=task_id).all()
-        count = len(submissions)
+        count = (
+            db.query(Submission)
+            .filter_by(task_id=task_id)
+            .delete(synchronize_session=False)
+        )
         logger.info(
             f"[clear_all_submissions] deleting count={count} user={getattr(current_user, 'id', None)} task={task_id}"
         )
-        for submission in submissions:
-            db.delete(submission)
-        
+        apply_submission_delta(db, task_id, -count)
+        refresh_last_submitted_at(db, task_id)
+        reset_field_stats(db, task_id)
         db.commit()
         logger.info(
             f"[clear_all_submissions] success user={getattr(current_user, 'id', None)} task={task_id} deleted={count}"
@@ -2209,6 +2501,28 @@ def clear_all_submissions(task_id):
         db.close()
 
 
+def user_room(user_id):
+    return f'user_{user_id}'
+
+
+def emit_to_user(user_id, event, data):
+    """向用户的所有SocketIO连接推送事件（可在后台线程中调用）"""
+    if socketio is not None:
+        socketio.emit(event, data, to=user_room(user_id), namespace=SOCKETIO_NAMESPACE)
+
+
+def register_socketio(socketio_instance):
+    """注册 QuickForm 的 SocketIO 事件：已登录用户连接 /quickform 后加入自己的房间，接收报告的流式输出"""
+    global socketio
+    socketio = socketio_instance
+
+    @socketio_instance.on('connect', namespace=SOCKETIO_NAMESPACE)
+    def on_connect(auth=None):
+        if not current_user.is_authenticated:
+            return False
+        join_room(user_room(current_user.id))
+
+
 def init_quickform(app, login_manager_instance=None, database_type=None):
     """
     初始化QuickForm Blueprint
@@ -2219,7 +2533,7 @@ def init_quickform(app, login_manager_instance=None, database_type=None):
         login_manager_instance: LoginManager实例（可选）
         database_type: 数据库类型，'sqlite' 或 'mysql'（可选，如果指定则强制使用该类型）
     """
-    global bcrypt, login_manager, _database_type
+    global bcrypt, login_manager, _database_type, submission_writer, rate_limit_recorder, export_jobs, analysis_jobs
     
     # 如果指定了数据库类型，重新初始化数据库
     if database_type:
@@ -2281,6 +2595,47 @@ def init_quickform(app, login_manager_instance=None, database_type=None):
     except Exception as e:
         logger.warning(f"初始化管理员账号警告: {str(e)}")
     
+    # 启动提交写缓冲（会先回放上次未入库的提交）
+    if SUBMIT_BUFFER_ENABLED and submission_writer is None:
+        try:
+            submission_writer = SubmissionWriter(
+                SessionLocal,
+                SUBMIT_SPOOL_DIR,
+                batch_size=SUBMIT_BATCH_SIZE,
+                max_latency=SUBMIT_BATCH_MAX_LATENCY_MS / 1000.0,
+                fsync=SUBMIT_SPOOL_FSYNC
+            )
+            submission_writer.start()
+        except Exception as e:
+            submission_writer = None
+            logger.error(f"启动提交写缓冲失败，改为逐条写库: {str(e)}", exc_info=True)
+
+    # 启动封禁事件的批量写入
+    if rate_limit_recorder is None:
+        rate_limit_recorder = RateLimitEventRecorder(SessionLocal, retention_days=RATE_LIMIT_EVENT_RETENTION_DAYS)
+        rate_limit_recorder.start()
+
+    # 启动后台导出（会先按大小/年龄清理导出缓存）
+    if export_jobs is None:
+        export_jobs = ExportJobManager(
+            SessionLocal,
+            EXPORT_CACHE_DIR,
+            max_bytes=EXPORT_CACHE_MAX_MB * 1024 * 1024,
+            max_age=EXPORT_CACHE_MAX_AGE_HOURS * 3600,
+            workers=EXPORT_WORKERS
+        )
+        export_jobs.start()
+
+    # 启动AI分析任务执行器（分析报告与HTML文件分析共用固定大小的线程池）
+    if analysis_jobs is None:
+        analysis_jobs = AnalysisJobExecutor(
+            workers=ANALYSIS_WORKERS,
+            max_per_user=ANALYSIS_MAX_PER_USER,
+            max_queue=ANALYSIS_MAX_QUEUE,
+            max_queued_per_user=ANALYSIS_MAX_QUEUED_PER_USER
+        )
+        analysis_jobs.start()
+    
     # 确保uploads目录存在
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
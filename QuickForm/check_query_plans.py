@@ -0,0 +1,135 @@
+"""
+检查热点查询的执行计划，发现全表扫描或额外排序时以非零状态码退出
+支持SQLite（EXPLAIN QUERY PLAN）和MySQL（EXPLAIN）；数据库选择与应用相同
+
+用法: python check_query_plans.py
+"""
+import os
+import sys
+from sqlalchemy import create_engine, select, func, text
+from dotenv import load_dotenv
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+from models import Base, Task, Submission, RateLimitEvent, migrate_database
+
+# 加载环境变量
+project_root = os.path.dirname(QUICKFORM_DIR)
+env_path = os.path.join(project_root, '.env')
+if os.path.exists(env_path):
+    load_dotenv(env_path)
+else:
+    load_dotenv()
+
+SQLITE_DB_PATH = os.path.join(QUICKFORM_DIR, 'quickform.db')
+
+MYSQL_HOST = os.getenv('MYSQL_HOST', '')
+MYSQL_PORT = os.getenv('MYSQL_PORT', '3306')
+MYSQL_USER = os.getenv('MYSQL_USER', '')
+MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
+MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'quickform')
+
+
+def get_database_url():
+    if MYSQL_HOST and MYSQL_USER and MYSQL_PASSWORD:
+        return f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}?charset=utf8mb4'
+    return f'sqlite:///{SQLITE_DB_PATH}'
+
+
+def hot_queries():
+    """(名称, 语句, 是否要求索引同时满足排序)"""
+    return [
+        ('最新提交（submit_form GET / task_detail）',
+         select(Submission).where(Submission.task_id == 1)
+         .order_by(Submission.submitted_at.desc(), Submission.id.desc()).limit(20),
+         True),
+        ('最后提交时间（删除提交后重算）',
+         select(func.max(Submission.submitted_at)).where(Submission.task_id == 1),
+         False),
+        ('按公开task_id查任务（提交API）',
+         select(Task.id, Task.task_id, Task.title).where(Task.task_id == 'abc'),
+         False),
+        ('按文件名查任务（/uploads）',
+         select(Task).where(Task.stored_filename == 'abc.html'),
+         False),
+        ('提示词样例定位（按位置取id，只读索引）',
+         select(Submission.id).where(Submission.task_id == 1)
+         .order_by(Submission.submitted_at.desc(), Submission.id.desc()).offset(100).limit(6),
+         True),
+        ('提交总数（提示词/智能分析）',
+         select(func.count(Submission.id)).where(Submission.task_id == 1),
+         False),
+        ('任务的封禁记录（task_detail）',
+         select(RateLimitEvent).where(RateLimitEvent.task_id == 1, RateLimitEvent.created_at >= '2024-01-01')
+         .order_by(RateLimitEvent.created_at.desc(), RateLimitEvent.id.desc()).limit(200),
+         False),
+    ]
+
+
+def explain(conn, dialect, sql):
+    """返回 (计划描述列表, 问题列表)"""
+    problems = []
+    if dialect == 'sqlite':
+        rows = conn.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+        details = [row[-1] for row in rows]
+        for detail in details:
+            # "SCAN submission" / "SCAN TABLE submission" 表示全表扫描；覆盖索引扫描不算
+            if detail.startswith('SCAN') and 'INDEX' not in detail:
+                problems.append(f'全表扫描: {detail}')
+            if 'USE TEMP B-TREE' in detail:
+                problems.append(f'额外排序: {detail}')
+        return details, problems
+
+    result = conn.execute(text('EXPLAIN ' + sql))
+    keys = list(result.keys())
+    details = []
+    for row in result.fetchall():
+        info = dict(zip(keys, row))
+        details.append(f"table={info.get('table')} type={info.get('type')} key={info.get('key')} extra={info.get('Extra')}")
+        if info.get('table') and info.get('type') == 'ALL':
+            problems.append(f"全表扫描: table={info.get('table')}")
+        if 'filesort' in (info.get('Extra') or ''):
+            problems.append(f"额外排序: table={info.get('table')}")
+    return details, problems
+
+
+def main():
+    database_url = get_database_url()
+    print("=" * 60)
+    print("检查热点查询执行计划")
+    print(f"数据库: {database_url.split('@')[-1]}")
+    print("=" * 60)
+
+    engine = create_engine(database_url, pool_pre_ping=True)
+    Base.metadata.create_all(engine)
+    migrate_database(engine)
+    dialect = engine.dialect.name
+
+    failed = 0
+    with engine.connect() as conn:
+        for name, stmt, needs_ordered_index in hot_queries():
+            sql = str(stmt.compile(engine, compile_kwargs={'literal_binds': True}))
+            details, problems = explain(conn, dialect, sql)
+            if not needs_ordered_index:
+                problems = [p for p in problems if not p.startswith('额外排序')]
+            print(f"\n【{name}】")
+            for detail in details:
+                print(f"  {detail}")
+            if problems:
+                failed += 1
+                for problem in problems:
+                    print(f"  ❌ {problem}")
+            else:
+                print("  ✓ 使用索引")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} 个热点查询未命中索引")
+        sys.exit(1)
+    print("✓ 所有热点查询均命中索引")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""后台导出任务 - 导出在线程池中执行，前端轮询进度，完成后下载
+
+导出结果缓存在磁盘上，文件名由 (任务, 最大的提交id, 提交数, 格式) 决定：
+数据未变化时重复导出直接返回已有文件；数据变化后旧文件立即失效并删除。
+缓存目录按文件年龄和总大小淘汰（最久未使用的先删除）。
+"""
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func
+
+from models import Submission
+from export_service import EXPORT_FORMATS, available_formats, iter_submission_rows, submission_columns, write_export_file
+
+logger = logging.getLogger(__name__)
+
+# task{任务主键}_{最大提交id}_{提交数}.{扩展名}
+ARTIFACT_PATTERN = re.compile(r'^task(\d+)_(\d+)_(\d+)\.(\w+)$')
+PROGRESS_EVERY = 500  # 每导出多少行更新一次进度
+
+
+class ExportJobManager:
+    """后台导出任务与导出文件缓存
+
+    Args:
+        SessionLocal: 会话工厂
+        cache_dir: 导出文件缓存目录
+        max_bytes: 缓存目录总大小上限
+        max_age: 导出文件最长保留时间（秒，按最后一次使用计算）
+        workers: 同时执行的导出任务数
+        job_ttl: 已结束的任务状态保留时间（秒）
+    """
+
+    def __init__(self, SessionLocal, cache_dir, max_bytes=512 * 1024 * 1024, max_age=24 * 3600, workers=2, job_ttl=3600):
+        self.SessionLocal = SessionLocal
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.workers = workers
+        self.job_ttl = job_ttl
+        self._executor = None
+        self._jobs = {}  # job_id -> 任务状态
+        self._active = {}  # 缓存键 -> 排队或执行中的 job_id，相同导出只执行一次
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.exports = 0
+        self.failures = 0
+        self.evicted = 0
+
+    def start(self):
+        if self._executor:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='quickform-export')
+        self.evict()
+
+    def stop(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # ---- 缓存 ----
+
+    def artifact_key(self, db, task_pk):
+        """(最大的提交id, 提交数)；任务没有提交时返回None
+
+        导出按 id 不超过最大id 读取字段和数据，提交数与最大id在同一条语句中统计，三者范围一致。
+        不按提交时间取最新一条：批量写入和落盘重放的提交时间可能早于id更大的提交，按时间取会漏掉这些行。
+        """
+        max_id, count = (
+            db.query(func.max(Submission.id), func.count(Submission.id))
+            .filter(Submission.task_id == task_pk)
+            .one()
+        )
+        if max_id is None:
+            return None
+        return max_id, count
+
+    def artifact_path(self, task_pk, max_id, count, fmt):
+        return os.path.join(self.cache_dir, f'task{task_pk}_{max_id}_{count}.{EXPORT_FORMATS[fmt][1]}')
+
+    def cached_artifact(self, task_pk, fmt):
+        """数据未变化时返回已缓存的导出文件路径，否则返回None"""
+        db = self.SessionLocal()
+        try:
+            key = self.artifact_key(db, task_pk)
+        finally:
+            db.close()
+        if key is None:
+            return None
+        path = self.artifact_path(task_pk, key[0], key[1], fmt)
+        if not self._touch(path):
+            return None
+        self.cache_hits += 1
+        return path
+
+    def _touch(self, path):
+        """更新文件的修改时间（用于按最近使用淘汰），文件不存在时返回False"""
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def _artifacts(self):
+        """缓存目录中的导出文件 [(路径, 文件名匹配结果, 修改时间, 大小)]，含未完成的临时文件（匹配结果为None）"""
+        result = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return result
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append((path, ARTIFACT_PATTERN.match(name), st.st_mtime, st.st_size))
+        return result
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.evicted += 1
+            return True
+        except OSError:
+            return False
+
+    def evict(self):
+        """删除过期的导出文件，再按最久未使用的顺序删除直到总大小不超过上限；返回 (删除数, 释放字节数)"""
+        now = time.time()
+        removed = freed = 0
+        active_paths = self._active_paths()
+        remaining = []
+        for path, match, mtime, size in self._artifacts():
+            if path in active_paths:
+                continue
+            # 未完成的临时文件只在过期后清理（可能是进程崩溃时遗留的）
+            if now - mtime > self.max_age:
+                if self._remove(path):
+                    removed += 1
+                    freed += size
+            elif match:
+                remaining.append((mtime, size, path))
+        total = sum(size for _, size, _ in remaining)
+        for mtime, size, path in sorted(remaining):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                removed += 1
+                freed += size
+                total -= size
+        if removed:
+            logger.info(f"导出缓存淘汰 {removed} 个文件，释放 {freed / 1024 / 1024:.1f}MB")
+        return removed, freed
+
+    def discard_task(self, task_pk):
+        """删除任务的全部导出文件（任务被删除时调用）"""
+        for path, match, _, _ in self._artifacts():
+            if match and int(match.group(1)) == task_pk:
+                self._remove(path)
+
+    def _discard_stale(self, task_pk, fmt, keep_path):
+        """数据已变化，同一任务同一格式的旧文件不会再被命中，直接删除"""
+        extension = EXPORT_FORMATS[fmt][1]
+        for path, match, _, _ in self._artifacts():
+            if match and int(match.group(1)) == task_pk and match.group(4) == extension and path != keep_path:
+                self._remove(path)
+
+    # ---- 任务 ----
+
+    def submit(self, task_pk, user_id, fmt, filename_prefix):
+        """创建导出任务并返回任务状态；数据未变化时直接返回已完成的任务，相同的导出正在执行时返回该任务
+
+        Raises:
+            ValueError: 格式不可用或任务没有提交数据
+        """
+        if fmt not in available_formats():
+            raise ValueError(f'不支持的导出格式: {fmt}')
+        db = self.SessionLocal()
+        try:
+            key = self.artifact_key(db, task_pk)
+        finally:
+            db.close()
+        if key is None:
+            raise ValueError('没有可导出的数据')
+        max_id, count = key
+        path = self.artifact_path(task_pk, max_id, count, fmt)
+        filename = f"{filename_prefix}.{EXPORT_FORMATS[fmt][1]}"
+
+        with self._lock:
+            self._prune_jobs()
+            active_id = self._active.get(path)
+            if active_id:
+                return dict(self._jobs[active_id])
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'task_id': task_pk,
+                'user_id': user_id,
+                'format': fmt,
+                'filename': filename,
+                'path': path,
+                'total': count,
+                'rows': 0,
+                'status': 'queued',
+                'cached': False,
+                'error': None,
+                'created_at': time.time(),
+                'finished_at': None
+            }
+            if self._touch(path):
+                job.update(status='completed', cached=True, rows=count, finished_at=job['created_at'])
+                self.cache_hits += 1
+            else:
+                if not self._executor:
+                    raise RuntimeError('导出服务未启动')
+                self._active[path] = job['job_id']
+            self._jobs[job['job_id']] = job
+        if job['status'] == 'queued':
+            self._executor.submit(self._run, job['job_id'], max_id)
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def _active_paths(self):
+        with self._lock:
+            return set(self._active)
+
+    def _prune_jobs(self):
+        """调用方持有锁；删除结束超过 job_ttl 的任务状态"""
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _counted(self, rows, job_id):
+        """逐行透传，并定期更新任务进度"""
+        count = 0
+        try:
+            for data in rows:
+                count += 1
+                if count % PROGRESS_EVERY == 0:
+                    self._update(job_id, rows=count)
+                yield data
+        finally:
+            rows.close()
+            self._update(job_id, rows=count)
+
+    def _run(self, job_id, max_id):
+        job = self.get(job_id)
+        if not job:
+            return
+        task_pk, fmt, path = job['task_id'], job['format'], job['path']
+        tmp_path = f"{path}.{job_id}.tmp"
+        self._update(job_id, status='running')
+        try:
+            columns = submission_columns(self.SessionLocal, task_pk, max_id=max_id)
+            rows = iter_submission_rows(self.SessionLocal, task_pk, newest_first=False, max_id=max_id)
+            write_export_file(self._counted(rows, job_id), columns, fmt, tmp_path)
+            os.replace(tmp_path, path)
+            self.exports += 1
+            self._update(job_id, status='completed', finished_at=time.time())
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"导出任务失败 (task={task_pk}, format={fmt}): {str(e)}", exc_info=True)
+            self._update(job_id, status='error', error=str(e), finished_at=time.time())
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self._active.pop(path, None)
+        self._discard_stale(task_pk, fmt, path)
+        self.evict()
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job['status']] = statuses.get(job['status'], 0) + 1
+        artifacts = [(size, match) for _, match, _, size in self._artifacts() if match]
+        return {
+            'jobs': statuses,
+            'exports': self.exports,
+            'failures': self.failures,
+            'cache_hits': self.cache_hits,
+            'evicted': self.evicted,
+            'artifacts': len(artifacts),
+            'artifact_bytes': sum(size for size, _ in artifacts),
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age
+        }
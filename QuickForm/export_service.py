@@ -0,0 +1,284 @@
+"""数据导出服务 - 以流式方式输出提交数据，内存占用与任务数据量无关
+
+支持 NDJSON / CSV / XLSX / Parquet：
+- 数据通过服务端游标（yield_per）逐批读取；
+- 列集合先做一遍轻量扫描：已规范化的提交按结构指纹（schema_fp）各取一条样本即可得到字段，
+  只有尚未规范化的旧数据需要逐条解析；
+- CSV边生成边发送；XLSX（openpyxl只写模式）和Parquet（pyarrow，可选依赖）按批写入临时文件，
+  完成后分块发送并删除临时文件。
+"""
+import io
+import os
+import csv
+import logging
+import tempfile
+
+from sqlalchemy import func
+
+import json_codec
+from models import Submission
+from submission_service import decode_submission, submission_json, load_submission_data, RAW_SCHEMA_FP
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # 可选依赖，未安装时不提供Parquet导出
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 500  # 每批从数据库读取/向客户端输出的行数
+FILE_CHUNK_SIZE = 64 * 1024  # 发送临时文件时每块的字节数
+
+# 格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def available_formats():
+    """当前环境可用的导出格式"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+
+def iter_submission_rows(SessionLocal, task_pk, batch_size=STREAM_BATCH_SIZE, as_json=False, newest_first=True,
+                         max_id=None):
+    """使用服务端游标（yield_per）逐批读取任务的提交数据
+
+    as_json=True 时逐条产出JSON文本（已规范化的数据直接透传），否则产出解析后的字典。
+    max_id 不为空时只读取 id 不超过它的提交（导出任务据此与缓存键保持一致）。
+    """
+    db = SessionLocal()
+    try:
+        if newest_first:
+            order = (Submission.submitted_at.desc(), Submission.id.desc())
+        else:
+            order = (Submission.submitted_at, Submission.id)
+        query = db.query(Submission.data, Submission.submitted_at, Submission.schema_fp).filter(Submission.task_id == task_pk)
+        if max_id is not None:
+            query = query.filter(Submission.id <= max_id)
+        query = query.order_by(*order).yield_per(batch_size)
+        convert = submission_json if as_json else decode_submission
+        for row in query:
+            yield convert(row.data, row.submitted_at, row.schema_fp)
+    finally:
+        db.close()
+
+
+def submission_columns(SessionLocal, task_pk, batch_size=STREAM_BATCH_SIZE, max_id=None):
+    """任务全部提交的字段并集（按首次出现的顺序），末尾为 submitted_at，存在无法解析的数据时再加 raw_data"""
+    db = SessionLocal()
+    try:
+        columns = []
+        seen = set()
+        has_raw = False
+
+        def add(data):
+            for key in data:
+                if key not in seen:
+                    seen.add(key)
+                    columns.append(key)
+
+        # 已规范化的提交：相同指纹的字段完全相同，每个指纹取最早的一条作为样本
+        scope = [Submission.task_id == task_pk]
+        if max_id is not None:
+            scope.append(Submission.id <= max_id)
+        fingerprints = (
+            db.query(Submission.schema_fp, func.min(Submission.id))
+            .filter(*scope, Submission.schema_fp.isnot(None))
+            .group_by(Submission.schema_fp)
+            .order_by(func.min(Submission.id))
+            .all()
+        )
+        for schema_fp, sample_id in fingerprints:
+            data = None
+            if schema_fp != RAW_SCHEMA_FP:
+                sample = db.query(Submission.data).filter(Submission.id == sample_id).scalar()
+                data = load_submission_data(sample, schema_fp)
+            if data is None:
+                has_raw = True
+            else:
+                add(data)
+
+        # 尚未回填指纹的旧数据需要逐条解析
+        legacy = (
+            db.query(Submission.data)
+            .filter(*scope, Submission.schema_fp.is_(None))
+            .order_by(Submission.id)
+            .yield_per(batch_size)
+        )
+        for row in legacy:
+            data = load_submission_data(row.data)
+            if data is None:
+                has_raw = True
+            else:
+                add(data)
+
+        result = [col for col in columns if col not in ('submitted_at', 'raw_data')]
+        result.append('submitted_at')
+        if has_raw or 'raw_data' in seen:
+            result.append('raw_data')
+        return result
+    finally:
+        db.close()
+
+
+def csv_cell(value):
+    """将字段值转换为单元格内容，列表/字典以JSON表示"""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json_codec.dumps(value)
+    return value
+
+
+def stream_ndjson(rows, batch_size=STREAM_BATCH_SIZE):
+    """每行一个JSON对象（NDJSON），逐批输出；rows 为 iter_submission_rows(..., as_json=True)"""
+    buf = []
+    try:
+        for line in rows:
+            buf.append(line)
+            if len(buf) >= batch_size:
+                yield '\n'.join(buf) + '\n'
+                buf = []
+        if buf:
+            yield '\n'.join(buf) + '\n'
+    finally:
+        rows.close()
+
+
+def stream_csv(rows, columns, batch_size=STREAM_BATCH_SIZE):
+    """逐批输出CSV，带UTF-8 BOM便于Excel直接打开中文内容"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    try:
+        writer.writerow(columns)
+        yield '\ufeff' + out.getvalue()
+        out.seek(0)
+        out.truncate()
+        for count, data in enumerate(rows, 1):
+            writer.writerow([csv_cell(data.get(col)) for col in columns])
+            if count % batch_size == 0:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        if out.tell():
+            yield out.getvalue()
+    finally:
+        rows.close()
+
+
+def write_xlsx(rows, columns, path, sheet_name='提交数据'):
+    """openpyxl只写模式：行数据直接写入工作表的临时XML，内存占用与行数无关"""
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    def cell(value):
+        value = csv_cell(value)
+        # openpyxl不接受控制字符
+        return ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+    sheet.append(columns)
+    try:
+        for data in rows:
+            sheet.append([cell(data.get(col)) for col in columns])
+    finally:
+        rows.close()
+    workbook.save(path)
+
+
+def write_parquet(rows, columns, path, batch_size=STREAM_BATCH_SIZE * 10):
+    """按批写入Parquet行组；表单字段类型不固定，所有列均以字符串存储"""
+    if pyarrow is None:
+        raise RuntimeError('导出Parquet需要安装pyarrow')
+    schema = pyarrow.schema([(col, pyarrow.string()) for col in columns])
+    writer = pyarrow.parquet.ParquetWriter(path, schema)
+    try:
+        batch = []
+        for data in rows:
+            batch.append(data)
+            if len(batch) >= batch_size:
+                writer.write_table(_parquet_table(batch, columns, schema))
+                batch = []
+        if batch:
+            writer.write_table(_parquet_table(batch, columns, schema))
+    finally:
+        rows.close()
+        writer.close()
+
+
+def _parquet_table(batch, columns, schema):
+    arrays = {}
+    for col in columns:
+        values = []
+        for data in batch:
+            value = data.get(col)
+            values.append(None if value is None else str(csv_cell(value)))
+        arrays[col] = values
+    return pyarrow.Table.from_pydict(arrays, schema=schema)
+
+
+def write_csv(rows, columns, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in stream_csv(rows, columns):
+            f.write(chunk)
+
+
+def write_export_file(rows, columns, fmt, path):
+    """把数据写入 CSV/XLSX/Parquet 文件"""
+    if fmt == 'csv':
+        write_csv(rows, columns, path)
+    elif fmt == 'xlsx':
+        write_xlsx(rows, columns, path)
+    else:
+        write_parquet(rows, columns, path)
+
+
+def stream_file(path, chunk_size=FILE_CHUNK_SIZE, remove=True):
+    """分块读取文件；remove=True 时读完后删除"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def export_submissions(SessionLocal, task_pk, fmt, newest_first=False):
+    """导出任务的全部提交，返回逐块产出响应体的生成器
+
+    XLSX/Parquet 在返回前已写好临时文件，写入失败时直接抛出异常（此时尚未开始响应）。
+
+    Args:
+        fmt: 'csv' / 'xlsx' / 'parquet'
+        newest_first: 是否按提交时间倒序（默认按提交顺序）
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+    if fmt == 'parquet' and pyarrow is None:
+        raise RuntimeError('导出Parquet需要安装pyarrow')
+
+    columns = submission_columns(SessionLocal, task_pk)
+    rows = iter_submission_rows(SessionLocal, task_pk, newest_first=newest_first)
+    if fmt == 'csv':
+        return stream_csv(rows, columns)
+
+    fd, path = tempfile.mkstemp(prefix='quickform_export_', suffix='.' + EXPORT_FORMATS[fmt][1])
+    os.close(fd)
+    try:
+        write_export_file(rows, columns, fmt, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return stream_file(path)
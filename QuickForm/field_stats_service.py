@@ -0,0 +1,327 @@
+"""字段统计服务 - 按任务、按字段增量维护提交数据的汇总统计
+
+每个字段一行（SubmissionFieldStat）：出现次数、数值的个数/和/平方和/最小值/最大值、布尔值的是/否计数、
+文本值的有界Top-K计数（Space-Saving算法），与提交写入在同一事务中合并。
+删除提交时反向扣减；最小/最大值无法扣减，删除的值恰好是当前极值时标记为过期，下次读取时重建。
+读取统计的代价与字段数成正比，与提交数无关。
+"""
+import math
+import logging
+
+from sqlalchemy import update
+
+import json_codec
+from models import Task, Submission, SubmissionFieldStat
+
+logger = logging.getLogger(__name__)
+
+TOP_K_CAPACITY = 32  # 每个字段保留的文本值个数上限
+TOP_VALUE_MAX_LENGTH = 100  # 文本值超过该长度时截断后再计数
+FIELD_NAME_MAX_LENGTH = 255
+DOMINANT_RATIO = 0.8  # 超过该比例的值为数值/布尔时，按数值/布尔字段展示
+
+
+def value_kind(value):
+    """'numeric' / 'boolean' / 'text'（bool是int的子类，需要先判断）"""
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'numeric'
+    return 'text'
+
+
+def _top_add(top, key):
+    """Space-Saving：已满时替换计数最小的值，新值继承其计数（计数为上界估计）"""
+    if key in top:
+        top[key] += 1
+    elif len(top) < TOP_K_CAPACITY:
+        top[key] = 1
+    else:
+        victim = min(top, key=top.get)
+        top[key] = top.pop(victim) + 1
+
+
+def _top_remove(top, key):
+    if key in top:
+        top[key] -= 1
+        if top[key] <= 0:
+            del top[key]
+
+
+# 统计行中随提交累加的列
+STAT_COLUMNS = (
+    'position', 'value_count', 'numeric_count', 'numeric_sum', 'numeric_sumsq', 'numeric_min', 'numeric_max',
+    'true_count', 'false_count', 'text_count', 'stale'
+)
+
+
+class _FieldAggregate:
+    """一个字段的统计（纯Python对象，合并时不经过ORM属性跟踪）"""
+    __slots__ = ('field', 'top', 'row') + STAT_COLUMNS
+
+    def __init__(self, field, position, row=None):
+        self.field = field
+        self.row = row
+        self.top = json_codec.loads(row.top_values) if row is not None and row.top_values else {}
+        if row is not None:
+            for name in STAT_COLUMNS:
+                setattr(self, name, getattr(row, name))
+            self.position = row.position or 0
+            self.stale = bool(row.stale)
+        else:
+            self.position = position
+            self.value_count = self.numeric_count = self.true_count = self.false_count = self.text_count = 0
+            self.numeric_sum = self.numeric_sumsq = 0.0
+            self.numeric_min = self.numeric_max = None
+            self.stale = False
+
+    @property
+    def top_values(self):
+        return json_codec.dumps(self.top) if self.top else None
+
+
+class FieldStatsAccumulator:
+    """一个任务的字段统计：载入已有的统计行，在内存中合并后写回"""
+
+    def __init__(self, task_pk, rows=()):
+        self.task_pk = task_pk
+        self.stats = {}
+        self.next_position = 0
+        for row in rows:
+            self.stats[row.field] = _FieldAggregate(row.field, row.position, row)
+            self.next_position = max(self.next_position, (row.position or 0) + 1)
+
+    def add(self, data):
+        if not isinstance(data, dict):
+            return
+        stats = self.stats
+        for key, value in data.items():
+            field = str(key)[:FIELD_NAME_MAX_LENGTH]
+            stat = stats.get(field)
+            if stat is None:
+                stat = stats[field] = _FieldAggregate(field, self.next_position)
+                self.next_position += 1
+            stat.value_count += 1
+            kind = value_kind(value)
+            if kind == 'numeric':
+                number = float(value)
+                stat.numeric_count += 1
+                stat.numeric_sum += number
+                stat.numeric_sumsq += number * number
+                if stat.numeric_min is None or number < stat.numeric_min:
+                    stat.numeric_min = number
+                if stat.numeric_max is None or number > stat.numeric_max:
+                    stat.numeric_max = number
+            elif kind == 'boolean':
+                if value:
+                    stat.true_count += 1
+                else:
+                    stat.false_count += 1
+            else:
+                stat.text_count += 1
+                _top_add(stat.top, str(value)[:TOP_VALUE_MAX_LENGTH])
+
+    def remove(self, data):
+        if not isinstance(data, dict):
+            return
+        for key, value in data.items():
+            field = str(key)[:FIELD_NAME_MAX_LENGTH]
+            stat = self.stats.get(field)
+            if stat is None:
+                continue
+            stat.value_count -= 1
+            kind = value_kind(value)
+            if kind == 'numeric':
+                number = float(value)
+                stat.numeric_count -= 1
+                stat.numeric_sum -= number
+                stat.numeric_sumsq -= number * number
+                if stat.numeric_count <= 0:
+                    stat.numeric_count, stat.numeric_sum, stat.numeric_sumsq = 0, 0.0, 0.0
+                    stat.numeric_min = stat.numeric_max = None
+                elif number <= stat.numeric_min or number >= stat.numeric_max:
+                    stat.stale = True
+            elif kind == 'boolean':
+                if value:
+                    stat.true_count -= 1
+                else:
+                    stat.false_count -= 1
+            else:
+                stat.text_count -= 1
+                _top_remove(stat.top, str(value)[:TOP_VALUE_MAX_LENGTH])
+
+    def finish(self):
+        """把统计写回统计行（新字段创建新行），返回按字段首次出现顺序排列的统计行"""
+        rows = []
+        for stat in sorted(self.stats.values(), key=lambda stat: stat.position):
+            row = stat.row
+            if row is None:
+                row = stat.row = SubmissionFieldStat(task_id=self.task_pk, field=stat.field)
+            for name in STAT_COLUMNS:
+                if getattr(row, name) != getattr(stat, name):
+                    setattr(row, name, getattr(stat, name))
+            top_values = stat.top_values
+            if row.top_values != top_values:
+                row.top_values = top_values
+            rows.append(row)
+        return rows
+
+    def summaries(self):
+        """当前的字段摘要（不写库）"""
+        ordered = sorted(self.stats.values(), key=lambda stat: stat.position)
+        return [summarize_field(stat) for stat in ordered if stat.value_count > 0]
+
+
+def apply_field_stats(db, task_pk, payloads, sign=1):
+    """在当前事务中把一批提交合并进任务的字段统计；sign=-1 表示删除这些提交
+
+    payloads 为解析后的提交数据，无法解析的提交传 None（只计入提交数）。
+    任务的统计尚未建立时跳过（首次读取时会整体重建）。统计更新失败不影响提交本身，
+    此时把统计标记为失效，等待下次读取时重建。
+    """
+    try:
+        with db.begin_nested():
+            counted = (
+                db.query(Task.field_stats_count)
+                .filter(Task.id == task_pk)
+                .with_for_update()
+                .scalar()
+            )
+            if counted is None:
+                return False
+            rows = db.query(SubmissionFieldStat).filter_by(task_id=task_pk).with_for_update().all()
+            accumulator = FieldStatsAccumulator(task_pk, rows)
+            for data in payloads:
+                if sign > 0:
+                    accumulator.add(data)
+                else:
+                    accumulator.remove(data)
+            for stat in accumulator.finish():
+                if stat.value_count <= 0:
+                    if stat.id is not None:
+                        db.delete(stat)
+                elif stat.id is None:
+                    db.add(stat)
+            db.execute(
+                update(Task).where(Task.id == task_pk)
+                .values(field_stats_count=Task.field_stats_count + sign * len(payloads))
+                .execution_options(synchronize_session=False)
+            )
+        return True
+    except Exception as e:
+        logger.warning(f"更新任务 {task_pk} 的字段统计失败，将在下次读取时重建: {str(e)}")
+        invalidate_field_stats(db, task_pk)
+        return False
+
+
+def invalidate_field_stats(db, task_pk):
+    """在当前事务中标记任务的字段统计失效"""
+    db.execute(
+        update(Task).where(Task.id == task_pk).values(field_stats_count=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reset_field_stats(db, task_pk):
+    """在当前事务中清空任务的字段统计（删除全部提交时调用）"""
+    db.query(SubmissionFieldStat).filter_by(task_id=task_pk).delete(synchronize_session=False)
+    db.execute(
+        update(Task).where(Task.id == task_pk).values(field_stats_count=0)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rebuild_field_stats(db, task_pk, batch_size=1000):
+    """按任务的全部提交重建字段统计并提交事务，返回统计行；写库失败时仍返回本次计算的结果"""
+    from submission_service import load_submission_data
+
+    accumulator = FieldStatsAccumulator(task_pk)
+    scanned = 0
+    try:
+        # 先锁定任务行并删除旧统计，期间的新提交会等待重建完成后再增量合并
+        db.query(Task.id).filter(Task.id == task_pk).with_for_update().scalar()
+        db.query(SubmissionFieldStat).filter_by(task_id=task_pk).delete(synchronize_session=False)
+        for obj in list(db.identity_map.values()):
+            if isinstance(obj, SubmissionFieldStat) and obj.task_id == task_pk:
+                db.expunge(obj)
+        rows = (
+            db.query(Submission.data, Submission.schema_fp)
+            .filter(Submission.task_id == task_pk)
+            .order_by(Submission.id)
+            .yield_per(batch_size)
+        )
+        for row in rows:
+            accumulator.add(load_submission_data(row.data, row.schema_fp))
+            scanned += 1
+        stats = accumulator.finish()
+        db.add_all(stats)
+        db.execute(
+            update(Task).where(Task.id == task_pk).values(field_stats_count=scanned)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        logger.info(f"已重建任务 {task_pk} 的字段统计：{scanned} 条提交，{len(stats)} 个字段")
+        return stats
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"重建任务 {task_pk} 的字段统计失败: {str(e)}")
+        return accumulator.finish()
+
+
+def summarize_field(stat):
+    """统计行 -> 摘要字典：类型按占比超过80%的值类型判断，与原先逐条统计的规则一致"""
+    top = stat.top if isinstance(stat, _FieldAggregate) else (json_codec.loads(stat.top_values) if stat.top_values else {})
+    summary = {
+        'field': stat.field,
+        'count': stat.value_count,
+        'numeric_count': stat.numeric_count,
+        'true_count': stat.true_count,
+        'false_count': stat.false_count,
+        'text_count': stat.text_count,
+        'top_values': sorted(top.items(), key=lambda item: -item[1])[:5]
+    }
+    if stat.numeric_count > stat.value_count * DOMINANT_RATIO:
+        summary['type'] = 'numeric'
+    elif stat.true_count + stat.false_count > stat.value_count * DOMINANT_RATIO:
+        summary['type'] = 'boolean'
+    else:
+        summary['type'] = 'text'
+    if stat.numeric_count:
+        mean = stat.numeric_sum / stat.numeric_count
+        variance = max(0.0, stat.numeric_sumsq / stat.numeric_count - mean * mean)
+        summary.update(min=stat.numeric_min, max=stat.numeric_max, mean=mean, std=math.sqrt(variance))
+    return summary
+
+
+def summarize_payloads(payloads):
+    """不经过数据库，直接按一组提交数据计算字段摘要"""
+    accumulator = FieldStatsAccumulator(None)
+    for data in payloads:
+        accumulator.add(data)
+    return accumulator.summaries()
+
+
+def load_field_stats(SessionLocal, task_pk):
+    """读取任务的字段摘要（按字段首次出现的顺序）
+
+    统计尚未建立、被标记过期或汇总的提交数与任务提交数不一致时，先重建。
+    """
+    db = SessionLocal()
+    try:
+        task = db.query(Task.submission_count, Task.field_stats_count).filter(Task.id == task_pk).first()
+        if task is None:
+            return []
+        stats = (
+            db.query(SubmissionFieldStat)
+            .filter_by(task_id=task_pk)
+            .order_by(SubmissionFieldStat.position)
+            .all()
+        )
+        if task.field_stats_count is None or task.field_stats_count != (task.submission_count or 0) \
+                or any(stat.stale for stat in stats):
+            if task.field_stats_count is not None and task.field_stats_count != (task.submission_count or 0):
+                logger.info(f"任务 {task_pk} 的字段统计（{task.field_stats_count} 条）与提交数（{task.submission_count}）不一致，重建")
+            stats = rebuild_field_stats(db, task_pk)
+        return [summarize_field(stat) for stat in stats if stat.value_count > 0]
+    finally:
+        db.close()
@@ -0,0 +1,129 @@
+"""AI服务商HTTP客户端 - 每个服务商一个共享的 requests.Session
+
+连接池按主机复用连接（keep-alive），连续调用同一服务商时不再重复TCP+TLS握手。
+重试策略：连接失败，以及 5xx 状态码按指数退避重试，遵循 Retry-After；
+读取超时不重试（请求可能已被服务商处理，重试会重复计费）。
+429（限流）不在这里重试：由 ai_admission_service 按 Retry-After 暂停该密钥的放行后重新排队，
+避免每个请求各自重试放大负载。
+QuickForm 与 ChatServer 共用同一个注册表（ChatServer 通过 main.py 加入的 sys.path 导入）。
+安装了httpx时AI请求改由 ai_gateway_service 的异步客户端发送（重试策略相同），这里的连接池作为回退。
+"""
+import os
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_CONNECTIONS = int(os.getenv('QUICKFORM_HTTP_POOL_CONNECTIONS', '4'))  # 每个服务商缓存的主机连接池个数
+HTTP_POOL_SIZE = int(os.getenv('QUICKFORM_HTTP_POOL_SIZE', '16'))  # 每个主机保持的空闲连接数
+HTTP_RETRIES = int(os.getenv('QUICKFORM_HTTP_RETRIES', '2'))
+HTTP_BACKOFF = float(os.getenv('QUICKFORM_HTTP_BACKOFF', '0.5'))
+RETRY_STATUS = (500, 502, 503, 504)
+
+# 服务商 -> 接口地址
+PROVIDER_URLS = {
+    'deepseek': 'https://api.deepseek.com/v1/chat/completions',
+    'doubao': 'https://ark.cn-beijing.volces.com/api/v3/chat/completions',
+    'qwen': 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation',
+    'siliconflow': 'https://api.siliconflow.cn/v1/chat/completions',
+}
+
+
+def build_retry(retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+    """POST 也重试，但只在请求未被处理（连接失败）或服务商出错（5xx）时"""
+    return Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+
+
+class ProviderClientRegistry:
+    """按服务商名称懒创建并缓存 Session
+
+    Args:
+        pool_connections: 每个 Session 缓存的主机连接池个数
+        pool_size: 每个主机连接池的连接数上限（同时进行的请求超过该值时，多出的连接用完即关闭）
+        retries: 最大重试次数
+        backoff: 指数退避系数（秒）
+    """
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES,
+                 backoff=HTTP_BACKOFF):
+        self.pool_connections = pool_connections
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self._sessions = {}
+        self._requests = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def session(self, provider):
+        session = self._sessions.get(provider)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(provider)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_size,
+                    max_retries=build_retry(self.retries, self.backoff)
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[provider] = session
+                self._requests[provider] = 0
+                self._errors[provider] = 0
+                logger.info(f"已创建服务商 {provider} 的HTTP连接池: pool_size={self.pool_size}, retries={self.retries}")
+        return session
+
+    def post(self, provider, url, **kwargs):
+        """通过服务商的共享 Session 发送 POST，参数与 requests.post 相同"""
+        session = self.session(provider)
+        with self._lock:
+            self._requests[provider] += 1
+        try:
+            return session.post(url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errors[provider] += 1
+            raise
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'retries': self.retries,
+                'providers': {
+                    provider: {'requests': self._requests[provider], 'errors': self._errors[provider]}
+                    for provider in self._sessions
+                }
+            }
+
+
+provider_clients = ProviderClientRegistry()
+
+
+def post(provider, url, **kwargs):
+    """provider_clients.post 的快捷方式"""
+    return provider_clients.post(provider, url, **kwargs)
@@ -0,0 +1,262 @@
+"""分析任务状态存储 - 保存分析报告的进度与结果，按TTL和条数上限淘汰，支持内存与SQLite共享两种后端
+
+状态为可JSON序列化的字典（status / progress / message / partial / report ...）：
+- 进行中的状态保留 running_ttl 秒（防止异常退出的任务永远停留在"生成中"），结束后的状态保留 ttl 秒，
+  报告本身已写入数据库，过期后状态查询会回退到数据库；
+- 条数超过 max_entries 时淘汰最久未更新的状态；
+- 多个worker进程部署时使用SQLite后端，任一进程都能查询到其他进程中任务的进度。
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('completed', 'error')
+
+
+def _matches(state, if_match):
+    return state is not None and all(state.get(field) == value for field, value in if_match.items())
+
+
+class _StateTTL:
+    """按状态计算过期时间"""
+
+    def __init__(self, ttl, running_ttl):
+        self.ttl = ttl
+        self.running_ttl = running_ttl
+
+    def expires_at(self, state, now):
+        return now + (self.ttl if state.get('status') in FINISHED_STATUSES else self.running_ttl)
+
+
+class MemoryJobStateBackend(_StateTTL):
+    """进程内存储，状态按最后更新时间排序，超过上限时淘汰最久未更新的
+
+    Args:
+        ttl: 已结束状态的保留时间（秒）
+        running_ttl: 进行中状态的保留时间（秒）
+        max_entries: 最多保存的状态条数
+    """
+
+    name = 'memory'
+
+    def __init__(self, ttl=600, running_ttl=3600, max_entries=1000):
+        super().__init__(ttl, running_ttl)
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (过期时间, 状态)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expired = 0
+
+    def _get(self, key, now):
+        """调用方持有锁"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self._data[key]
+            self.expired += 1
+            return None
+        return item[1]
+
+    def _put(self, key, state, now):
+        """调用方持有锁"""
+        self._data[key] = (self.expires_at(state, now), state)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            state = self._get(key, time.time())
+            return dict(state) if state is not None else None
+
+    def set(self, key, state):
+        with self._lock:
+            self._put(key, dict(state), time.time())
+
+    def update(self, key, fields, if_match=None, replace=False):
+        now = time.time()
+        with self._lock:
+            current = self._get(key, now)
+            if if_match is not None and not _matches(current, if_match):
+                return False
+            if current is None and not replace:
+                return False
+            self._put(key, dict(fields) if replace else dict(current, **fields), now)
+            return True
+
+    def delete(self, key, if_match=None):
+        with self._lock:
+            current = self._get(key, time.time())
+            if current is None or (if_match is not None and not _matches(current, if_match)):
+                return False
+            del self._data[key]
+            return True
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+            for key in expired:
+                del self._data[key]
+            self.expired += len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'entries': len(self._data), 'max_entries': self.max_entries,
+                    'ttl': self.ttl, 'running_ttl': self.running_ttl, 'evictions': self.evictions,
+                    'expired': self.expired}
+
+
+class SQLiteJobStateBackend(_StateTTL):
+    """SQLite共享存储，多个worker进程共用同一个数据库文件
+
+    读-改-写在 BEGIN IMMEDIATE 事务内完成；每写入 prune_every 次清理一次过期状态并执行条数上限。
+
+    Args:
+        path: 数据库文件路径
+        ttl: 已结束状态的保留时间（秒）
+        running_ttl: 进行中状态的保留时间（秒）
+        max_entries: 最多保存的状态条数
+        prune_every: 每写入多少次执行一次清理
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, ttl=600, running_ttl=3600, max_entries=1000, prune_every=200):
+        super().__init__(ttl, running_ttl)
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self.evictions = 0
+        self.expired = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_state ("
+            "state_key TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_job_state_updated_at ON job_state (updated_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None：由代码显式控制事务
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _get(self, conn, key, now):
+        row = conn.execute(
+            "SELECT state FROM job_state WHERE state_key = ? AND expires_at > ?", (str(key), now)
+        ).fetchone()
+        return json_codec.loads(row[0]) if row else None
+
+    def _put(self, conn, key, state, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO job_state (state_key, state, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+            (str(key), json_codec.dumps(state), self.expires_at(state, now), now)
+        )
+
+    def _written(self):
+        with self._writes_lock:
+            self._writes += 1
+            should_prune = self._writes % self.prune_every == 0
+        if should_prune:
+            self.prune()
+
+    def get(self, key):
+        return self._get(self._conn(), key, time.time())
+
+    def set(self, key, state):
+        self._put(self._conn(), key, state, time.time())
+        self._written()
+
+    def update(self, key, fields, if_match=None, replace=False):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = self._get(conn, key, now)
+            if (if_match is not None and not _matches(current, if_match)) or (current is None and not replace):
+                conn.execute('ROLLBACK')
+                return False
+            self._put(conn, key, dict(fields) if replace else dict(current, **fields), now)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        self._written()
+        return True
+
+    def delete(self, key, if_match=None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = self._get(conn, key, now)
+            if current is None or (if_match is not None and not _matches(current, if_match)):
+                conn.execute('ROLLBACK')
+                return False
+            conn.execute("DELETE FROM job_state WHERE state_key = ?", (str(key),))
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def prune(self):
+        """删除过期的状态，并把条数控制在max_entries以内"""
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self.expired += conn.execute("DELETE FROM job_state WHERE expires_at <= ?", (time.time(),)).rowcount
+            total = conn.execute("SELECT COUNT(*) FROM job_state").fetchone()[0]
+            excess = total - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM job_state WHERE state_key IN "
+                    "(SELECT state_key FROM job_state ORDER BY updated_at LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.warning(f"清理分析任务状态失败: {str(e)}")
+
+    def stats(self):
+        try:
+            entries = self._conn().execute("SELECT COUNT(*) FROM job_state").fetchone()[0]
+        except Exception:
+            entries = None
+        return {'backend': self.name, 'path': self.path, 'entries': entries, 'max_entries': self.max_entries,
+                'ttl': self.ttl, 'running_ttl': self.running_ttl, 'evictions': self.evictions,
+                'expired': self.expired}
+
+
+def build_job_state_store(backend, ttl=600, running_ttl=3600, max_entries=1000, sqlite_path=None):
+    """按配置创建状态存储；backend 为 'memory' 或 'sqlite'"""
+    if backend == 'sqlite':
+        return SQLiteJobStateBackend(sqlite_path, ttl=ttl, running_ttl=running_ttl, max_entries=max_entries)
+    if backend != 'memory':
+        logger.warning(f"未知的分析任务状态存储后端 {backend}，使用内存存储")
+    return MemoryJobStateBackend(ttl=ttl, running_ttl=running_ttl, max_entries=max_entries)
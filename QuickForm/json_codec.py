@@ -0,0 +1,118 @@
+"""JSON编解码 - 安装了orjson时使用orjson，否则回退到标准库json
+
+QuickForm、VoteSite、ChatServer共用：
+- dumps/dumps_bytes/loads：紧凑、不转义中文的编解码，两种实现输出一致
+- raw_json_response/splice_raw_array：把数据库中已存储的JSON文本直接写入响应体，不做解析和重新编码
+- CodecJSONProvider：Flask的JSON提供者，使 jsonify 也走同一个编解码器
+"""
+import re
+import json
+import logging
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+# loads 失败时抛出的异常（orjson.JSONDecodeError 也是 ValueError 的子类）
+JSONDecodeError = ValueError
+
+_COMPACT = (',', ':')
+
+# orjson把超过64位的整数解析为浮点数（丢失精度）；出现19位以上连续数字时改用标准库解析
+_LONG_DIGITS = re.compile(r'\d{19}')
+_LONG_DIGITS_BYTES = re.compile(rb'\d{19}')
+
+
+def _orjson_safe(data):
+    if isinstance(data, str):
+        return not _LONG_DIGITS.search(data)
+    return not _LONG_DIGITS_BYTES.search(data)
+
+
+def _stdlib_dumps(obj, sort_keys=False, default=None):
+    return json.dumps(obj, ensure_ascii=False, separators=_COMPACT, sort_keys=sort_keys, default=default)
+
+
+def dumps(obj, sort_keys=False, default=None):
+    """序列化为紧凑JSON文本（中文不转义）"""
+    if orjson:
+        try:
+            option = orjson.OPT_SORT_KEYS if sort_keys else 0
+            return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            # orjson不支持的值（如超过64位的整数）交给标准库处理
+            pass
+    return _stdlib_dumps(obj, sort_keys=sort_keys, default=default)
+
+
+def dumps_bytes(obj, sort_keys=False, default=None):
+    """序列化为UTF-8编码的JSON字节串"""
+    if orjson:
+        try:
+            option = orjson.OPT_SORT_KEYS if sort_keys else 0
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, sort_keys=sort_keys, default=default).encode('utf-8')
+
+
+def loads(data):
+    """解析JSON文本或字节串"""
+    if orjson and _orjson_safe(data):
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def splice_raw_array(payload, key, raw_items):
+    """把一组已是JSON文本的元素作为数组放入 payload[key]，返回完整的JSON文本
+
+    payload 中的其余字段正常序列化；raw_items 原样拼接，不做解析。
+    """
+    envelope = dumps(payload)
+    if envelope == '{}':
+        return '{' + dumps(key) + ':[' + ','.join(raw_items) + ']}'
+    return envelope[:-1] + ',' + dumps(key) + ':[' + ','.join(raw_items) + ']}'
+
+
+def raw_json_response(body, status=200):
+    """用已序列化的JSON（文本或字节串）直接构造响应"""
+    return current_app.response_class(body, status=status, content_type='application/json; charset=utf-8')
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """使 jsonify / request.get_json 使用本模块的编解码器
+
+    日期、Decimal、UUID等类型仍按Flask默认规则转换（orjson原生的日期格式与Flask不同，这里不使用）。
+    输出为UTF-8（不转义中文），响应头已声明 charset=utf-8。
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson:
+            indent = kwargs.pop('indent', None)
+            kwargs.pop('separators', None)
+            if not kwargs:
+                option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+                if self.sort_keys:
+                    option |= orjson.OPT_SORT_KEYS
+                if indent:
+                    option |= orjson.OPT_INDENT_2
+                try:
+                    return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+                except TypeError:
+                    pass
+            if indent:
+                kwargs['indent'] = indent
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson and not kwargs and _orjson_safe(s):
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
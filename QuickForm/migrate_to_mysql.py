@@ -864,7 +864,7 @@ def migrate_data():
         logger.info("=" * 60)
         
         # 迁移其他表
-        for table_name in ['ai_config', 'certification_request']:
+        for table_name in ['ai_config', 'certification_request', 'rate_limit_event', 'submission_field_stat']:
             try:
                 logger.info(f"开始迁移 {table_name} 表...")
                 sqlite_rows = sqlite_session.execute(text(f"SELECT * FROM {table_name}")).fetchall()
@@ -1,9 +1,10 @@
 """数据库模型定义和迁移"""
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, inspect, text
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float, Index, UniqueConstraint, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from flask_login import UserMixin
 from datetime import datetime
+import re
 import uuid
 import secrets
 import logging
@@ -70,6 +71,7 @@ class Task(Base):
     submission = relationship('Submission', back_populates='task', cascade='all, delete-orphan')
     file_name = Column(String(200))
     file_path = Column(String(500))
+    stored_filename = Column(String(255), index=True)  # 上传文件保存后的文件名（file_path的末段），供/uploads按文件名查任务
     task_id = Column(String(50), unique=True, default=lambda: secrets.token_urlsafe(8))
     analysis_report = Column(Text)
     report_file_path = Column(String(500))
@@ -79,20 +81,76 @@ class Task(Base):
     html_approved_by = Column(Integer, ForeignKey('user.id'), nullable=True)  # 审核人ID
     html_approved_at = Column(DateTime, nullable=True)  # 审核时间
     html_review_note = Column(Text)
-    rate_limit_log = Column(Text)
+    rate_limit_log = Column(Text)  # 已废弃，迁移时转存到rate_limit_event表
     custom_prompt = Column(Text)  # 用户自定义的分析提示词（已废弃，保留用于兼容）
     user_prompt_template = Column(Text)  # 用户自定义的提示词模板（不包含数据部分）
     is_featured = Column(Boolean, default=False)  # 是否加精
+    submission_count = Column(Integer, default=0)  # 提交数量（与提交/删除在同一事务中维护）
+    last_submitted_at = Column(DateTime)  # 最后一次提交时间
+    field_stats_count = Column(Integer, default=0)  # 字段统计已汇总的提交数；为空或与submission_count不一致时重建
     approver = relationship('User', foreign_keys=[html_approved_by], backref='approved_tasks')
 
 
 class Submission(Base):
     __tablename__ = 'submission'
+    __table_args__ = (
+        # 几乎所有查询都是 task_id 过滤 + 按提交时间排序
+        Index('ix_submission_task_submitted', 'task_id', 'submitted_at', 'id'),
+        # 导出时按结构指纹汇总字段（只扫描索引）
+        Index('ix_submission_task_schema', 'task_id', 'schema_fp'),
+    )
     id = Column(Integer, primary_key=True)
     task_id = Column(Integer, ForeignKey('task.id', ondelete='CASCADE'))  # 数据库层面级联删除
     task = relationship('Task', back_populates='submission')
-    data = Column(Text, nullable=False)
+    data = Column(Text, nullable=False)  # 规范化后的紧凑JSON（schema_fp为空的旧数据可能是原始文本）
     submitted_at = Column(DateTime, default=datetime.now)
+    schema_fp = Column(String(16))  # 字段结构指纹，写入时计算；为空表示尚未规范化
+
+
+class SubmissionFieldStat(Base):
+    """任务各字段的汇总统计，随提交/删除增量维护（见 field_stats_service）"""
+    __tablename__ = 'submission_field_stat'
+    __table_args__ = (
+        UniqueConstraint('task_id', 'field', name='uq_submission_field_stat_task_field'),
+    )
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
+    field = Column(String(255), nullable=False)
+    position = Column(Integer, default=0)  # 字段首次出现的顺序
+    value_count = Column(Integer, default=0)  # 出现次数
+    numeric_count = Column(Integer, default=0)
+    numeric_sum = Column(Float, default=0)
+    numeric_sumsq = Column(Float, default=0)
+    numeric_min = Column(Float)
+    numeric_max = Column(Float)
+    true_count = Column(Integer, default=0)
+    false_count = Column(Integer, default=0)
+    text_count = Column(Integer, default=0)
+    top_values = Column(Text)  # 文本值的有界Top-K计数（JSON对象）
+    stale = Column(Boolean, default=False)  # 删除了等于最小/最大值的提交，需要重建
+
+
+class SubmissionSpoolCheckpoint(Base):
+    """提交写缓冲落盘文件的入库进度，与批量插入在同一事务中更新"""
+    __tablename__ = 'submission_spool_checkpoint'
+    spool_name = Column(String(100), primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)  # 已入库的最大序号
+    updated_at = Column(DateTime, default=datetime.now)
+
+
+class RateLimitEvent(Base):
+    """限流封禁事件（只追加），取代 task.rate_limit_log 文本字段"""
+    __tablename__ = 'rate_limit_event'
+    __table_args__ = (
+        # 任务详情页按任务查询最近的封禁记录
+        Index('ix_rate_limit_event_task_created', 'task_id', 'created_at'),
+    )
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('task.id', ondelete='CASCADE'))
+    client_ip = Column(String(64), nullable=False)
+    window_seconds = Column(Integer)  # 触发封禁的统计窗口（秒）
+    ban_seconds = Column(Integer)  # 封禁时长（秒）
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # UTC时间
 
 
 class AIConfig(Base):
@@ -126,6 +184,62 @@ class CertificationRequest(Base):
     reviewer = relationship('User', foreign_keys=[reviewed_by], backref='processed_certification_requests')
 
 
+# 迁移时补建的索引：(表名, 索引名, 列)
+MIGRATION_INDEXES = [
+    ('submission', 'ix_submission_task_submitted', 'task_id, submitted_at, id'),
+    ('task', 'ix_task_stored_filename', 'stored_filename'),
+    ('submission', 'ix_submission_task_schema', 'task_id, schema_fp'),
+]
+
+
+def stored_filename_of(file_path):
+    """取上传文件路径的末段文件名（兼容Windows路径分隔符）"""
+    if not file_path:
+        return None
+    return file_path.replace('\\', '/').split('/')[-1]
+
+
+# 旧版 rate_limit_log 的单行格式
+RATE_LIMIT_LOG_PATTERN = re.compile(r'\[([^\]]+)\]\s*IP\s+(\S+)\s+在\s+(\d+)s\s+内多次提交，已暂时封禁\s+(\d+)\s+分钟')
+
+
+def parse_rate_limit_log(log_text):
+    """解析旧版 rate_limit_log 文本，返回 [(created_at, client_ip, window_seconds, ban_seconds)]"""
+    events = []
+    for line in (log_text or '').splitlines():
+        match = RATE_LIMIT_LOG_PATTERN.search(line)
+        if not match:
+            continue
+        try:
+            created_at = datetime.strptime(match.group(1).strip(), '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+        events.append((created_at, match.group(2)[:64], int(match.group(3)), int(match.group(4)) * 60))
+    return events
+
+
+def migrate_rate_limit_log(engine):
+    """把 task.rate_limit_log 中的历史记录转存到 rate_limit_event 表，转存后清空原字段"""
+    RateLimitEvent.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        rows = conn.execute(text(
+            "SELECT id, rate_limit_log FROM task WHERE rate_limit_log IS NOT NULL AND rate_limit_log != ''"
+        )).fetchall()
+        migrated = 0
+        for task_pk, log_text in rows:
+            events = parse_rate_limit_log(log_text)
+            if events:
+                conn.execute(RateLimitEvent.__table__.insert(), [
+                    {'task_id': task_pk, 'client_ip': ip, 'window_seconds': window,
+                     'ban_seconds': ban, 'created_at': created_at}
+                    for created_at, ip, window, ban in events
+                ])
+                migrated += len(events)
+            conn.execute(text("UPDATE task SET rate_limit_log = NULL WHERE id = :id"), {'id': task_pk})
+    if rows:
+        logger.info(f"成功将 {len(rows)} 个任务的rate_limit_log转存为 {migrated} 条限流事件")
+
+
 def migrate_database(engine):
     """数据库迁移函数"""
     try:
@@ -134,6 +248,7 @@ def migrate_database(engine):
         ai_cfg_cols = [col['name'] for col in inspector.get_columns('ai_config')] if 'ai_config' in inspector.get_table_names() else []
         task_cols = [col['name'] for col in inspector.get_columns('task')] if 'task' in inspector.get_table_names() else []
         cert_req_cols = [col['name'] for col in inspector.get_columns('certification_request')] if 'certification_request' in inspector.get_table_names() else []
+        submission_cols = [col['name'] for col in inspector.get_columns('submission')] if 'submission' in inspector.get_table_names() else []
         
         with engine.begin() as conn:
             if 'school' not in columns:
@@ -264,6 +379,52 @@ def migrate_database(engine):
                 except Exception as e:
                     logger.warning(f"添加is_featured失败（可能已存在）: {str(e)}")
 
+            # task 新增提交计数字段，并按现有数据回填
+            if task_cols and ('submission_count' not in task_cols or 'last_submitted_at' not in task_cols):
+                try:
+                    if 'submission_count' not in task_cols:
+                        conn.execute(text("ALTER TABLE task ADD COLUMN submission_count INTEGER DEFAULT 0"))
+                    if 'last_submitted_at' not in task_cols:
+                        conn.execute(text("ALTER TABLE task ADD COLUMN last_submitted_at DATETIME"))
+                    conn.execute(text(
+                        "UPDATE task SET "
+                        "submission_count = (SELECT COUNT(*) FROM submission WHERE submission.task_id = task.id), "
+                        "last_submitted_at = (SELECT MAX(submitted_at) FROM submission WHERE submission.task_id = task.id)"
+                    ))
+                    logger.info("成功为task添加submission_count/last_submitted_at字段并回填")
+                except Exception as e:
+                    logger.warning(f"添加submission_count/last_submitted_at失败（可能已存在）: {str(e)}")
+
+            # task 新增 field_stats_count 字段；旧任务保持为空，首次读取字段统计时重建
+            if task_cols and 'field_stats_count' not in task_cols:
+                try:
+                    conn.execute(text("ALTER TABLE task ADD COLUMN field_stats_count INTEGER"))
+                    logger.info("成功为task添加field_stats_count字段")
+                except Exception as e:
+                    logger.warning(f"添加field_stats_count失败（可能已存在）: {str(e)}")
+
+            # task 新增 stored_filename 字段，并由 file_path 回填
+            if task_cols and 'stored_filename' not in task_cols:
+                try:
+                    conn.execute(text("ALTER TABLE task ADD COLUMN stored_filename VARCHAR(255)"))
+                    rows = conn.execute(text("SELECT id, file_path FROM task WHERE file_path IS NOT NULL AND file_path != ''")).fetchall()
+                    for task_pk, file_path in rows:
+                        conn.execute(
+                            text("UPDATE task SET stored_filename = :name WHERE id = :id"),
+                            {'name': stored_filename_of(file_path), 'id': task_pk}
+                        )
+                    logger.info(f"成功为task添加stored_filename字段，回填 {len(rows)} 条")
+                except Exception as e:
+                    logger.warning(f"添加stored_filename失败（可能已存在）: {str(e)}")
+
+            # submission 新增 schema_fp 字段（旧数据由 normalize_submissions.py 回填）
+            if submission_cols and 'schema_fp' not in submission_cols:
+                try:
+                    conn.execute(text("ALTER TABLE submission ADD COLUMN schema_fp VARCHAR(16)"))
+                    logger.info("成功为submission添加schema_fp字段")
+                except Exception as e:
+                    logger.warning(f"添加schema_fp失败（可能已存在）: {str(e)}")
+
             # 创建认证申请表
             if 'certification_request' not in inspector.get_table_names():
                 try:
@@ -271,5 +432,25 @@ def migrate_database(engine):
                     logger.info("成功创建certification_request表")
                 except Exception as e:
                     logger.warning(f"创建certification_request表失败: {str(e)}")
+
+        # 为热点查询创建索引（SQLite与MySQL语法一致）
+        for table_name, index_name, columns_sql in MIGRATION_INDEXES:
+            if table_name not in inspector.get_table_names():
+                continue
+            existing = {idx['name'] for idx in inspect(engine).get_indexes(table_name)}
+            if index_name in existing:
+                continue
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"CREATE INDEX {index_name} ON {table_name} ({columns_sql})"))
+                logger.info(f"成功为{table_name}创建索引{index_name}")
+            except Exception as e:
+                logger.warning(f"创建索引{index_name}失败（可能已存在）: {str(e)}")
+
+        if 'task' in inspector.get_table_names():
+            try:
+                migrate_rate_limit_log(engine)
+            except Exception as e:
+                logger.warning(f"转存rate_limit_log失败: {str(e)}")
     except Exception as e:
         logger.error(f"数据库迁移失败: {str(e)}")
@@ -0,0 +1,76 @@
+"""
+回填提交数据的规范化存储：解开双重编码、改写为紧凑JSON并计算字段结构指纹（submission.schema_fp）
+新提交在写入时已规范化，本脚本只处理 schema_fp 为空的历史数据，可重复执行
+支持SQLite和MySQL两种数据库（与应用相同：配置了MySQL环境变量则使用MySQL，否则使用SQLite）
+
+用法: python normalize_submissions.py [--batch-size 1000] [--dry-run]
+"""
+import os
+import sys
+import time
+import argparse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+from models import migrate_database
+from submission_service import normalize_submissions
+
+# 加载环境变量
+project_root = os.path.dirname(QUICKFORM_DIR)
+env_path = os.path.join(project_root, '.env')
+if os.path.exists(env_path):
+    load_dotenv(env_path)
+else:
+    load_dotenv()
+
+SQLITE_DB_PATH = os.path.join(QUICKFORM_DIR, 'quickform.db')
+
+MYSQL_HOST = os.getenv('MYSQL_HOST', '')
+MYSQL_PORT = os.getenv('MYSQL_PORT', '3306')
+MYSQL_USER = os.getenv('MYSQL_USER', '')
+MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
+MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'quickform')
+
+
+def get_database_url():
+    if MYSQL_HOST and MYSQL_USER and MYSQL_PASSWORD:
+        return f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}?charset=utf8mb4'
+    return f'sqlite:///{SQLITE_DB_PATH}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回填提交数据的规范化存储')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的条数（每批一个事务）')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不写入数据库')
+    args = parser.parse_args()
+
+    database_url = get_database_url()
+    print("=" * 60)
+    print("规范化历史提交数据" + ("（仅检查）" if args.dry_run else ""))
+    print(f"数据库: {database_url.split('@')[-1]}")
+    print("=" * 60)
+
+    engine = create_engine(database_url, pool_pre_ping=True)
+    # 确保schema_fp字段已存在
+    migrate_database(engine)
+    db = sessionmaker(bind=engine)()
+    start = time.time()
+    try:
+        scanned, changed, unparsable = normalize_submissions(db, batch_size=args.batch_size, dry_run=args.dry_run)
+    finally:
+        db.close()
+
+    print(f"\n处理 {scanned:,} 条，其中 {changed:,} 条内容被改写（双重编码/非紧凑格式），"
+          f"{unparsable:,} 条无法解析为JSON（原样保留），耗时 {time.time() - start:.1f}s")
+    if not args.dry_run and scanned:
+        print("\n✓ 已完成")
+    print("\n" + "=" * 60)
+
+
+if __name__ == '__main__':
+    main()
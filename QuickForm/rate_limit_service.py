@@ -0,0 +1,420 @@
+"""提交限流服务 - 滑动窗口计数 + 黑名单，支持内存与SQLite共享两种存储后端；封禁事件批量写入rate_limit_event表
+
+滑动窗口采用"两个固定窗口加权"的近似算法：只保存当前窗口和上一窗口的计数，
+估计值 = 上一窗口计数 × 剩余重叠比例 + 当前窗口计数，每次判断都是O(1)。
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import insert
+
+from models import RateLimitEvent
+
+logger = logging.getLogger(__name__)
+
+# allowed: 是否放行；count: 当前窗口内的估计请求数；blacklisted_now: 本次请求触发了封禁
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'count', 'blacklisted_now'])
+
+
+def client_key(forwarded_for, remote_addr):
+    """从X-Forwarded-For中取最前面的客户端地址作为限流键，没有时使用remote_addr"""
+    if forwarded_for:
+        first = forwarded_for.split(',', 1)[0].strip()
+        if first:
+            return first[:64]
+    return remote_addr or 'unknown'
+
+
+def _advance(window_id, curr, prev, now, window):
+    """把计数状态推进到now所在的窗口，返回 (window_id, curr, prev)"""
+    now_id = int(now // window)
+    if window_id == now_id:
+        return window_id, curr, prev
+    if window_id == now_id - 1:
+        return now_id, 0, curr
+    return now_id, 0, 0
+
+
+def _estimate(curr, prev, now, window):
+    elapsed = (now % window) / window
+    return prev * (1 - elapsed) + curr
+
+
+class MemoryRateLimitBackend:
+    """进程内存储，按LRU淘汰最久未出现的客户端，内存占用有上限
+
+    Args:
+        max_keys: 最多保存的客户端数量
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()  # key -> [window_id, curr, prev, blacklist_until]
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def blacklisted_until(self, key, now):
+        with self._lock:
+            state = self._data.get(key)
+            if state and state[3] > now:
+                return state[3]
+        return 0
+
+    def hit(self, key, now, window, threshold, blacklist_duration):
+        with self._lock:
+            state = self._data.get(key)
+            if state is None:
+                state = [int(now // window), 0, 0, 0]
+                self._data[key] = state
+                while len(self._data) > self.max_keys:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._data.move_to_end(key)
+            if state[3] > now:
+                return RateLimitResult(False, _estimate(state[1], state[2], now, window), False)
+            state[0], state[1], state[2] = _advance(state[0], state[1], state[2], now, window)
+            state[1] += 1
+            count = _estimate(state[1], state[2], now, window)
+            if count > threshold:
+                state[3] = now + blacklist_duration
+                return RateLimitResult(False, count, True)
+            return RateLimitResult(True, count, False)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'keys': len(self._data), 'max_keys': self.max_keys,
+                    'evictions': self.evictions}
+
+
+class SQLiteRateLimitBackend:
+    """SQLite共享存储，多个worker进程共用同一个数据库文件，限流在进程间同样生效
+
+    每次计数在 BEGIN IMMEDIATE 事务内完成读-改-写；定期清理长期未出现的客户端，
+    并在超过 max_keys 时按最后出现时间淘汰。
+
+    Args:
+        path: 数据库文件路径
+        max_keys: 最多保存的客户端数量
+        prune_every: 每计数多少次执行一次清理
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_keys=100000, prune_every=1000):
+        self.path = path
+        self.max_keys = max_keys
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._hits = 0
+        self._hits_lock = threading.Lock()
+        self.evictions = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_state ("
+            "client_key TEXT PRIMARY KEY, window_id INTEGER NOT NULL, curr INTEGER NOT NULL, "
+            "prev INTEGER NOT NULL, blacklist_until REAL NOT NULL, last_seen REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_limit_state_last_seen ON rate_limit_state (last_seen)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None：由代码显式控制事务
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def blacklisted_until(self, key, now):
+        row = self._conn().execute(
+            "SELECT blacklist_until FROM rate_limit_state WHERE client_key = ?", (key,)
+        ).fetchone()
+        if row and row[0] > now:
+            return row[0]
+        return 0
+
+    def hit(self, key, now, window, threshold, blacklist_duration):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT window_id, curr, prev, blacklist_until FROM rate_limit_state WHERE client_key = ?",
+                (key,)
+            ).fetchone()
+            window_id, curr, prev, blacklist_until = row if row else (int(now // window), 0, 0, 0)
+            if blacklist_until > now:
+                result = RateLimitResult(False, _estimate(curr, prev, now, window), False)
+            else:
+                window_id, curr, prev = _advance(window_id, curr, prev, now, window)
+                curr += 1
+                count = _estimate(curr, prev, now, window)
+                if count > threshold:
+                    blacklist_until = now + blacklist_duration
+                    result = RateLimitResult(False, count, True)
+                else:
+                    result = RateLimitResult(True, count, False)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_state "
+                "(client_key, window_id, curr, prev, blacklist_until, last_seen) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, window_id, curr, prev, blacklist_until, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+        with self._hits_lock:
+            self._hits += 1
+            should_prune = self._hits % self.prune_every == 0
+        if should_prune:
+            self.prune(now, window)
+        return result
+
+    def prune(self, now, window):
+        """删除已过期的客户端状态，并把数量控制在max_keys以内"""
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "DELETE FROM rate_limit_state WHERE last_seen < ? AND blacklist_until < ?",
+                (now - 2 * window, now)
+            )
+            total = conn.execute("SELECT COUNT(*) FROM rate_limit_state").fetchone()[0]
+            excess = total - self.max_keys
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM rate_limit_state WHERE client_key IN "
+                    "(SELECT client_key FROM rate_limit_state ORDER BY last_seen LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.warning(f"清理限流状态失败: {str(e)}")
+
+    def stats(self):
+        try:
+            keys = self._conn().execute("SELECT COUNT(*) FROM rate_limit_state").fetchone()[0]
+        except Exception:
+            keys = None
+        return {'backend': self.name, 'path': self.path, 'keys': keys, 'max_keys': self.max_keys,
+                'evictions': self.evictions}
+
+
+class RateLimiter:
+    """按客户端限流：window 秒内超过 threshold 次请求即封禁 blacklist_duration 秒"""
+
+    def __init__(self, backend, window, threshold, blacklist_duration):
+        self.backend = backend
+        self.window = window
+        self.threshold = threshold
+        self.blacklist_duration = blacklist_duration
+
+    def is_blacklisted(self, key, now=None):
+        """只读检查，不计数；用于在解析请求之前快速拒绝已封禁的客户端"""
+        return self.backend.blacklisted_until(key, time.time() if now is None else now) > 0
+
+    def hit(self, key, now=None):
+        """记录一次请求并返回 RateLimitResult"""
+        now = time.time() if now is None else now
+        return self.backend.hit(key, now, self.window, self.threshold, self.blacklist_duration)
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats.update({'window': self.window, 'threshold': self.threshold,
+                      'blacklist_duration': self.blacklist_duration})
+        return stats
+
+
+def build_rate_limiter(backend, window, threshold, blacklist_duration, max_keys=10000, sqlite_path=None):
+    """按配置创建限流器；backend 为 'memory' 或 'sqlite'"""
+    if backend == 'sqlite':
+        store = SQLiteRateLimitBackend(sqlite_path, max_keys=max_keys)
+    else:
+        if backend != 'memory':
+            logger.warning(f"未知的限流存储后端 {backend}，使用内存存储")
+        store = MemoryRateLimitBackend(max_keys=max_keys)
+    return RateLimiter(store, window, threshold, blacklist_duration)
+
+
+class RateLimitEventRecorder:
+    """封禁事件的批量写入器：事件先进入内存队列，由后台线程按批插入，并定期清理过期事件
+
+    事件仅用于展示与排查，队列满或写库失败时丢弃并计数，不影响请求处理。
+
+    Args:
+        SessionLocal: 会话工厂
+        flush_interval: 两次批量写入的最长间隔（秒）
+        batch_size: 队列达到该数量时立即写入
+        retention_days: 事件保留天数
+        max_pending: 队列上限
+    """
+
+    PURGE_INTERVAL = 3600  # 清理过期事件的间隔（秒）
+
+    def __init__(self, SessionLocal, flush_interval=1.0, batch_size=100, retention_days=30, max_pending=10000):
+        self.SessionLocal = SessionLocal
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._last_purge = 0
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.purged = 0
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='rate-limit-event-recorder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def record(self, task_pk, client_ip, window_seconds, ban_seconds, created_at=None):
+        event = {
+            'task_id': task_pk,
+            'client_ip': (client_ip or 'unknown')[:64],
+            'window_seconds': window_seconds,
+            'ban_seconds': ban_seconds,
+            'created_at': created_at or datetime.utcnow()
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append(event)
+            self.recorded += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """把队列中的事件写入数据库，返回写入条数"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        db = self.SessionLocal()
+        try:
+            db.execute(insert(RateLimitEvent), batch)
+            db.commit()
+            self.written += len(batch)
+            return len(batch)
+        except Exception as e:
+            db.rollback()
+            self.dropped += len(batch)
+            logger.error(f"写入限流事件失败，丢弃 {len(batch)} 条: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def purge(self, now=None):
+        """删除超过保留期的事件"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        db = self.SessionLocal()
+        try:
+            deleted = (
+                db.query(RateLimitEvent)
+                .filter(RateLimitEvent.created_at < cutoff)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            self.purged += deleted
+            if deleted:
+                logger.info(f"清理了 {deleted} 条超过 {self.retention_days} 天的限流事件")
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"清理限流事件失败: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - self._last_purge >= self.PURGE_INTERVAL:
+                self._last_purge = time.monotonic()
+                self.purge()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'recorded': self.recorded,
+            'written': self.written,
+            'dropped': self.dropped,
+            'purged': self.purged,
+            'pending': pending,
+            'retention_days': self.retention_days
+        }
+
+
+def query_rate_limit_events(db, task_pk, since=None, limit=200):
+    """按任务查询封禁事件（最新的在前），走 (task_id, created_at) 索引"""
+    query = db.query(RateLimitEvent).filter(RateLimitEvent.task_id == task_pk)
+    if since is not None:
+        query = query.filter(RateLimitEvent.created_at >= since)
+    return query.order_by(RateLimitEvent.created_at.desc(), RateLimitEvent.id.desc()).limit(limit).all()
+
+
+def active_bans(db, task_pk, max_ban_seconds, now=None, limit=200):
+    """任务当前仍在封禁期内的IP，按IP合并
+
+    Returns:
+        [{'ip', 'banned_at', 'window_seconds', 'ban_minutes', 'expires_at', 'records'}]，
+        banned_at 为UTC时间字符串，expires_at 为UNIX时间戳
+    """
+    now = now or datetime.utcnow()
+    events = query_rate_limit_events(db, task_pk, since=now - timedelta(seconds=max_ban_seconds), limit=limit)
+    bans = OrderedDict()
+    for event in events:
+        expires = event.created_at + timedelta(seconds=event.ban_seconds or 0)
+        if expires <= now:
+            continue
+        ban = bans.get(event.client_ip)
+        if ban:
+            ban['records'] += 1
+            continue
+        bans[event.client_ip] = {
+            'ip': event.client_ip,
+            'banned_at': event.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'window_seconds': event.window_seconds,
+            'ban_minutes': (event.ban_seconds or 0) // 60,
+            # created_at 为UTC的naive时间
+            'expires_at': int((expires - datetime(1970, 1, 1)).total_seconds()),
+            'records': 1
+        }
+    return list(bans.values())
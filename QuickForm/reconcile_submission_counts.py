@@ -0,0 +1,76 @@
+"""
+修复任务提交计数（task.submission_count / task.last_submitted_at）与submission表之间的偏差
+支持SQLite和MySQL两种数据库（与应用相同：配置了MySQL环境变量则使用MySQL，否则使用SQLite）
+
+用法: python reconcile_submission_counts.py [--dry-run]
+"""
+import os
+import sys
+import argparse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+
+QUICKFORM_DIR = os.path.dirname(os.path.abspath(__file__))
+if QUICKFORM_DIR not in sys.path:
+    sys.path.insert(0, QUICKFORM_DIR)
+
+from models import migrate_database
+from submission_service import reconcile_submission_counts
+
+# 加载环境变量
+project_root = os.path.dirname(QUICKFORM_DIR)
+env_path = os.path.join(project_root, '.env')
+if os.path.exists(env_path):
+    load_dotenv(env_path)
+else:
+    load_dotenv()
+
+SQLITE_DB_PATH = os.path.join(QUICKFORM_DIR, 'quickform.db')
+
+MYSQL_HOST = os.getenv('MYSQL_HOST', '')
+MYSQL_PORT = os.getenv('MYSQL_PORT', '3306')
+MYSQL_USER = os.getenv('MYSQL_USER', '')
+MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
+MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'quickform')
+
+
+def get_database_url():
+    if MYSQL_HOST and MYSQL_USER and MYSQL_PASSWORD:
+        return f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}?charset=utf8mb4'
+    return f'sqlite:///{SQLITE_DB_PATH}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='修复任务提交计数偏差')
+    parser.add_argument('--dry-run', action='store_true', help='只报告偏差，不写入数据库')
+    args = parser.parse_args()
+
+    database_url = get_database_url()
+    print("=" * 60)
+    print("修复任务提交计数" + ("（仅检查）" if args.dry_run else ""))
+    print(f"数据库: {database_url.split('@')[-1]}")
+    print("=" * 60)
+
+    engine = create_engine(database_url, pool_pre_ping=True)
+    # 确保计数字段已存在
+    migrate_database(engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        drift = reconcile_submission_counts(db, dry_run=args.dry_run)
+    finally:
+        db.close()
+
+    if not drift:
+        print("\n✓ 所有任务的提交计数均与实际数据一致")
+    else:
+        print(f"\n发现 {len(drift)} 个任务的计数存在偏差：")
+        for task_pk, stored, actual in drift:
+            print(f"  任务ID {task_pk}: 记录 {stored} 条，实际 {actual:,} 条")
+        if not args.dry_run:
+            print("\n✓ 已修复")
+    print("\n" + "=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,49 +3,80 @@ import os
 import io
 import re
 import urllib.parse
-import threading
+import time
 import logging
 from datetime import datetime
-from functools import wraps
 from PIL import Image, ImageDraw, ImageFont
 
+from job_state_service import build_job_state_store
+
 logger = logging.getLogger(__name__)
 
-# 用于存储分析任务进度的字典
-analysis_progress = {}
-analysis_results = {}
-completed_reports = set()
-progress_lock = threading.Lock()
+# 分析任务的进度与结果（按任务主键），按TTL和条数上限淘汰；多进程部署时设置为sqlite后端共享
+JOB_STATE_BACKEND = os.getenv('QUICKFORM_JOB_STATE_BACKEND', 'memory')
+JOB_STATE_DB = os.getenv('QUICKFORM_JOB_STATE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job_state.db'))
+JOB_STATE_TTL = int(os.getenv('QUICKFORM_JOB_STATE_TTL', '600'))
+JOB_STATE_RUNNING_TTL = int(os.getenv('QUICKFORM_JOB_STATE_RUNNING_TTL', '3600'))
+JOB_STATE_MAX_ENTRIES = int(os.getenv('QUICKFORM_JOB_STATE_MAX_ENTRIES', '1000'))
 
+analysis_state = build_job_state_store(
+    JOB_STATE_BACKEND, ttl=JOB_STATE_TTL, running_ttl=JOB_STATE_RUNNING_TTL,
+    max_entries=JOB_STATE_MAX_ENTRIES, sqlite_path=JOB_STATE_DB
+)
 
-def timeout(seconds, error_message="函数执行超时"):
-    """超时装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            result = [None]
-            exception = [None]
-            
-            def target():
-                try:
-                    result[0] = func(*args, **kwargs)
-                except Exception as e:
-                    exception[0] = e
-            
-            thread = threading.Thread(target=target)
-            thread.daemon = True
-            thread.start()
-            thread.join(seconds)
-            
-            if thread.is_alive():
-                raise TimeoutError(error_message)
-            elif exception[0]:
-                raise exception[0]
-            else:
-                return result[0]
-        
-        return wrapper
-    return decorator
+
+STREAM_EMIT_INTERVAL = 0.2  # 流式输出合并推送的间隔（秒）
+
+
+class ReportStream:
+    """累积AI流式输出的文本：按间隔合并后推送给任务所有者，并写入进度供轮询读取
+
+    推送的事件为 report_delta {task_id, offset, text}，offset 为 text 在完整报告中的起始位置，
+    前端据此拼接（重复或乱序的片段可直接按位置覆盖）。
+    """
+
+    def __init__(self, task_id, user_id, emit_func=None, interval=STREAM_EMIT_INTERVAL):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.emit_func = emit_func
+        self.interval = interval
+        self.parts = []
+        self.length = 0
+        self.sent = 0  # 已推送的字符数
+        self.pending = []
+        self.last_flush = 0.0
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+
+    def add(self, text):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            logger.info(f"任务 {self.task_id} 收到首个输出，耗时 {self.first_token_at - self.started_at:.2f} 秒")
+        self.parts.append(text)
+        self.pending.append(text)
+        self.length += len(text)
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        offset = self.sent
+        self.pending = []
+        self.sent += len(text)
+        self.last_flush = time.monotonic()
+        analysis_state.update(self.task_id, {'partial': ''.join(self.parts), 'message': '大模型正在输出报告...'},
+                              if_match={'status': 'in_progress'})
+        self.emit('report_delta', {'task_id': self.task_id, 'offset': offset, 'text': text})
+
+    def emit(self, event, data):
+        if not self.emit_func:
+            return
+        try:
+            self.emit_func(self.user_id, event, data)
+        except Exception as e:
+            logger.warning(f"推送任务 {self.task_id} 的报告输出失败: {str(e)}")
 
 
 def save_analysis_report(task_id, report_content, SessionLocal, Task, upload_folder):
@@ -133,9 +164,6 @@ def save_analysis_report(task_id, report_content, SessionLocal, Task, upload_fol
             task.report_generated_at = datetime.now()
             db.commit()
             
-            with progress_lock:
-                completed_reports.add(task_id)
-            
             logger.info(f"任务 {task_id} 的分析报告已保存")
     except Exception as e:
         logger.error(f"保存分析报告失败: {str(e)}")
@@ -302,101 +330,112 @@ def generate_report_image(task, report_content):
 def perform_analysis_with_custom_prompt(task_id, user_id, ai_config_id, custom_prompt, 
                                          SessionLocal, Task, Submission, AIConfig,
                                          read_file_content_func, call_ai_model_func, 
-                                         save_analysis_report_func):
-    """使用自定义提示词执行分析任务"""
+                                         save_analysis_report_func, stream_ai_model_func=None, emit_func=None):
+    """使用自定义提示词执行分析任务
+
+    传入 stream_ai_model_func 时以流式方式调用模型，输出通过 emit_func(user_id, event, data) 实时推送，
+    完成或失败时分别推送 report_completed / report_error。
+    """
     import traceback
     import logging
     
     db = SessionLocal()
+    stream = None
     try:
         task = db.query(Task).filter_by(id=task_id, user_id=user_id).first()
         if not task:
-            with progress_lock:
-                analysis_progress[task_id] = {
-                    'status': 'error',
-                    'message': '任务不存在'
-                }
+            analysis_state.set(task_id, {
+                'status': 'error',
+                'message': '任务不存在'
+            })
             return
         
-        submission = db.query(Submission).filter_by(task_id=task_id).all()
-        
         file_content = None
         if task.file_path and os.path.exists(task.file_path):
             file_content = read_file_content_func(task.file_path)
         
         ai_config = db.query(AIConfig).filter_by(id=ai_config_id).first()
         if not ai_config:
-            with progress_lock:
-                analysis_progress[task_id] = {
-                    'status': 'error',
-                    'message': 'AI配置不存在'
-                }
+            analysis_state.set(task_id, {
+                'status': 'error',
+                'message': 'AI配置不存在'
+            })
             return
         
         if ai_config.selected_model == 'deepseek' and not ai_config.deepseek_api_key:
-            with progress_lock:
-                analysis_progress[task_id] = {
-                    'status': 'error',
-                    'message': 'DeepSeek API密钥未配置'
-                }
+            analysis_state.set(task_id, {
+                'status': 'error',
+                'message': 'DeepSeek API密钥未配置'
+            })
             logging.error(f"任务 {task_id}：DeepSeek API密钥未配置")
             return
         elif ai_config.selected_model == 'doubao' and not ai_config.doubao_api_key:
-            with progress_lock:
-                analysis_progress[task_id] = {
-                    'status': 'error',
-                    'message': '豆包API密钥未配置完整'
-                }
+            analysis_state.set(task_id, {
+                'status': 'error',
+                'message': '豆包API密钥未配置完整'
+            })
             logging.error(f"任务 {task_id}：豆包API密钥未配置完整")
             return
         
         logging.info(f"任务 {task_id}：使用模型 {ai_config.selected_model}")
         
-        with progress_lock:
-            analysis_progress[task_id] = {
-                'status': 'in_progress',
-                'progress': 0,
-                'message': '正在生成提示词...'
-            }
+        analysis_state.set(task_id, {
+            'status': 'in_progress',
+            'progress': 0,
+            'message': '正在生成提示词...'
+        })
         
         prompt = custom_prompt
         
-        with progress_lock:
-            analysis_progress[task_id] = {
-                'status': 'in_progress',
-                'progress': 1,
-                'message': '大模型分析中，这可能需要几分钟时间...'
-            }
+        analysis_state.set(task_id, {
+            'status': 'in_progress',
+            'progress': 1,
+            'message': '大模型分析中，这可能需要几分钟时间...'
+        })
         logging.info(f"任务 {task_id}：调用AI模型进行分析")
         
         # 调整各模型超时，避免后端刚返回而前端已判定超时的情况
         timeout_seconds = 180 if ai_config.selected_model == 'chat_server' else (120 if ai_config.selected_model in ['deepseek', 'qwen'] else 90)
         
-        @timeout(seconds=timeout_seconds, error_message=f"调用{ai_config.selected_model}模型超时（{timeout_seconds}秒）")
-        def call_ai_with_timeout(prompt, config):
-            logging.info(f"开始调用 {config.selected_model} API，提示词长度: {len(prompt)} 字符，超时设置: {timeout_seconds}秒")
-            return call_ai_model_func(prompt, config)
+        stream = ReportStream(task_id, user_id, emit_func) if stream_ai_model_func else None
+        
+        def report_wait(ahead, eta):
+            # 同一API密钥的请求过多时在准入控制中排队，把排队进度显示给用户
+            analysis_state.update(task_id, {
+                'message': f'AI服务繁忙，排队中：前面还有 {ahead} 个请求，预计等待 {eta} 秒...'
+            }, if_match={'status': 'in_progress'})
         
         try:
-            analysis_report = call_ai_with_timeout(prompt, ai_config)
+            # 超时由HTTP读取超时（非流式）和流式输出的截止时间控制，在当前线程内结束，不另起线程
+            logging.info(f"开始调用 {ai_config.selected_model} API，提示词长度: {len(prompt)} 字符，超时设置: {timeout_seconds}秒")
+            if stream:
+                analysis_report = stream_ai_model_func(prompt, ai_config, stream.add, timeout=timeout_seconds,
+                                                       on_wait=report_wait)
+                stream.flush()
+            else:
+                analysis_report = call_ai_model_func(prompt, ai_config, on_wait=report_wait)
             logging.info(f"成功获取 {ai_config.selected_model} API 响应，报告长度: {len(analysis_report)} 字符")
         except TimeoutError as timeout_error:
             error_msg = str(timeout_error)
             logging.error(f"任务 {task_id}：{error_msg}")
-            with progress_lock:
-                analysis_progress[task_id] = {
-                    'status': 'error',
-                    'message': f"分析超时：{error_msg}，请检查网络连接或稍后重试"
-                }
+            message = f"分析超时：{error_msg}，请检查网络连接或稍后重试"
+            analysis_state.set(task_id, {
+                'status': 'error',
+                'message': message
+            })
+            if stream:
+                stream.emit('report_error', {'task_id': task_id, 'message': message})
             return
         except Exception as api_error:
             logging.error(f"任务 {task_id}：AI模型调用失败: {str(api_error)}")
             logging.error(f"详细错误堆栈: {traceback.format_exc()}")
-            with progress_lock:
-                analysis_progress[task_id] = {
-                    'status': 'error',
-                    'message': f'API调用失败: {str(api_error)}'
-                }
+            message = f'API调用失败: {str(api_error)}'
+            analysis_state.set(task_id, {
+                'status': 'error',
+                'message': message
+            })
+            if stream:
+                stream.emit('report_error', {'task_id': task_id, 'message': message})
             return
         
         if analysis_report.startswith("错误：") or \
@@ -405,18 +444,16 @@ def perform_analysis_with_custom_prompt(task_id, user_id, ai_config_id, custom_p
             logging.error(f"任务 {task_id}：AI模型返回错误: {analysis_report}")
             raise Exception(analysis_report)
         
-        with progress_lock:
-            # 先保存到内存，确保状态查询能立即获取
-            analysis_results[task_id] = analysis_report
-            analysis_progress[task_id] = {
-                'status': 'completed',
-                'progress': 100,
-                'message': '分析完成，请查看报告',
-                'report': analysis_report  # 直接包含在progress中，确保前端能获取
-            }
-            logger.info(f"任务 {task_id} 报告已保存到内存，长度: {len(analysis_report)} 字符")
+        # 先写入任务状态，确保状态查询能立即获取
+        analysis_state.set(task_id, {
+            'status': 'completed',
+            'progress': 100,
+            'message': '分析完成，请查看报告',
+            'report': analysis_report  # 直接包含在状态中，确保前端能获取
+        })
+        logger.info(f"任务 {task_id} 报告已写入任务状态，长度: {len(analysis_report)} 字符")
         
-        # 保存到数据库（在锁外执行，避免阻塞状态查询）
+        # 保存到数据库
         try:
             # 获取upload_folder路径
             quickform_dir = os.path.dirname(os.path.abspath(__file__))
@@ -426,13 +463,17 @@ def perform_analysis_with_custom_prompt(task_id, user_id, ai_config_id, custom_p
         except Exception as e:
             logger.error(f"保存报告到数据库失败 - Task ID: {task_id}, 错误: {str(e)}")
             # 即使数据库保存失败，内存中已有报告，不影响用户查看
+        if stream:
+            # 报告入库后再通知，前端刷新页面时能读到新报告
+            stream.emit('report_completed', {'task_id': task_id, 'report': analysis_report})
             
     except Exception as e:
-        with progress_lock:
-            analysis_progress[task_id] = {
-                'status': 'error',
-                'message': f'分析过程中出错: {str(e)}'
-            }
+        analysis_state.set(task_id, {
+            'status': 'error',
+            'message': f'分析过程中出错: {str(e)}'
+        })
+        if stream:
+            stream.emit('report_error', {'task_id': task_id, 'message': f'分析过程中出错: {str(e)}'})
     finally:
         db.close()
 
@@ -0,0 +1,693 @@
+"""提交写入服务 - 批量合并表单提交，减少数据库事务次数
+
+请求线程只负责把已校验的提交追加到本地落盘文件（spool）并fsync，随即返回成功；
+后台写入线程按批量大小/最大等待时间，将多条提交合并到一个事务中写库。
+每个落盘文件在数据库中有一条检查点（SubmissionSpoolCheckpoint），与批量插入在同一事务内更新，
+进程崩溃后重启时只回放检查点之后的记录，保证已确认的提交不丢失、不重复。
+"""
+import os
+import time
+import base64
+import hashlib
+import uuid
+import queue
+import atexit
+import threading
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert, update, select, func, case, or_
+from sqlalchemy.exc import IntegrityError
+
+import json_codec
+from models import Task, Submission, SubmissionSpoolCheckpoint
+from field_stats_service import apply_field_stats
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.spool'
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _try_lock(f):
+        """非阻塞地独占锁定文件，用于判断落盘文件的所属进程是否仍存活"""
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+else:
+    import fcntl
+
+    def _try_lock(f):
+        """非阻塞地独占锁定文件，用于判断落盘文件的所属进程是否仍存活"""
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+
+class SubmissionWriter:
+    """批量提交写入器（write-behind）
+
+    Args:
+        SessionLocal: 数据库会话工厂
+        spool_dir: 落盘文件目录
+        batch_size: 单个事务最多写入的提交条数
+        max_latency: 攒批的最长等待时间（秒）
+        fsync: 确认提交前是否fsync落盘文件（关闭后断电可能丢失最近的提交）
+        spool_max_bytes: 落盘文件超过该大小且全部入库后轮换
+    """
+
+    def __init__(self, SessionLocal, spool_dir, batch_size=200, max_latency=0.05,
+                 fsync=True, spool_max_bytes=16 * 1024 * 1024):
+        self.SessionLocal = SessionLocal
+        self.spool_dir = spool_dir
+        self.batch_size = max(1, int(batch_size))
+        self.max_latency = max(0.0, float(max_latency))
+        self.fsync = fsync
+        self.spool_max_bytes = spool_max_bytes
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()        # 保护落盘文件写入与序号分配
+        self._sync_lock = threading.Lock()   # 合并并发请求的fsync
+        self._committed_cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._spool = None
+        self._spool_name = None
+        self._seq = 0          # 已分配的最大序号
+        self._synced = 0       # 已fsync的最大序号
+        self._committed = 0    # 已入库的最大序号
+        self._stats = {'accepted': 0, 'committed': 0, 'batches': 0, 'dropped': 0, 'errors': 0}
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        """回放遗留落盘文件并启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._recover_orphans()
+        self._open_spool()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='quickform-submission-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info(
+            f"提交写缓冲已启动: batch_size={self.batch_size}, max_latency={self.max_latency * 1000:.0f}ms, "
+            f"fsync={self.fsync}, spool={self._spool_name}"
+        )
+
+    def stop(self, timeout=10):
+        """停止写入线程，尽量写完队列中的提交；未写完的部分留在落盘文件中，下次启动回放"""
+        if not self._thread:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        self._thread = None
+        with self._sync_lock, self._lock:
+            if self._spool and self._committed >= self._seq:
+                self._discard_spool()
+            elif self._spool:
+                self._spool.close()
+                self._spool = None
+
+    # ---------- 请求线程接口 ----------
+
+    def submit(self, task_pk, data_json, submitted_at=None, schema_fp=None):
+        """接收一条已校验（已规范化）的提交；返回时该提交已持久化到落盘文件"""
+        submitted_at = submitted_at or datetime.now()
+        with self._lock:
+            if self._spool is None:
+                raise RuntimeError('提交写缓冲未启动')
+            self._seq += 1
+            seq = self._seq
+            record = {
+                'seq': seq,
+                'task_id': task_pk,
+                'data': data_json,
+                'schema_fp': schema_fp,
+                'submitted_at': submitted_at.isoformat()
+            }
+            self._spool.write(json_codec.dumps(record) + '\n')
+            self._spool.flush()
+            self._stats['accepted'] += 1
+            # 在锁内入队，保证队列顺序与序号一致，检查点才能单调前进
+            self._queue.put((self._spool_name, seq, task_pk, data_json, submitted_at, schema_fp))
+        self._sync(seq)
+        return seq
+
+    def flush(self, timeout=None):
+        """等待调用前已接收的提交全部入库，返回是否在超时前完成"""
+        with self._lock:
+            target = self._seq
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._committed_cond:
+            while self._committed < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._committed_cond.wait(remaining)
+        return True
+
+    def stats(self):
+        """写缓冲运行指标"""
+        with self._lock:
+            data = dict(self._stats)
+            data['pending'] = self._seq - self._committed
+        data['avg_batch_size'] = round(data['committed'] / data['batches'], 2) if data['batches'] else 0
+        return data
+
+    def _sync(self, seq):
+        """组提交式fsync：并发请求中由一个线程完成fsync，其余线程复用其结果"""
+        if not self.fsync:
+            return
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                target = self._seq
+                fd = self._spool.fileno()
+            os.fsync(fd)
+            self._synced = target
+
+    # ---------- 后台写入 ----------
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    break
+                self._maybe_rotate()
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_with_retry(batch)
+
+    def _write_with_retry(self, batch):
+        """写入一批提交；数据库暂时不可用时退避重试，直到成功或进程退出"""
+        last_seq, count = batch[-1][1], len(batch)
+        pending = list(batch)
+        backoff = 0.5
+        while pending:
+            try:
+                try:
+                    self._write_batch(pending)
+                    pending = []
+                except IntegrityError:
+                    # 通常是任务在提交后被删除，逐条写入并丢弃失败的记录
+                    self._write_one_by_one(pending)
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                logger.error(f"批量写入提交失败，{backoff:.1f}s 后重试: {str(e)}")
+                if self._stopped.wait(backoff):
+                    # 进程正在退出，剩余记录保留在落盘文件中等待下次回放
+                    return
+                backoff = min(backoff * 2, 30)
+        self._mark_committed(last_seq, count)
+
+    def _write_batch(self, batch):
+        db = self.SessionLocal()
+        try:
+            db.execute(insert(Submission), [
+                {'task_id': task_pk, 'data': data_json, 'submitted_at': submitted_at, 'schema_fp': schema_fp}
+                for _, _, task_pk, data_json, submitted_at, schema_fp in batch
+            ])
+            checkpoints = {}
+            task_deltas = {}
+            task_payloads = {}
+            for spool_name, seq, task_pk, data_json, submitted_at, schema_fp in batch:
+                checkpoints[spool_name] = max(seq, checkpoints.get(spool_name, 0))
+                count, latest = task_deltas.get(task_pk, (0, submitted_at))
+                task_deltas[task_pk] = (count + 1, max(latest, submitted_at))
+                task_payloads.setdefault(task_pk, []).append(load_submission_data(data_json, schema_fp))
+            for task_pk, (count, latest) in task_deltas.items():
+                apply_submission_delta(db, task_pk, count, latest)
+                apply_field_stats(db, task_pk, task_payloads[task_pk])
+            for spool_name, seq in checkpoints.items():
+                _save_checkpoint(db, spool_name, seq)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_one_by_one(self, pending):
+        """逐条写入，成功或被丢弃的记录从 pending 中移除；其他异常向上抛出，剩余记录留待重试"""
+        while pending:
+            item = pending[0]
+            try:
+                self._write_batch([item])
+            except IntegrityError as e:
+                spool_name, seq, task_pk = item[0], item[1], item[2]
+                logger.warning(f"丢弃无法写入的提交（任务可能已删除） task={task_pk} seq={seq}: {str(e)}")
+                db = self.SessionLocal()
+                try:
+                    _save_checkpoint(db, spool_name, seq)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.close()
+                with self._lock:
+                    self._stats['dropped'] += 1
+            pending.pop(0)
+
+    def _mark_committed(self, seq, count):
+        with self._lock:
+            self._stats['committed'] += count
+            self._stats['batches'] += 1
+        with self._committed_cond:
+            self._committed = max(self._committed, seq)
+            self._committed_cond.notify_all()
+
+    # ---------- 落盘文件管理 ----------
+
+    def _open_spool(self):
+        self._spool_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.spool_dir, self._spool_name + SPOOL_SUFFIX)
+        self._spool = open(path, 'a+', encoding='utf-8')
+        _try_lock(self._spool)
+
+    def _discard_spool(self):
+        """删除已全部入库的落盘文件及其检查点（调用方持有 self._lock）"""
+        path = self._spool.name
+        name = self._spool_name
+        self._spool.close()
+        self._spool = None
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除落盘文件失败: {path}, 错误: {str(e)}")
+        _delete_checkpoint(self.SessionLocal, name)
+
+    def _maybe_rotate(self):
+        """空闲时轮换过大的落盘文件"""
+        with self._sync_lock, self._lock:
+            if not self._spool or self._committed < self._seq:
+                return
+            try:
+                size = os.path.getsize(self._spool.name)
+            except OSError:
+                return
+            if size < self.spool_max_bytes:
+                return
+            self._discard_spool()
+            self._open_spool()
+            self._synced = self._seq
+
+    def _recover_orphans(self):
+        """回放已退出进程遗留的落盘文件中尚未入库的提交"""
+        for filename in sorted(os.listdir(self.spool_dir)):
+            if not filename.endswith(SPOOL_SUFFIX):
+                continue
+            path = os.path.join(self.spool_dir, filename)
+            spool_name = filename[:-len(SPOOL_SUFFIX)]
+            try:
+                f = open(path, 'a+', encoding='utf-8')
+            except OSError:
+                continue
+            try:
+                if not _try_lock(f):
+                    continue  # 所属进程仍在运行
+                f.seek(0)
+                replayed = self._replay(spool_name, f)
+            except Exception as e:
+                logger.error(f"回放落盘文件失败: {path}, 错误: {str(e)}", exc_info=True)
+                f.close()
+                continue
+            f.close()
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"删除已回放的落盘文件失败: {path}, 错误: {str(e)}")
+            _delete_checkpoint(self.SessionLocal, spool_name)
+            if replayed:
+                logger.info(f"已从落盘文件 {filename} 回放 {replayed} 条提交")
+
+    def _replay(self, spool_name, f):
+        db = self.SessionLocal()
+        try:
+            checkpoint = db.get(SubmissionSpoolCheckpoint, spool_name)
+            last_seq = checkpoint.last_seq if checkpoint else 0
+        finally:
+            db.close()
+
+        replayed = 0
+        batch = []
+        for line in f:
+            try:
+                record = json_codec.loads(line)
+            except ValueError:
+                # 崩溃时写了一半的行，从未确认给客户端，直接忽略
+                continue
+            if record['seq'] <= last_seq:
+                continue
+            submitted_at = datetime.fromisoformat(record['submitted_at'])
+            data_json, schema_fp = record['data'], record.get('schema_fp')
+            if schema_fp is None:
+                # 旧版本写入的落盘记录没有指纹，回放时补做规范化
+                data_json, schema_fp = canonicalize_payload(data_json)
+            batch.append((spool_name, record['seq'], record['task_id'], data_json, submitted_at, schema_fp))
+            if len(batch) >= self.batch_size:
+                self._replay_batch(batch)
+                replayed += len(batch)
+                batch = []
+        if batch:
+            self._replay_batch(batch)
+            replayed += len(batch)
+        return replayed
+
+    def _replay_batch(self, batch):
+        try:
+            self._write_batch(batch)
+        except IntegrityError:
+            self._write_one_by_one(list(batch))
+
+
+def apply_submission_delta(db, task_pk, delta, last_submitted_at=None):
+    """在当前事务中调整任务的提交计数；新增提交时同时推进最后提交时间"""
+    values = {'submission_count': func.coalesce(Task.submission_count, 0) + delta}
+    if last_submitted_at is not None:
+        values['last_submitted_at'] = case(
+            (or_(Task.last_submitted_at.is_(None), Task.last_submitted_at < last_submitted_at), last_submitted_at),
+            else_=Task.last_submitted_at
+        )
+    db.execute(
+        update(Task).where(Task.id == task_pk).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def refresh_last_submitted_at(db, task_pk):
+    """删除提交后，在当前事务中按剩余数据重新计算最后提交时间"""
+    latest = (
+        select(func.max(Submission.submitted_at))
+        .where(Submission.task_id == task_pk)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Task).where(Task.id == task_pk).values(last_submitted_at=latest)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reconcile_submission_counts(db, dry_run=False):
+    """以submission表为准修复任务提交计数的偏差
+
+    Returns:
+        list: [(任务主键, 原计数, 实际计数), ...]
+    """
+    actual = {
+        row.task_id: (row.cnt, row.latest)
+        for row in db.query(
+            Submission.task_id,
+            func.count(Submission.id).label('cnt'),
+            func.max(Submission.submitted_at).label('latest')
+        ).group_by(Submission.task_id)
+    }
+    drift = []
+    for task in db.query(Task.id, Task.submission_count, Task.last_submitted_at).all():
+        count, latest = actual.get(task.id, (0, None))
+        if task.submission_count == count and task.last_submitted_at == latest:
+            continue
+        drift.append((task.id, task.submission_count, count))
+        if not dry_run:
+            # 用相关子查询在单条语句内重算，避免与并发写入之间的竞争
+            db.execute(
+                update(Task).where(Task.id == task.id).values(
+                    submission_count=select(func.count(Submission.id)).where(Submission.task_id == task.id).scalar_subquery(),
+                    last_submitted_at=select(func.max(Submission.submitted_at)).where(Submission.task_id == task.id).scalar_subquery()
+                ).execution_options(synchronize_session=False)
+            )
+    if not dry_run:
+        db.commit()
+    return drift
+
+
+RAW_SCHEMA_FP = 'raw'  # 无法解析为JSON的旧数据，规范化时原样保留
+
+# 字段值类型在指纹中的标记
+_TYPE_TAGS = ((bool, 'b'), ((int, float), 'n'), (str, 's'), (list, 'l'), (dict, 'o'))
+
+
+def _type_tag(value):
+    if value is None:
+        return 'z'
+    for types, tag in _TYPE_TAGS:
+        if isinstance(value, types):
+            return tag
+    return 'x'
+
+
+def schema_fingerprint(data):
+    """字段结构指纹：字段名（排序后）与值类型的摘要，字段顺序不同但结构相同的提交指纹相同"""
+    if isinstance(data, dict):
+        raw = '|'.join(f"{key}:{_type_tag(data[key])}" for key in sorted(data))
+    else:
+        raw = f"<{_type_tag(data)}>"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def canonicalize_payload(payload):
+    """把提交数据规范化为紧凑JSON并计算结构指纹，写入时调用一次
+
+    payload 可以是已解析的对象或JSON文本；会解开双重编码（JSON字符串中又包了一层JSON）。
+
+    Returns:
+        (data_json, schema_fp)；文本无法解析为JSON时返回 (原文, RAW_SCHEMA_FP)
+    """
+    data = payload
+    if isinstance(payload, (str, bytes)):
+        try:
+            data = json_codec.loads(payload)
+        except ValueError:
+            return payload, RAW_SCHEMA_FP
+    if isinstance(data, str):
+        try:
+            data = json_codec.loads(data)
+        except ValueError:
+            pass
+    return json_codec.dumps(data), schema_fingerprint(data)
+
+
+def load_submission_data(raw_data, schema_fp=None):
+    """解析提交数据为字典，无法解析或不是对象时返回None
+
+    已规范化的数据（schema_fp不为空）只需一次json.loads；旧数据兼容双重编码。
+    """
+    if schema_fp == RAW_SCHEMA_FP:
+        return None
+    try:
+        data = json_codec.loads(raw_data)
+        if not schema_fp and isinstance(data, str):
+            data = json_codec.loads(data)
+    except (ValueError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def decode_submission(raw_data, submitted_at, schema_fp=None):
+    """解析一条提交数据并附加格式化的提交时间；解析失败时以raw_data返回原文"""
+    submitted_str = submitted_at.strftime('%Y-%m-%d %H:%M:%S')
+    data = load_submission_data(raw_data, schema_fp)
+    if data is None:
+        return {'submitted_at': submitted_str, 'raw_data': raw_data}
+    data['submitted_at'] = submitted_str
+    return data
+
+
+def submission_json(raw_data, submitted_at, schema_fp=None):
+    """返回一条提交的JSON文本（与decode_submission结果等价）
+
+    已规范化的对象直接在存储的JSON末尾拼接submitted_at，不做解析和重新编码。
+    """
+    if (schema_fp and schema_fp != RAW_SCHEMA_FP and raw_data.startswith('{')
+            and '"submitted_at"' not in raw_data):
+        submitted = '"submitted_at":"' + submitted_at.strftime('%Y-%m-%d %H:%M:%S') + '"'
+        if raw_data == '{}':
+            return '{' + submitted + '}'
+        return raw_data[:-1] + ',' + submitted + '}'
+    return json_codec.dumps(decode_submission(raw_data, submitted_at, schema_fp))
+
+
+def normalize_submissions(db, batch_size=1000, dry_run=False):
+    """回填：把尚未规范化（schema_fp为空）的提交改写为紧凑JSON并计算指纹
+
+    按主键分批处理，每批一个事务，可中断后重新执行。
+
+    Returns:
+        (处理条数, 内容有变化的条数, 无法解析的条数)
+    """
+    scanned = changed = unparsable = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(Submission.id, Submission.data)
+            .filter(Submission.schema_fp.is_(None), Submission.id > last_id)
+            .order_by(Submission.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            data_json, schema_fp = canonicalize_payload(row.data)
+            if data_json != row.data:
+                changed += 1
+            if schema_fp == RAW_SCHEMA_FP:
+                unparsable += 1
+            updates.append({'id': row.id, 'data': data_json, 'schema_fp': schema_fp})
+        if not dry_run:
+            db.execute(update(Submission), updates)
+            db.commit()
+        scanned += len(rows)
+        last_id = rows[-1].id
+    return scanned, changed, unparsable
+
+
+def encode_cursor(submitted_at, submission_id):
+    """生成分页游标（对客户端不透明）"""
+    raw = f"{submitted_at.isoformat()}|{submission_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        ts, submission_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(ts), int(submission_id)
+    except Exception:
+        raise ValueError(f'无效的分页游标: {cursor}')
+
+
+def keyset_page(query, limit, cursor=None, before=None):
+    """按 (submitted_at, id) 倒序做键集分页，任意页的耗时与偏移量无关
+
+    Args:
+        query: 已按任务过滤、未排序的Submission查询
+        limit: 每页条数
+        cursor: 返回早于该游标的记录（下一页）
+        before: 返回晚于该游标的记录（上一页）
+
+    Returns:
+        tuple: (rows, next_cursor, prev_cursor)，没有更多数据时对应游标为None
+    """
+    if before:
+        ts, submission_id = decode_cursor(before)
+        # submitted_at >= ts 作为索引范围条件，OR条件只用于同一时间戳内按id区分
+        rows = (
+            query
+            .filter(Submission.submitted_at >= ts,
+                    or_(Submission.submitted_at > ts, Submission.id > submission_id))
+            .order_by(Submission.submitted_at.asc(), Submission.id.asc())
+            .limit(limit + 1)
+            .all()
+        )
+        has_newer = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        next_cursor = encode_cursor(rows[-1].submitted_at, rows[-1].id) if rows else None
+        prev_cursor = encode_cursor(rows[0].submitted_at, rows[0].id) if rows and has_newer else None
+        return rows, next_cursor, prev_cursor
+
+    if cursor:
+        ts, submission_id = decode_cursor(cursor)
+        query = query.filter(Submission.submitted_at <= ts,
+                             or_(Submission.submitted_at < ts, Submission.id < submission_id))
+    rows = (
+        query
+        .order_by(Submission.submitted_at.desc(), Submission.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].submitted_at, rows[-1].id) if rows and has_more else None
+    prev_cursor = encode_cursor(rows[0].submitted_at, rows[0].id) if rows and cursor else None
+    return rows, next_cursor, prev_cursor
+
+
+def count_task_submissions(db, task_pk):
+    """任务的提交数：读取与提交/删除在同一事务中维护的 Task.submission_count，读路径上不做 COUNT"""
+    return db.query(Task.submission_count).filter(Task.id == task_pk).scalar() or 0
+
+
+def fetch_submission_ranges(db, task_pk, ranges, total_count):
+    """按 (submitted_at, id) 正序取若干连续区间的提交，返回 [(位置, 行)]
+
+    先在索引 ix_submission_task_submitted 上只读id定位区间（后半部分的区间从末尾倒序定位，跳过的行更少），
+    再按id一次取出被选中行的数据。
+
+    Args:
+        ranges: [(起始位置, 条数)]，位置从0开始
+        total_count: 任务的提交数，用于决定从哪一端定位
+    """
+    base = db.query(Submission.id).filter(Submission.task_id == task_pk)
+    positions = {}
+    for start, limit in ranges:
+        if start * 2 >= total_count:
+            skip = max(0, total_count - start - limit)
+            ids = [row.id for row in (
+                base.order_by(Submission.submitted_at.desc(), Submission.id.desc())
+                .offset(skip).limit(limit).all()
+            )]
+            first = total_count - skip - len(ids)
+            ids.reverse()
+        else:
+            ids = [row.id for row in (
+                base.order_by(Submission.submitted_at, Submission.id)
+                .offset(start).limit(limit).all()
+            )]
+            first = start
+        for offset, submission_id in enumerate(ids):
+            positions[submission_id] = first + offset
+    if not positions:
+        return []
+    rows = (
+        db.query(Submission.id, Submission.data, Submission.schema_fp, Submission.submitted_at)
+        .filter(Submission.id.in_(list(positions)))
+        .all()
+    )
+    return sorted(((positions[row.id], row) for row in rows), key=lambda item: item[0])
+
+
+def _save_checkpoint(db, spool_name, seq):
+    checkpoint = db.get(SubmissionSpoolCheckpoint, spool_name)
+    if checkpoint:
+        checkpoint.last_seq = seq
+        checkpoint.updated_at = datetime.now()
+    else:
+        db.add(SubmissionSpoolCheckpoint(spool_name=spool_name, last_seq=seq, updated_at=datetime.now()))
+
+
+def _delete_checkpoint(SessionLocal, spool_name):
+    db = SessionLocal()
+    try:
+        db.query(SubmissionSpoolCheckpoint).filter_by(spool_name=spool_name).delete()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"删除落盘检查点失败: {spool_name}, 错误: {str(e)}")
+    finally:
+        db.close()
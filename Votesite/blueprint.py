@@ -26,6 +26,8 @@ import queue
 import atexit
 from sqlalchemy.orm import scoped_session, sessionmaker
 
+import json_codec  # QuickForm/json_codec.py，由 main.py 加入 sys.path
+
 # 获取VoteSite目录路径
 VOTESITE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -715,6 +717,11 @@ def init_votesite(app, login_manager_instance=None):
     
     app.config.setdefault('SQLALCHEMY_DATABASE_URI', f'sqlite:///{database_path}')
     app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    # JSON列（如Survey.option_limits）使用统一的编解码器
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+        'json_serializer': json_codec.dumps,
+        'json_deserializer': json_codec.loads
+    })
     app.config.setdefault('VOTESITE_ADMIN_GATE_KEY', 'wzkjgz')
     
     # 初始化SQLAlchemy
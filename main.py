@@ -44,14 +44,20 @@ quickform_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Quick
 if quickform_path not in sys.path:
     sys.path.insert(0, quickform_path)
 
+# 统一使用 QuickForm/json_codec 的JSON编解码（安装了orjson时自动启用），jsonify 也走同一实现
+from json_codec import CodecJSONProvider
+app.json = CodecJSONProvider(app)
+
 # 初始化Flask-Login（在主应用层面统一管理）
 from flask_login import LoginManager
 login_manager = LoginManager()
 login_manager.init_app(app)
 
 # 导入并注册QuickForm Blueprint
-from QuickForm.blueprint import quickform_bp, init_quickform
+from QuickForm.blueprint import quickform_bp, init_quickform, register_socketio as register_quickform_socketio
 init_quickform(app, login_manager, database_type=QUICKFORM_DATABASE_TYPE)
+# 注册 QuickForm 的 SocketIO 事件（智能分析报告的流式推送）
+register_quickform_socketio(socketio)
 # 在init之后导入User和SessionLocal
 from QuickForm.blueprint import SessionLocal, User as QuickFormUser
 